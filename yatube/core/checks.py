@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Кеш, видимый только своему процессу: сдвиг поколения в одном процессе
+# не доходит до остальных.
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register()
+def shared_cache_check(app_configs, **kwargs):
+    """Кеш страниц держится на поколениях, общих для всех процессов."""
+    backend = settings.CACHES['default']['BACKEND']
+    if backend not in LOCAL_CACHES:
+        return []
+    return [Warning(
+        f'Кеш {backend} у каждого процесса свой.',
+        hint='При нескольких воркерах веб-сервера изменения, сделанные '
+             'в одном, другие не увидят до конца TTL страниц, а ETag '
+             'и Last-Modified будут разными. Настройте общий кеш в '
+             'CACHES: FileBasedCache или Memcached.',
+        id='core.W001',
+    )]
@@ -0,0 +1,65 @@
+"""Чтение с реплик для лент и страницы поста.
+
+Реплики из settings.DATABASE_REPLICAS получают только чтения
+маршрутов REPLICA_READ_VIEWS; всё остальное, включая сессии и
+пользователя, читается из default. Кто только что писал (запись
+модели из REPLICA_STICKY_APPS за время запроса), получает cookie и
+следующие REPLICA_STICKY_SECONDS читает из default: свои изменения он
+видит сразу, даже если реплика отстаёт. Служебные записи вроде kvstore
+миниатюр на это не влияют. Страницы, кеш которых сброшен недавно
+REPLICA_MAX_LAG_SECONDS, читаются из default для всех (read_primary):
+иначе отстающая реплика попала бы в кеш под новым поколением.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+DEFAULT = 'default'
+STICKY_COOKIE = 'read_primary'
+
+
+class RoutingState:
+    __slots__ = ('replica_allowed', 'wrote')
+
+    def __init__(self):
+        self.replica_allowed = False
+        self.wrote = False
+
+
+# Состояние текущего запроса; вне запроса (команды, тесты) его нет,
+# и всё идёт в default.
+current = ContextVar('database_routing', default=None)
+
+
+def read_primary():
+    """До конца запроса читать только из default."""
+    state = current.get()
+    if state is not None:
+        state.replica_allowed = False
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = current.get()
+        if (state is None or not state.replica_allowed
+                or not settings.DATABASE_REPLICAS):
+            return DEFAULT
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = current.get()
+        if (state is not None
+                and model._meta.app_label in settings.REPLICA_STICKY_APPS):
+            state.wrote = True
+            state.replica_allowed = False
+        return DEFAULT
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии default: объекты с любой из них связаны.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема приходит на реплики вместе с данными.
+        return db not in settings.DATABASE_REPLICAS
@@ -0,0 +1,81 @@
+"""SQLite с настройками для работы под нагрузкой.
+
+- WAL: читатели не ждут писателя, писатель не ждёт читателей;
+- synchronous=NORMAL: в WAL это безопасно при сбое процесса,
+  fsync только на контрольных точках;
+- mmap и увеличенный кеш страниц: горячие индексы читаются из памяти;
+- busy_timeout: писатель ждёт блокировку, а не падает с
+  «database is locked»;
+- BEGIN IMMEDIATE для atomic(): блокировка записи берётся в начале
+  транзакции, и переход чтение → запись не упирается в SQLITE_BUSY,
+  который busy_timeout не лечит;
+- PRAGMA optimize раз в OPTIMIZE_INTERVAL и перед закрытием соединения.
+
+Соединения переиспользуются между запросами через CONN_MAX_AGE.
+Значения PRAGMA можно переопределить в OPTIONS['pragmas'].
+"""
+import time
+
+from django.db.backends.sqlite3 import base
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    # Байты: 256 МиБ.
+    'mmap_size': 256 * 1024 * 1024,
+    # Отрицательное значение — в КиБ: 64 МиБ.
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+    # Миллисекунды.
+    'busy_timeout': 5000,
+}
+# Секунды между PRAGMA optimize на одном соединении.
+OPTIMIZE_INTERVAL = 60 * 60
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        options = self.settings_dict['OPTIONS']
+        self.pragmas = {**PRAGMAS, **options.get('pragmas', {})}
+        params = super().get_connection_params()
+        params.pop('pragmas', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        self.optimized_at = time.monotonic()
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
+
+    def optimize(self):
+        """Обновляет статистику планировщика для таблиц, по которым
+        она устарела; обычно занимает миллисекунды. Блокировку не ждёт:
+        если база занята записью, статистика обновится в другой раз."""
+        self.optimized_at = time.monotonic()
+        self.connection.execute('PRAGMA busy_timeout = 0')
+        try:
+            self.connection.execute('PRAGMA optimize')
+        except base.Database.OperationalError:
+            pass
+        finally:
+            self.connection.execute(
+                f'PRAGMA busy_timeout = {self.pragmas["busy_timeout"]}')
+
+    def close_if_unusable_or_obsolete(self):
+        # Вызывается в конце каждого запроса: удобная точка, чтобы
+        # долгоживущее соединение иногда обновляло статистику.
+        if (self.connection is not None and not self.in_atomic_block
+                and time.monotonic() - self.optimized_at
+                > OPTIMIZE_INTERVAL):
+            self.optimize()
+        super().close_if_unusable_or_obsolete()
+
+    def _close(self):
+        if self.connection is not None and not self.in_atomic_block:
+            self.optimize()
+        super()._close()
@@ -0,0 +1,46 @@
+import sqlite3
+import time
+from contextlib import closing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def copy_database(source, target):
+    """Согласованный снимок source в target через backup API SQLite:
+    пишущие в source не блокируются, читающие target видят либо
+    прежнюю копию, либо новую целиком."""
+    with closing(sqlite3.connect(source)) as primary, \
+            closing(sqlite3.connect(target)) as replica:
+        primary.backup(replica)
+
+
+class Command(BaseCommand):
+    help = ('Замена репликации для локальной проверки чтения с реплик: '
+            'копирует базу default во все DATABASE_REPLICAS, однократно '
+            'или каждые --interval секунд. Только для SQLite.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Пауза между копиями; 0 — скопировать один раз.')
+
+    def handle(self, *args, **options):
+        databases = settings.DATABASES
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('DATABASE_REPLICAS пуст: запустите '
+                               'с YATUBE_REPLICA=1.')
+        if any('sqlite3' not in databases[alias]['ENGINE']
+               for alias in ['default', *settings.DATABASE_REPLICAS]):
+            raise CommandError('Команда копирует только базы SQLite.')
+        source = databases['default']['NAME']
+        while True:
+            for alias in settings.DATABASE_REPLICAS:
+                started = time.monotonic()
+                copy_database(source, databases[alias]['NAME'])
+                self.stdout.write(
+                    f'{alias}: скопировано за '
+                    f'{(time.monotonic() - started) * 1000:.0f} мс')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,66 @@
+import multiprocessing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import tasks
+from core.checks import LOCAL_CACHES
+
+DEFAULT_THREADS = 4
+# Секунды между опросами пустой очереди.
+DEFAULT_POLL = 1.0
+
+
+class Command(BaseCommand):
+    help = ('Выполняет фоновые задачи из очереди core.tasks: миниатюры, '
+            'сброс кеша, ленты подписок, счётчики, письма. Работает, '
+            'пока не прервут; при --once — пока есть готовые задачи.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=DEFAULT_THREADS,
+            help='Потоков в каждом процессе.')
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='Процессов-воркеров: задачи, упирающиеся в CPU '
+                 '(миниатюры), не делят один GIL.')
+        parser.add_argument('--poll', type=float, default=DEFAULT_POLL)
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить готовые задачи и выйти.')
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='Сначала вернуть в очередь задачи со статусом failed.')
+
+    def handle(self, *args, **options):
+        backend = settings.CACHES['default']['BACKEND']
+        if backend in LOCAL_CACHES:
+            raise CommandError(
+                f'Кеш {backend} у каждого процесса свой: задачи сбросили '
+                f'бы кеш только воркеру. Настройте общий кеш в CACHES.')
+        if options['retry_failed']:
+            self.stdout.write(
+                f'Возвращено в очередь: {tasks.retry_failed()}')
+        work = (options['threads'], options['poll'], options['once'])
+        if options['processes'] == 1:
+            self.report(*tasks.work(*work))
+            return
+        # Дочерние процессы открывают свои соединения с базой.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=tasks.work, args=work, daemon=True)
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.join()
+
+    def report(self, done, failed):
+        self.stdout.write(f'Выполнено задач: {done}, неудачно: {failed}')
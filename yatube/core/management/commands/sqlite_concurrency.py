@@ -0,0 +1,115 @@
+import os
+import random
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+# Режимы сравнения: стандартный бэкенд с новым соединением на каждый
+# запрос и настроенный с постоянным соединением.
+MODES = {
+    'default': {'ENGINE': 'django.db.backends.sqlite3', 'CONN_MAX_AGE': 0},
+    'tuned': {'ENGINE': 'core.db.sqlite3', 'CONN_MAX_AGE': 600},
+}
+SCHEMA = (
+    'CREATE TABLE bench_post (id INTEGER PRIMARY KEY, author_id INTEGER, '
+    'text TEXT, pub_date REAL)',
+    'CREATE INDEX bench_post_author ON bench_post (author_id, pub_date)',
+)
+AUTHORS = 100
+READ_SQL = ('SELECT id, text, pub_date FROM bench_post WHERE author_id = %s '
+            'ORDER BY pub_date DESC LIMIT 10')
+WRITE_SQL = ('INSERT INTO bench_post (author_id, text, pub_date) '
+             'VALUES (%s, %s, %s)')
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность SQLite со стандартными '
+            'настройками и с core.db.sqlite3 при одновременных чтениях '
+            '(как лента автора) и записях (как post_create в atomic).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--rows', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        for mode, overrides in MODES.items():
+            directory = tempfile.mkdtemp()
+            alias = f'concurrency_{mode}'
+            connections.databases[alias] = {
+                **overrides, 'NAME': os.path.join(directory, 'bench.db')}
+            connections.ensure_defaults(alias)
+            connections.prepare_test_settings(alias)
+            try:
+                self.prepare(alias, options['rows'])
+                result = self.run(alias, options)
+            finally:
+                connections[alias].close()
+                del connections[alias]
+                del connections.databases[alias]
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+                os.rmdir(directory)
+            seconds = options['seconds']
+            self.stdout.write(
+                f'{mode:<8} чтений {result["reads"] / seconds:8.0f}/с  '
+                f'записей {result["writes"] / seconds:7.0f}/с  '
+                f'ошибок блокировки {result["errors"]}')
+
+    def prepare(self, alias, rows):
+        connection = connections[alias]
+        with transaction.atomic(using=alias), connection.cursor() as cursor:
+            for sql in SCHEMA:
+                cursor.execute(sql)
+            cursor.executemany(WRITE_SQL, [
+                (index % AUTHORS, f'Пост {index}', index)
+                for index in range(rows)])
+        connection.close()
+
+    def run(self, alias, options):
+        counts = {'reads': 0, 'writes': 0, 'errors': 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['seconds']
+
+        def worker(write):
+            rng = random.Random()
+            connection = connections[alias]
+            done = errors = 0
+            while time.monotonic() < deadline:
+                try:
+                    if write:
+                        with transaction.atomic(using=alias), \
+                                connection.cursor() as cursor:
+                            cursor.execute(WRITE_SQL, (
+                                rng.randrange(AUTHORS), 'Новый пост',
+                                time.time()))
+                    else:
+                        with connection.cursor() as cursor:
+                            cursor.execute(
+                                READ_SQL, (rng.randrange(AUTHORS),))
+                            cursor.fetchall()
+                    done += 1
+                except OperationalError:
+                    errors += 1
+                # Конец «запроса»: так Django закрывает соединение
+                # при CONN_MAX_AGE = 0.
+                connection.close_if_unusable_or_obsolete()
+            connection.close()
+            with lock:
+                counts['writes' if write else 'reads'] += done
+                counts['errors'] += errors
+
+        threads = [
+            threading.Thread(target=worker, args=(write,))
+            for write in ([False] * options['readers']
+                          + [True] * options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return counts
@@ -0,0 +1,149 @@
+"""Метрики запросов в памяти процесса и их вывод в формате Prometheus.
+
+Каждый процесс сервера копит свои значения; Prometheus опрашивает
+процессы по отдельности и складывает ряды сам. Обновление — один
+захват блокировки на запрос, поэтому сбор можно не выключать.
+"""
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+
+# Верхние границы корзин гистограммы времени ответа, в секундах.
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNRESOLVED = '<unresolved>'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Замер текущего запроса: его пополняют обёртка SQL и таймер шаблонов.
+current = ContextVar('current_request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('request', 'queries', 'sql_seconds', 'render_seconds',
+                 'render_depth')
+
+    def __init__(self, request=None):
+        self.request = request
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.render_depth = 0
+
+
+class ViewMetrics:
+    __slots__ = ('buckets', 'count', 'seconds', 'queries', 'sql_seconds',
+                 'render_seconds', 'response_bytes', 'statuses')
+
+    def __init__(self):
+        # Последняя корзина — +Inf.
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.response_bytes = 0
+        self.statuses = defaultdict(int)
+
+
+_lock = threading.Lock()
+_views = defaultdict(ViewMetrics)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else UNRESOLVED
+
+
+def record(view, status, seconds, request_metrics, response_bytes):
+    with _lock:
+        metrics = _views[view]
+        metrics.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        metrics.count += 1
+        metrics.seconds += seconds
+        metrics.queries += request_metrics.queries
+        metrics.sql_seconds += request_metrics.sql_seconds
+        metrics.render_seconds += request_metrics.render_seconds
+        metrics.response_bytes += response_bytes
+        metrics.statuses[status] += 1
+
+
+def reset():
+    with _lock:
+        _views.clear()
+
+
+def snapshot():
+    """Копия метрик, чтобы не держать блокировку на время вывода."""
+    with _lock:
+        copies = {}
+        for view, metrics in _views.items():
+            copy = ViewMetrics()
+            for name in ViewMetrics.__slots__:
+                value = getattr(metrics, name)
+                setattr(copy, name, value.copy()
+                        if isinstance(value, (list, dict)) else value)
+            copies[view] = copy
+        return copies
+
+
+def escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def exposition():
+    """Текстовый формат Prometheus 0.0.4."""
+    views = snapshot()
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    family('yatube_requests_total', 'counter',
+           'Requests by URL name and status.')
+    for view, metrics in sorted(views.items()):
+        for status, count in sorted(metrics.statuses.items()):
+            lines.append(
+                f'yatube_requests_total{{view="{escape(view)}",'
+                f'status="{status}"}} {count}')
+
+    family('yatube_request_duration_seconds', 'histogram',
+           'Request latency by URL name.')
+    for view, metrics in sorted(views.items()):
+        label = f'view="{escape(view)}"'
+        total = 0
+        for bound, count in zip(LATENCY_BUCKETS, metrics.buckets):
+            total += count
+            lines.append(
+                f'yatube_request_duration_seconds_bucket{{{label},'
+                f'le="{bound}"}} {total}')
+        lines.append(
+            f'yatube_request_duration_seconds_bucket{{{label},'
+            f'le="+Inf"}} {metrics.count}')
+        lines.append(
+            f'yatube_request_duration_seconds_sum{{{label}}} '
+            f'{metrics.seconds}')
+        lines.append(
+            f'yatube_request_duration_seconds_count{{{label}}} '
+            f'{metrics.count}')
+
+    counters = (
+        ('yatube_sql_queries_total', 'queries',
+         'SQL queries executed by URL name.'),
+        ('yatube_sql_duration_seconds_total', 'sql_seconds',
+         'Time spent in SQL by URL name.'),
+        ('yatube_template_render_seconds_total', 'render_seconds',
+         'Time spent rendering templates by URL name.'),
+        ('yatube_response_bytes_total', 'response_bytes',
+         'Response body size by URL name (non-streaming responses).'),
+    )
+    for name, attribute, help_text in counters:
+        family(name, 'counter', help_text)
+        for view, metrics in sorted(views.items()):
+            lines.append(
+                f'{name}{{view="{escape(view)}"}} '
+                f'{getattr(metrics, attribute)}')
+    return '\n'.join(lines) + '\n'
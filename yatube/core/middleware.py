@@ -0,0 +1,120 @@
+import time
+from contextlib import ExitStack
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import Template
+
+from . import metrics, slow_queries
+from .db import routers
+
+
+def count_query(execute, sql, params, many, context):
+    """Обёртка выполнения SQL: число и время запросов текущего запроса;
+    медленные запросы уходят в журнал вместе с планом."""
+    request_metrics = metrics.current.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        request_metrics.queries += 1
+        request_metrics.sql_seconds += elapsed
+        slow_queries.check(
+            context['connection'], sql, params, many, elapsed,
+            metrics.view_name(request_metrics.request))
+
+
+def timed_render(render):
+    """Время рендера шаблонов верхнего уровня: include и вложенные
+    render_to_string уже входят во время внешнего шаблона."""
+    @wraps(render)
+    def wrapper(self, context=None, request=None):
+        request_metrics = metrics.current.get()
+        if request_metrics is None:
+            return render(self, context, request)
+        request_metrics.render_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            request_metrics.render_depth -= 1
+            if not request_metrics.render_depth:
+                request_metrics.render_seconds += (
+                    time.perf_counter() - started)
+    wrapper.timed = True
+    return wrapper
+
+
+def install_template_timer():
+    if not getattr(Template.render, 'timed', False):
+        Template.render = timed_render(Template.render)
+
+
+class MetricsMiddleware:
+    """Время ответа, SQL, рендер шаблонов и размер ответа по имени
+    маршрута. Ставится первым в MIDDLEWARE, чтобы мерить весь запрос."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_template_timer()
+
+    def __call__(self, request):
+        request_metrics = metrics.RequestMetrics(request)
+        token = metrics.current.set(request_metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(count_query))
+                response = self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        elapsed = time.perf_counter() - started
+        metrics.record(
+            metrics.view_name(request),
+            response.status_code,
+            elapsed,
+            request_metrics,
+            0 if response.streaming else len(response.content),
+        )
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """Разрешает чтение с реплик для маршрутов REPLICA_READ_VIEWS, если
+    пользователь недавно ничего не записывал, и ставит cookie после
+    записи. Ставится после AuthenticationMiddleware: сессия и
+    пользователь читаются из default."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = routers.RoutingState()
+        token = routers.current.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.current.reset(token)
+        if state.wrote:
+            response.set_cookie(
+                routers.STICKY_COOKIE, '1',
+                max_age=settings.REPLICA_STICKY_SECONDS, httponly=True)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (request.method not in ('GET', 'HEAD')
+                or request.resolver_match.view_name
+                not in settings.REPLICA_READ_VIEWS
+                or routers.STICKY_COOKIE in request.COOKIES):
+            return None
+        # Сессию и пользователя — из default до включения реплик:
+        # только что созданная сессия могла ещё не доехать.
+        request.user.is_authenticated
+        routers.current.get().replica_allowed = True
+        return None
@@ -0,0 +1,118 @@
+"""Журнал медленных SQL-запросов.
+
+Запрос дольше SLOW_QUERY_MS попадает в кольцевой буфер последних
+SLOW_QUERY_LOG_SIZE записей процесса и в логгер yatube.slow_queries:
+имя маршрута, параметры, кадры стека кода проекта и план запроса
+(EXPLAIN QUERY PLAN в SQLite, EXPLAIN в PostgreSQL). План снимается
+только для медленных запросов, быстрые проходят без накладных расходов.
+"""
+import logging
+import os
+import threading
+import traceback
+from collections import deque
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+logger = logging.getLogger('yatube.slow_queries')
+
+# Кадров кода проекта в записи, от внешнего к ближайшему к запросу.
+ORIGIN_DEPTH = 5
+# Длинные строковые параметры обрезаются.
+PARAM_LENGTH = 200
+# Свой код журнала и мидлвара метрик в стеке не показываются.
+OWN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_lock = threading.Lock()
+_entries = deque(maxlen=settings.SLOW_QUERY_LOG_SIZE)
+# Пока снимается план, обёртка не должна проверять сам EXPLAIN.
+_explaining = ContextVar('slow_query_explaining', default=False)
+
+
+def threshold():
+    return settings.SLOW_QUERY_MS / 1000
+
+
+def entries():
+    """Записи от новых к старым."""
+    with _lock:
+        return list(reversed(_entries))
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def origin():
+    """Кадры стека из файлов проекта, кроме самого журнала."""
+    frames = [
+        f'{os.path.relpath(frame.filename, settings.BASE_DIR)}:'
+        f'{frame.lineno} {frame.name}'
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(settings.BASE_DIR)
+        and not frame.filename.startswith(OWN_DIR)
+    ]
+    return frames[-ORIGIN_DEPTH:]
+
+
+def shorten(value):
+    if isinstance(value, (str, bytes)) and len(value) > PARAM_LENGTH:
+        return value[:PARAM_LENGTH] + '...'
+    return value
+
+
+def shorten_params(params):
+    if isinstance(params, dict):
+        return {name: shorten(value) for name, value in params.items()}
+    return [shorten(value) for value in params or ()]
+
+
+def explain(connection, sql, params):
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return []
+    token = _explaining.set(True)
+    # Точка сохранения нужна PostgreSQL: ошибка EXPLAIN прервала бы
+    # транзакцию запроса. В SQLite она не нужна, а atomic() вне
+    # транзакции начал бы BEGIN IMMEDIATE и ждал блокировку записи.
+    if connection.vendor == 'sqlite':
+        guard = nullcontext()
+    else:
+        guard = transaction.atomic(using=connection.alias)
+    try:
+        with guard, connection.cursor() as cursor:
+            cursor.execute(
+                f'{connection.ops.explain_query_prefix()} {sql}', params)
+            return [str(row[-1]) for row in cursor.fetchall()]
+    except DatabaseError as error:
+        return [f'План не получен: {error}']
+    finally:
+        _explaining.reset(token)
+
+
+def check(connection, sql, params, many, seconds, view):
+    """Записывает запрос, если он медленнее порога."""
+    if seconds < threshold() or _explaining.get():
+        return
+    if many:
+        # У executemany params — список наборов: план по первому.
+        params = next(iter(params), None)
+    entry = {
+        'time': timezone.now(),
+        'view': view,
+        'duration_ms': round(seconds * 1000, 3),
+        'sql': sql,
+        'params': shorten_params(params),
+        'origin': origin(),
+        'plan': explain(connection, sql, params),
+    }
+    with _lock:
+        _entries.append(entry)
+    logger.warning(
+        'Медленный запрос %.1f мс в %s: %s %r\nСтек: %s\nПлан: %s',
+        entry['duration_ms'], view, sql, entry['params'],
+        ' <- '.join(reversed(entry['origin'])), '; '.join(entry['plan']))
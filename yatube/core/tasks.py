@@ -0,0 +1,160 @@
+"""Фоновые задачи с надёжной очередью (outbox) в базе.
+
+task() помечает функцию задачей, func.delay(*args, **kwargs) ставит
+её строкой Task в текущей транзакции: задача появляется, только если
+запрос закоммитился, и не теряется при падении процесса. Аргументы —
+только JSON. Задачи выполняет manage.py run_workers: пул потоков,
+при --processes — в нескольких процессах.
+
+Неудачная попытка повторяется через BACKOFF_BASE * 2 ** (попытка - 1)
+секунд (не больше BACKOFF_MAX, со случайным разбросом); после
+max_attempts задача остаётся в базе со статусом failed. Задача с
+atomic=True выполняется в одной транзакции с удалением своей строки,
+и её изменения в базе применяются ровно один раз; остальные (письма,
+миниатюры) — хотя бы один раз.
+
+При TASKS_EAGER delay() просто вызывает функцию — как до очереди.
+"""
+import json
+import logging
+import random
+import time
+import traceback
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger('yatube.tasks')
+
+DEFAULT_MAX_ATTEMPTS = 5
+# Секунды.
+BACKOFF_BASE = 2
+BACKOFF_MAX = 600
+
+
+def task(max_attempts=DEFAULT_MAX_ATTEMPTS, atomic=True):
+    """Декоратор: функция остаётся обычной, delay ставит её в очередь."""
+    def decorator(func):
+        func.task_name = f'{func.__module__}.{func.__qualname__}'
+        func.max_attempts = max_attempts
+        func.atomic = atomic
+        func.delay = partial(enqueue, func)
+        return func
+    return decorator
+
+
+def enqueue(func, *args, **kwargs):
+    payload = json.dumps({'args': args, 'kwargs': kwargs})
+    if settings.TASKS_EAGER:
+        func(*args, **kwargs)
+        return
+    Task.objects.create(name=func.task_name, payload=payload)
+
+
+def backoff(attempt):
+    """Задержка перед повтором: половина — случайная, чтобы задачи,
+    упавшие вместе, не повторялись вместе."""
+    delay = min(BACKOFF_BASE * 2 ** (attempt - 1), BACKOFF_MAX)
+    return random.uniform(delay / 2, delay)
+
+
+def claim(limit):
+    """Захватывает до limit готовых задач, включая брошенные
+    упавшими воркерами (истёк locked_until)."""
+    now = timezone.now()
+    due = (Q(status=Task.PENDING, run_at__lte=now)
+           | Q(status=Task.RUNNING, locked_until__lt=now))
+    with transaction.atomic():
+        ready = Task.objects.select_for_update(skip_locked=True).filter(
+            due).order_by('run_at', 'id')
+        ids = list(ready.values_list('pk', flat=True)[:limit])
+        Task.objects.filter(pk__in=ids).update(
+            status=Task.RUNNING,
+            attempts=F('attempts') + 1,
+            locked_until=now + timedelta(
+                seconds=settings.TASK_LEASE_SECONDS),
+        )
+    return list(Task.objects.filter(pk__in=ids).order_by('run_at', 'id'))
+
+
+def fail(task, max_attempts, error):
+    if task.attempts >= max_attempts:
+        status, run_at = Task.FAILED, task.run_at
+    else:
+        status = Task.PENDING
+        run_at = timezone.now() + timedelta(seconds=backoff(task.attempts))
+    Task.objects.filter(pk=task.pk).update(
+        status=status, run_at=run_at, locked_until=None, last_error=error)
+
+
+def run(task):
+    """Выполняет захваченную задачу. Возвращает True при успехе."""
+    max_attempts = DEFAULT_MAX_ATTEMPTS
+    try:
+        func = import_string(task.name)
+        max_attempts = func.max_attempts
+        if task.attempts > max_attempts:
+            # Воркеры падали, не успев записать результат.
+            raise RuntimeError('Попытки исчерпаны.')
+        payload = json.loads(task.payload)
+        with transaction.atomic() if func.atomic else nullcontext():
+            func(*payload['args'], **payload['kwargs'])
+            Task.objects.filter(pk=task.pk).delete()
+    except Exception:
+        logger.exception('Задача %s #%s, попытка %s', task.name, task.pk,
+                         task.attempts)
+        fail(task, max_attempts, traceback.format_exc())
+        return False
+    return True
+
+
+def run_in_thread(task):
+    # Как в запросе: устаревшие и сломанные соединения потока
+    # закрываются до и после задачи.
+    close_old_connections()
+    try:
+        return run(task)
+    finally:
+        close_old_connections()
+
+
+def work(threads, poll, once=False):
+    """Цикл воркера: держит в работе до threads задач, новые
+    захватывает по мере освобождения потоков. once — выйти, когда
+    готовых задач не осталось. Возвращает (выполнено, неудачно)."""
+    done = failed = 0
+    running = set()
+    with ThreadPoolExecutor(threads, thread_name_prefix='task') as pool:
+        while True:
+            free = threads - len(running)
+            if free:
+                running.update(
+                    pool.submit(run_in_thread, task)
+                    for task in claim(free))
+            if not running:
+                if once:
+                    return done, failed
+                time.sleep(poll)
+                continue
+            finished, running = wait(
+                running, timeout=poll, return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future.result():
+                    done += 1
+                else:
+                    failed += 1
+
+
+def retry_failed():
+    """Возвращает задачи failed в очередь с новым запасом попыток."""
+    return Task.objects.filter(status=Task.FAILED).update(
+        status=Task.PENDING, attempts=0, run_at=timezone.now())
@@ -1,6 +1,33 @@
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
 from http import HTTPStatus
+from io import StringIO
 
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import cache as posts_cache
+from posts.models import AuthorStats, Follow, Group, Post, TimelineEntry
+
+from . import checks, metrics, slow_queries, tasks
+from .db import routers
+from .db.sqlite3.base import PRAGMAS
+from .management.commands.replicate_sqlite import copy_database
+from .models import Task
 # from pytest_django.asserts import assertTemplateUsed
 # from django.shortcuts import render
 
@@ -21,3 +48,311 @@ class ViewTestClass(TestCase):
         # return render(request, 'core/403csrf.html',
         #               {'path': request.path}, status=403)
     '''
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def test_metrics_staff_only(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        user = get_user_model().objects.create_user(username='reader')
+        self.client.force_login(user)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+
+    def test_request_recorded_by_url_name(self):
+        """Запрос к ленте попадает в гистограмму, счётчики SQL,
+        шаблонов и размера ответа под именем маршрута."""
+        self.client.get('/')
+        staff = get_user_model().objects.create_user(
+            username='staff', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        text = response.content.decode()
+        self.assertIn(
+            'yatube_requests_total{view="posts:index",status="200"} 1', text)
+        self.assertIn(
+            'yatube_request_duration_seconds_bucket{view="posts:index",'
+            'le="+Inf"} 1', text)
+        samples = dict(
+            line.rsplit(' ', 1) for line in text.splitlines()
+            if line.startswith('yatube_') and 'posts:index' in line)
+        for name in ('yatube_sql_queries_total',
+                     'yatube_template_render_seconds_total',
+                     'yatube_response_bytes_total'):
+            with self.subTest(metric=name):
+                self.assertGreater(
+                    float(samples[f'{name}{{view="posts:index"}}']), 0)
+
+
+@override_settings(SLOW_QUERY_MS=0)
+class SlowQueryLogTest(TestCase):
+    def setUp(self):
+        slow_queries.clear()
+
+    def test_slow_query_recorded_with_plan(self):
+        """При нулевом пороге каждый запрос ленты группы попадает
+        в журнал с маршрутом, параметрами, местом в posts.views и планом."""
+        Group.objects.create(title='Группа', slug='slow', description='')
+        with self.assertLogs('yatube.slow_queries', 'WARNING'):
+            self.client.get('/group/slow/')
+        entry = next(
+            entry for entry in slow_queries.entries()
+            if entry['sql'].startswith('SELECT "posts_group"'))
+        self.assertEqual(entry['view'], 'posts:group_list')
+        self.assertEqual(entry['params'], ['slow'])
+        self.assertTrue(any(
+            frame.startswith('posts/views.py') for frame in entry['origin']))
+        self.assertTrue(entry['plan'])
+
+        staff = get_user_model().objects.create_user(
+            username='staff', is_staff=True)
+        self.client.force_login(staff)
+        with self.assertLogs('yatube.slow_queries', 'WARNING'):
+            response = self.client.get('/slow-queries/')
+        self.assertContains(response, 'posts:group_list')
+
+    def test_explain_takes_no_lock(self):
+        """План в SQLite снимается без транзакции: медленное чтение
+        не ждёт блокировку записи."""
+        with CaptureQueriesContext(connection) as captured:
+            plan = slow_queries.explain(
+                connection, 'SELECT * FROM posts_post', [])
+        self.assertTrue(plan)
+        self.assertEqual(len(captured), 1)
+
+
+class SQLiteTuningTest(TestCase):
+    def test_pragmas_applied(self):
+        with connection.cursor() as cursor:
+            for name in ('synchronous', 'cache_size', 'busy_timeout'):
+                with self.subTest(pragma=name):
+                    cursor.execute(f'PRAGMA {name}')
+                    value = cursor.fetchone()[0]
+                    expected = {'synchronous': 1}.get(name, PRAGMAS[name])
+                    self.assertEqual(value, expected)
+
+    def test_concurrency_benchmark(self):
+        """Сравнение запускается на файловых базах и печатает оба режима."""
+        out = StringIO()
+        call_command('sqlite_concurrency', seconds=0.2, readers=2,
+                     writers=1, rows=100, stdout=out)
+        self.assertIn('default', out.getvalue())
+        self.assertIn('tuned', out.getvalue())
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_MAX_LAG_SECONDS=0)
+class ReplicaRouterTest(TransactionTestCase):
+    """Реплика здесь — второе соединение с той же тестовой базой:
+    данные всегда совпадают, проверяется только маршрутизация."""
+
+    def setUp(self):
+        connections.databases['replica'] = dict(
+            connections['default'].settings_dict)
+        self.addCleanup(self.drop_replica)
+        self.replica_queries = []
+        wrapper = connections['replica'].execute_wrapper(self.spy)
+        wrapper.__enter__()
+        self.addCleanup(wrapper.__exit__, None, None, None)
+        self.user = get_user_model().objects.create_user(username='reader')
+        Post.objects.create(author=self.user, text='Пост')
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def drop_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+
+    def spy(self, execute, sql, params, many, context):
+        self.replica_queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def test_feeds_read_from_replica(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(any('posts_post' in sql
+                            for sql in self.replica_queries))
+        # Сессия и пользователь — из default.
+        self.assertFalse(any('django_session' in sql
+                             for sql in self.replica_queries))
+
+    def test_writes_and_other_views_use_primary(self):
+        self.client.get('/create/')
+        self.assertEqual(self.replica_queries, [])
+
+    def test_reads_stick_to_primary_after_write(self):
+        """После записи пользователь получает cookie и на время окна
+        читает ленты из default."""
+        response = self.client.post('/create/', {'text': 'Новый пост'})
+        self.assertIn(routers.STICKY_COOKIE, response.cookies)
+        self.client.get('/')
+        self.assertEqual(self.replica_queries, [])
+
+        self.client.cookies.pop(routers.STICKY_COOKIE)
+        cache.clear()
+        self.client.get('/')
+        self.assertTrue(self.replica_queries)
+
+    @override_settings(REPLICA_MAX_LAG_SECONDS=60)
+    def test_fresh_generation_reads_primary(self):
+        """Пока поколение кеша моложе отставания реплики, страница
+        не читается с неё: иначе старые данные попали бы в кеш нового
+        поколения."""
+        self.client.logout()
+        self.client.get('/')
+        self.assertEqual(self.replica_queries, [])
+
+        cache.clear()
+        cache.set(posts_cache.GENERATION_KEY.format(posts_cache.FEED),
+                  time.time() - 60, timeout=None)
+        self.client.get('/')
+        self.assertTrue(self.replica_queries)
+
+
+class ReplicateSqliteTest(TestCase):
+    def test_copy_database(self):
+        """Замена репликации переносит в реплику согласованный снимок."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, 'primary.sqlite3')
+        target = os.path.join(directory, 'replica.sqlite3')
+        with closing(sqlite3.connect(source)) as primary:
+            primary.execute('CREATE TABLE post (text TEXT)')
+            primary.execute("INSERT INTO post VALUES ('Пост')")
+            primary.commit()
+        copy_database(source, target)
+        with closing(sqlite3.connect(target)) as replica:
+            self.assertEqual(
+                replica.execute('SELECT text FROM post').fetchall(),
+                [('Пост',)])
+
+
+@tasks.task(max_attempts=2)
+def failing_task():
+    raise ValueError('Сбой')
+
+
+@override_settings(TASKS_EAGER=False)
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        self.author = get_user_model().objects.create_user(username='author')
+
+    def test_post_side_effects_are_queued(self):
+        """Счётчики меняются не в запросе, а когда воркер выполнит
+        задачу; выполненная задача удаляется."""
+        Post.objects.create(author=self.author, text='Пост')
+        self.assertEqual(AuthorStats.objects.get(pk=self.author.pk)
+                         .posts_count, 0)
+        self.assertTrue(Task.objects.filter(
+            name='posts.counters.bump_author').exists())
+        for task in tasks.claim(Task.objects.count()):
+            self.assertTrue(tasks.run(task))
+        self.assertEqual(AuthorStats.objects.get(pk=self.author.pk)
+                         .posts_count, 1)
+        self.assertFalse(Task.objects.exists())
+
+    def test_password_reset_token_is_not_queued(self):
+        """В строке задачи нет ни токена, ни ссылки сброса: воркер
+        строит их сам, и ссылка из письма работает."""
+        self.author.email = 'author@example.com'
+        self.author.set_password('old-password')
+        self.author.save()
+        self.client.post(reverse('users:password_reset_form'),
+                         {'email': self.author.email})
+        task, = tasks.claim(1)
+        self.assertEqual(task.name, 'users.forms.send_password_reset')
+        self.assertNotIn('reset/', task.payload)
+        self.assertNotIn('token', task.payload)
+        self.assertTrue(tasks.run(task))
+
+        message, = mail.outbox
+        self.assertEqual(message.to, [self.author.email])
+        link = re.search(r'/auth/reset/\S+/\S+/', message.body).group()
+        response = self.client.get(link, follow=True)
+        self.assertTrue(response.context['validlink'])
+
+    def test_failed_task_is_retried_with_backoff(self):
+        failing_task.delay()
+        task, = tasks.claim(1)
+        with self.assertLogs('yatube.tasks', 'ERROR'):
+            self.assertFalse(tasks.run(task))
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.PENDING)
+        self.assertGreater(task.run_at, timezone.now())
+        self.assertIn('Сбой', task.last_error)
+        # До run_at задача не захватывается.
+        self.assertEqual(tasks.claim(1), [])
+
+        Task.objects.filter(pk=task.pk).update(run_at=timezone.now())
+        task, = tasks.claim(1)
+        with self.assertLogs('yatube.tasks', 'ERROR'):
+            self.assertFalse(tasks.run(task))
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.FAILED)
+        self.assertEqual(tasks.retry_failed(), 1)
+
+    def test_abandoned_task_is_reclaimed(self):
+        """Задачу упавшего воркера берёт другой, когда истекает захват."""
+        failing_task.delay()
+        task, = tasks.claim(1)
+        self.assertEqual(tasks.claim(1), [])
+        Task.objects.filter(pk=task.pk).update(locked_until=timezone.now())
+        self.assertEqual([task.pk for task in tasks.claim(1)], [task.pk])
+
+    def test_backoff_grows(self):
+        self.assertLessEqual(tasks.backoff(1), tasks.BACKOFF_BASE)
+        self.assertGreaterEqual(tasks.backoff(4), tasks.BACKOFF_BASE * 4)
+        self.assertLessEqual(tasks.backoff(100), tasks.BACKOFF_MAX)
+
+
+@override_settings(TASKS_EAGER=False)
+class RunWorkersTest(TransactionTestCase):
+    """Воркер работает в своих потоках: данные должны быть закоммичены.
+    Один поток: общая in-memory база SQLite тестов не ждёт блокировок."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        shared_cache = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': directory,
+        }})
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+
+    def test_refuses_process_local_cache(self):
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }}):
+            with self.assertRaises(CommandError):
+                call_command('run_workers', once=True, stdout=StringIO())
+
+    def test_run_workers_once(self):
+        User = get_user_model()
+        author = User.objects.create_user(username='author')
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=author)
+        Post.objects.create(author=author, text='Пост')
+        out = StringIO()
+        call_command('run_workers', threads=1, once=True, stdout=out)
+        self.assertIn('неудачно: 0', out.getvalue())
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(AuthorStats.objects.get(pk=author.pk).posts_count,
+                         1)
+        self.assertTrue(TimelineEntry.objects.filter(user=reader).exists())
+
+
+class SharedCacheCheckTest(SimpleTestCase):
+    def test_project_cache_is_shared(self):
+        self.assertEqual(checks.shared_cache_check(None), [])
+
+    def test_process_local_cache_warns(self):
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }}):
+            warnings = checks.shared_cache_check(None)
+        self.assertEqual([warning.id for warning in warnings], ['core.W001'])
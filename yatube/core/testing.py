@@ -0,0 +1,76 @@
+"""Бюджеты SQL-запросов для тестов представлений и выполнение
+колбэков on_commit в TestCase.
+
+Бюджет — наибольшее число запросов, которое представление может
+выполнить. Управляющие транзакциями команды (BEGIN, SAVEPOINT...)
+не считаются: в TestCase их больше, чем в настоящем запросе.
+При превышении в сообщение попадают повторяющиеся запросы — обычно
+это и есть N+1.
+"""
+import re
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test.utils import CaptureQueriesContext
+
+TRANSACTION_SQL = re.compile(
+    r'^\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b', re.IGNORECASE)
+# Литералы и числа: запросы, отличающиеся только ими, — одинаковые.
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def data_queries(captured):
+    return [query['sql'] for query in captured.captured_queries
+            if not TRANSACTION_SQL.match(query['sql'])]
+
+
+def duplicates(queries):
+    counts = Counter(LITERALS.sub('?', sql) for sql in queries)
+    return [(count, sql) for sql, count in counts.most_common()
+            if count > 1]
+
+
+def budget_report(name, budget, queries):
+    lines = [f'{name}: {len(queries)} запросов при бюджете {budget}.']
+    repeated = duplicates(queries)
+    if repeated:
+        lines.append('Повторяющиеся запросы:')
+        lines.extend(f'  {count} x {sql}' for count, sql in repeated)
+    else:
+        lines.append('Запросы:')
+        lines.extend(f'  {sql}' for sql in queries)
+    return '\n'.join(lines)
+
+
+class QueryBudgetMixin:
+    """Примесь к TestCase: assertQueryBudget выполняет func и падает,
+    если запросов больше бюджета. Возвращает результат func
+    и число запросов."""
+
+    def assertQueryBudget(self, name, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as captured:
+            result = func(*args, **kwargs)
+            if getattr(result, 'streaming', False):
+                for _ in result.streaming_content:
+                    pass
+        queries = data_queries(captured)
+        if len(queries) > budget:
+            self.fail(budget_report(name, budget, queries))
+        return result, len(queries)
+
+
+@contextmanager
+def run_on_commit(using=DEFAULT_DB_ALIAS):
+    """Выполняет колбэки on_commit, поставленные внутри блока, как
+    captureOnCommitCallbacks(execute=True) из Django 3.2: транзакция
+    TestCase не коммитится, и сами они не выполнятся."""
+    callbacks = connections[using].run_on_commit
+    start = len(callbacks)
+    try:
+        yield
+    finally:
+        # Колбэк может поставить следующие.
+        while len(callbacks) > start:
+            _, func = callbacks.pop(start)
+            func()
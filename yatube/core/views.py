@@ -1,5 +1,10 @@
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse
 from django.shortcuts import render
 
+from . import metrics, slow_queries
+
 
 def page_not_found(request, exception):
     # Переменная exception содержит отладочную информацию,
@@ -17,3 +22,19 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+@staff_member_required
+def prometheus_metrics(request):
+    """Метрики запросов этого процесса в формате Prometheus."""
+    return HttpResponse(
+        metrics.exposition(), content_type=metrics.CONTENT_TYPE)
+
+
+@staff_member_required
+def slow_query_log(request):
+    """Последние медленные SQL-запросы этого процесса с планами."""
+    return render(request, 'core/slow_queries.html', {
+        'entries': slow_queries.entries(),
+        'threshold': settings.SLOW_QUERY_MS,
+    })
@@ -1,9 +1,93 @@
 from django.contrib import admin
+from django.core.paginator import Page, Paginator
+from django.db import DatabaseError, connection
+from django.utils.functional import cached_property
 
+from . import search
 from .models import Group, Post, Comment
+from .utils import CURSOR_NEXT, CursorPaginator
 
+# Таблицы меньше этого размера (по статистике) считаются точно.
+EXACT_COUNT_LIMIT = 1000
+# С какой строки страницы читаются keyset-срезом, а не OFFSET.
+KEYSET_FROM = 200
 
-class PostAdmin(admin.ModelAdmin):
+
+def estimated_count(model):
+    """Число строк таблицы по статистике СУБД; None, если её нет.
+    Для SQLite статистику собирает ANALYZE."""
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+    elif connection.vendor == 'sqlite':
+        sql = ("SELECT CAST(stat AS INTEGER) FROM sqlite_stat1 "
+               "WHERE tbl = %s")
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            rows = [row[0] for row in cursor.fetchall() if row[0]]
+    except DatabaseError:
+        return None
+    return max(rows, default=None)
+
+
+class ScalablePaginator(Paginator):
+    """Пагинатор списка админки для больших таблиц.
+    Полный список большой таблицы считается по статистике СУБД, а не
+    COUNT(*); отфильтрованный и небольшой — точно.
+    Глубокие страницы при сортировке по ключу (дата, id) читаются
+    keyset-срезом: OFFSET проходит только по индексу ключа, строки
+    выбираются с границы страницы."""
+    date_field = None
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = estimated_count(self.object_list.model)
+            if estimate and estimate > EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+    def keyset_ordering(self):
+        ordering = (f'-{self.date_field}', '-id')
+        return tuple(self.object_list.query.order_by) in (
+            ordering, ordering + ('-pk',))
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        if (self.date_field is None or bottom < KEYSET_FROM
+                or not self.keyset_ordering()):
+            return super().page(number)
+        keys = self.object_list.values_list(self.date_field, 'id')
+        try:
+            boundary = keys[bottom - 1]
+        except IndexError:
+            # Оценка числа строк могла оказаться больше настоящего.
+            return Page([], number, self)
+        cursor = CursorPaginator(
+            self.object_list, self.per_page, date_field=self.date_field)
+        # Срез queryset, а не список: его ждёт formset list_editable.
+        rows = cursor.seek(self.object_list, boundary, CURSOR_NEXT)
+        return Page(rows[:self.per_page], number, self)
+
+
+class ScalableAdminMixin:
+    """Списки без полного COUNT(*) и без OFFSET на глубоких страницах."""
+    show_full_result_count = False
+    keyset_date_field = None
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        paginator = ScalablePaginator(
+            queryset, per_page, orphans, allow_empty_first_page)
+        paginator.date_field = self.keyset_date_field
+        return paginator
+
+
+class PostAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = (
         "pk",
         "text",
@@ -12,13 +96,20 @@ class PostAdmin(admin.ModelAdmin):
         "group",
     )
     list_editable = ("group",)
+    list_select_related = ("author", "group")
     search_fields = ("text",)
     list_filter = ("pub_date",)
+    date_hierarchy = "pub_date"
+    raw_id_fields = ("author",)
+    autocomplete_fields = ("group",)
     empty_value_display = "-пусто-"
+    keyset_date_field = "pub_date"
 
-
-admin.site.register(Post, PostAdmin)
-admin.site.register(Group)
+    def get_search_results(self, request, queryset, search_term):
+        """Поиск по полнотекстовому индексу вместо LIKE '%...%'."""
+        if not search_term:
+            return queryset, False
+        return search.filter_posts(queryset, search_term), False
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -27,10 +118,19 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
-class CommentAdmin(admin.ModelAdmin):
+admin.site.register(Post, PostAdmin)
+admin.site.register(Group, GroupAdmin)
+
+
+class CommentAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ('pk', 'post', 'author', 'text', 'created')
-    list_filter = ('author',)
-    search_fields = ('author', 'created')
+    list_select_related = ('post', 'author')
+    # Точное совпадение имени — поиск по уникальному индексу username.
+    search_fields = ('=author__username',)
+    date_hierarchy = 'created'
+    ordering = ('-created', '-id')
+    raw_id_fields = ('post', 'author')
+    keyset_date_field = 'created'
 
 
 admin.site.register(Comment, CommentAdmin)
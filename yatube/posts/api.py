@@ -0,0 +1,269 @@
+"""JSON API лент только для чтения.
+
+Строки читаются через .values() и сразу сериализуются, экземпляры
+моделей не создаются. Страницы курсорные, как в HTML-лентах:
+?cursor= берётся из полей next/previous ответа. ?fields=id,text
+выбирает поля, ?format=ndjson отдаёт ленту целиком потоком строк JSON.
+
+С шардированием JOIN с авторами и группами невозможен: посты
+и комментарии читаются экземплярами из шардов, связи подставляет
+sharding.attach, а строки собираются в тот же вид, что и .values().
+"""
+import json
+from functools import wraps
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+
+from . import cache, sharding
+from .models import Comment, Group, Post, User
+from .timeline import follow_key_paginator
+from .utils import (COUNT_COMMENTS, COUNT_PAGES, CURSOR_NEXT,
+                    CursorPaginator)
+
+# Поле ответа: путь для .values().
+POST_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+    'comments_count': 'comments_count',
+}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'created': 'created',
+    'author': 'author__username',
+}
+# Поля ключа курсора читаются всегда, даже если их не просили.
+POST_KEY = ('pub_date', 'id')
+COMMENT_KEY = ('created', 'id')
+
+NDJSON = 'application/x-ndjson'
+# Строк за одно обращение к курсору базы при потоковой выдаче.
+STREAM_CHUNK_SIZE = 2000
+
+
+class FieldError(ValueError):
+    """Запрошено поле, которого нет в API."""
+
+
+def api_view(view):
+    """Ошибки в параметрах запроса — ответ 400 в JSON."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except FieldError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+    return wrapper
+
+
+def selected_fields(request, available):
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(available)
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = sorted(set(fields) - set(available))
+    if unknown:
+        raise FieldError(f'Неизвестные поля: {", ".join(unknown)}')
+    return fields
+
+
+def lookups(fields, available, key=()):
+    """Пути для .values(): выбранные поля и ключ курсора."""
+    return list(dict.fromkeys(
+        [*(available[field] for field in fields), *key]))
+
+
+def serialize(row, fields, available):
+    item = {field: row[available[field]] for field in fields}
+    if 'image' in item:
+        item['image'] = (
+            default_storage.url(item['image']) if item['image'] else None)
+    return item
+
+
+def post_values(post):
+    """Строка поста в виде .values(): для постов, прочитанных
+    экземплярами с подставленными автором и группой."""
+    return {
+        'id': post.id,
+        'text': post.text,
+        'pub_date': post.pub_date,
+        'author__username': post.author.username,
+        'group__slug': post.group.slug if post.group else None,
+        'image': post.image.name,
+        'comments_count': post.comments_count,
+    }
+
+
+def comment_values(comment):
+    """Строка комментария в виде .values(), как post_values."""
+    return {
+        'id': comment.id,
+        'text': comment.text,
+        'created': comment.created,
+        'author__username': comment.author.username,
+    }
+
+
+def merged_rows(paginator):
+    """Все строки шардированного пагинатора порциями по
+    STREAM_CHUNK_SIZE, от новых к старым."""
+    position = None
+    while True:
+        rows = paginator.fetch(position, CURSOR_NEXT, STREAM_CHUNK_SIZE)
+        yield from rows
+        if len(rows) < STREAM_CHUNK_SIZE:
+            return
+        position = paginator.key(rows[-1])
+
+
+def ndjson_lines(items):
+    for item in items:
+        yield json.dumps(item, cls=DjangoJSONEncoder,
+                         ensure_ascii=False) + '\n'
+
+
+def page_response(page, results):
+    return JsonResponse({
+        'results': results,
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+def post_feed(request, posts, shard=None):
+    """Лента постов: курсорная страница или весь поток в NDJSON.
+    shard — шард автора для ленты одного автора."""
+    fields = selected_fields(request, POST_FIELDS)
+    if sharding.enabled():
+        return sharded_post_feed(request, posts, fields, shard)
+    rows = posts.values(*lookups(fields, POST_FIELDS, POST_KEY))
+    if request.GET.get('format') == 'ndjson':
+        rows = rows.order_by('-pub_date', '-id').iterator(
+            chunk_size=STREAM_CHUNK_SIZE)
+        return StreamingHttpResponse(
+            ndjson_lines(serialize(row, fields, POST_FIELDS) for row in rows),
+            content_type=NDJSON)
+    page = CursorPaginator(rows, COUNT_PAGES).get_page(
+        request.GET.get('cursor'))
+    return page_response(
+        page, [serialize(row, fields, POST_FIELDS) for row in page])
+
+
+def sharded_post_feed(request, posts, fields, shard):
+    if request.GET.get('format') == 'ndjson':
+        paginator = sharding.paginator(posts, STREAM_CHUNK_SIZE, shard=shard)
+        return StreamingHttpResponse(
+            ndjson_lines(serialize(post_values(post), fields, POST_FIELDS)
+                         for post in merged_rows(paginator)),
+            content_type=NDJSON)
+    page = sharding.paginator(posts, COUNT_PAGES, shard=shard).get_page(
+        request.GET.get('cursor'))
+    return page_response(page, [
+        serialize(post_values(post), fields, POST_FIELDS) for post in page
+    ])
+
+
+def comments_page(post_id, cursor, fields, shard=None):
+    """Страница комментариев от старых к новым; shard — шард поста,
+    если посты шардированы."""
+    if sharding.enabled():
+        page = sharding.paginator(
+            Comment.objects.filter(post_id=post_id), COUNT_COMMENTS,
+            shard=shard, date_field='created', oldest_first=True,
+        ).get_page(cursor)
+        return page, [
+            serialize(comment_values(comment), fields, COMMENT_FIELDS)
+            for comment in page
+        ]
+    rows = Comment.objects.filter(post_id=post_id).values(
+        *lookups(fields, COMMENT_FIELDS, COMMENT_KEY))
+    paginator = CursorPaginator(
+        rows, COUNT_COMMENTS, date_field='created', oldest_first=True)
+    page = paginator.get_page(cursor)
+    return page, [serialize(row, fields, COMMENT_FIELDS) for row in page]
+
+
+@api_view
+@cache.anonymous_page(cache.FEED)
+def index(request):
+    return post_feed(request, Post.objects.all())
+
+
+@api_view
+@cache.anonymous_page(cache.group_scope)
+def group_posts(request, slug):
+    group = get_object_or_404(Group.objects.values('id'), slug=slug)
+    return post_feed(request, Post.objects.filter(group_id=group['id']))
+
+
+@api_view
+@cache.anonymous_page(cache.author_scope)
+def profile(request, username):
+    author = get_object_or_404(User.objects.values('id'), username=username)
+    return post_feed(request, Post.objects.filter(author_id=author['id']),
+                     shard=sharding.author_shard(author['id']))
+
+
+@api_view
+def follow_index(request):
+    """Лента подписок: ключи страницы из материализованной ленты,
+    поля постов — одним запросом по id. С шардами TimelineEntry
+    не ведётся, посты читаются прямо из шардов авторов."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Нужна авторизация.'}, status=401)
+    fields = selected_fields(request, POST_FIELDS)
+    if sharding.enabled():
+        page = sharding.follow_paginator(request.user, COUNT_PAGES).get_page(
+            request.GET.get('cursor'))
+        return page_response(page, [
+            serialize(post_values(post), fields, POST_FIELDS)
+            for post in page
+        ])
+    page = follow_key_paginator(request.user, COUNT_PAGES).get_page(
+        request.GET.get('cursor'))
+    ids = [row['id'] for row in page]
+    rows = Post.objects.filter(id__in=ids).values(
+        *lookups(fields, POST_FIELDS, POST_KEY))
+    by_id = {row['id']: row for row in rows}
+    return page_response(page, [
+        serialize(by_id[pk], fields, POST_FIELDS)
+        for pk in ids if pk in by_id
+    ])
+
+
+@api_view
+@cache.anonymous_page(cache.post_scope)
+def post_detail(request, post_id):
+    """Пост и первая страница комментариев, от старых к новым."""
+    fields = selected_fields(request, POST_FIELDS)
+    shard = None
+    if sharding.enabled():
+        post = sharding.get_post_or_404(Post.objects, id=post_id)
+        shard = post._state.db
+        post = post_values(post)
+    else:
+        post = get_object_or_404(
+            Post.objects.values(*lookups(fields, POST_FIELDS)), id=post_id)
+    page, comments = comments_page(
+        post_id, None, list(COMMENT_FIELDS), shard)
+    data = serialize(post, fields, POST_FIELDS)
+    data['comments'] = {'results': comments, 'next': page.next_cursor}
+    return JsonResponse(data)
+
+
+@api_view
+@cache.anonymous_page(cache.post_scope)
+def post_comments(request, post_id):
+    fields = selected_fields(request, COMMENT_FIELDS)
+    page, comments = comments_page(
+        post_id, request.GET.get('cursor'), fields,
+        sharding.post_shard(post_id))
+    return page_response(page, comments)
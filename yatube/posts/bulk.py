@@ -0,0 +1,73 @@
+"""Общие части массовой загрузки данных (import_posts, seed).
+
+bulk_create не отправляет сигналы, поэтому счётчики, поисковый индекс,
+ленты подписок и поколения кеша при загрузке не обновляются построчно;
+finish() приводит их в порядок один раз в конце.
+"""
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import AutoField
+
+from . import cache, counters, search, timeline
+from .models import Comment, Group, Post
+
+
+def insert(model, objects, batch_size, using=DEFAULT_DB_ALIAS, raw=False,
+           ignore_conflicts=False):
+    """bulk_create с размером пачки не больше, чем позволяет база:
+    Django 2.2 не ограничивает его сам, а SQLite отвергает INSERT
+    длиннее 500 строк (too many terms in compound SELECT).
+
+    raw=True сохраняет значения полей как есть, как loaddata:
+    auto_now_add не подменяет переданные pub_date и created. Поля
+    модели при этом не меняются, поэтому другие сохранения в том же
+    процессе работают как обычно."""
+    objects = list(objects)
+    limit = connections[using].ops.bulk_batch_size(
+        model._meta.concrete_fields, objects)
+    batch_size = min(batch_size, limit) if limit else batch_size
+    if not raw:
+        return model.objects.using(using).bulk_create(
+            objects, batch_size=batch_size,
+            ignore_conflicts=ignore_conflicts)
+    fields = model._meta.concrete_fields
+    groups = (
+        ([obj for obj in objects if obj.pk is not None], fields),
+        ([obj for obj in objects if obj.pk is None],
+         [field for field in fields if not isinstance(field, AutoField)]),
+    )
+    with transaction.atomic(using=using, savepoint=False):
+        for group, group_fields in groups:
+            for start in range(0, len(group), batch_size):
+                # Как Model.save_base(raw=True): запрос вставки с raw
+                # не вызывает pre_save полей.
+                model._base_manager._insert(
+                    group[start:start + batch_size], fields=group_fields,
+                    using=using, raw=True, ignore_conflicts=ignore_conflicts)
+    for obj in objects:
+        obj._state.adding = False
+        obj._state.db = using
+    return objects
+
+
+def reset_sequences(*models):
+    """После вставки с явными id счётчики id в PostgreSQL отстают."""
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def finish(group_slugs=(), usernames=()):
+    """Отложенное обслуживание после массовой загрузки.
+    Возвращает исправленные счётчики, как counters.recount."""
+    reset_sequences(Group, Post, Comment)
+    fixed = counters.recount()
+    search.rebuild()
+    timeline.backfill_all()
+    cache.bump(
+        cache.FEED,
+        *(cache.group_scope(slug) for slug in group_slugs),
+        *(cache.author_scope(username) for username in usernames),
+    )
+    return fixed
@@ -0,0 +1,160 @@
+"""Поколения кеша для лент постов.
+
+Каждая область (вся лента, группа, автор, пост) имеет своё поколение —
+отметку времени последнего изменения. Поколение входит в ключ кеша,
+поэтому изменение поста делает старые записи недостижимыми сразу, и
+TTL можно держать долгим. Пропавшее из кеша поколение создаётся заново
+текущим временем, что тоже означает «всё перечитать».
+
+Поколение — это и время последнего изменения области, поэтому из него
+же получаются ETag и Last-Modified без рендеринга страницы. Пока оно
+моложе REPLICA_MAX_LAG_SECONDS, запрос читает не с реплики, поэтому
+поколение берётся до чтения данных страницы или фрагмента.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from core.db import routers
+
+GENERATION_KEY = 'generation:{}'
+PAGE_KEY = 'anonymous_page:{}:{}'
+POST_AUTHOR_KEY = 'post_author:{}'
+FEED = 'feed'
+
+# Время жизни страниц для анонимных читателей; актуальность
+# обеспечивают поколения, TTL лишь вытесняет забытые записи.
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+
+def group_scope(slug):
+    return f'group:{slug}'
+
+
+def author_scope(username):
+    return f'author:{username}'
+
+
+def post_scope(post_id):
+    return f'post:{post_id}'
+
+
+def post_author_scope(post_id):
+    """Область автора поста: страница поста показывает его счётчики.
+    Имя автора запоминается в кеше, чтобы повторный запрос страницы
+    не обращался к базе."""
+    from . import sharding
+    from .models import Post, User
+
+    key = POST_AUTHOR_KEY.format(post_id)
+    username = cache.get(key)
+    if username is None:
+        author_id = None
+        for using in sharding.shards() or [None]:
+            author_id = Post.objects.using(using).filter(
+                pk=post_id).values_list('author_id', flat=True).first()
+            if author_id is not None:
+                break
+        username = User.objects.filter(pk=author_id).values_list(
+            'username', flat=True).first()
+        if username is None:
+            # Поста нет: страница не кешируется, область не важна.
+            return post_scope(post_id)
+        cache.set(key, username, PAGE_CACHE_TIMEOUT)
+    return author_scope(username)
+
+
+def generations(*scopes):
+    """Текущие поколения областей в одном обращении к кешу."""
+    keys = [GENERATION_KEY.format(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in found}
+    for key, value in missing.items():
+        # add не перезапишет поколение, созданное параллельным запросом.
+        if not cache.add(key, value, timeout=None):
+            value = cache.get(key, value)
+        found[key] = value
+    current = [found[key] for key in keys]
+    # Реплика могла ещё не получить изменение, сдвинувшее поколение:
+    # прочитанное с неё попало бы в кеш под новым поколением.
+    if current and time.time() - max(current) < (
+            settings.REPLICA_MAX_LAG_SECONDS):
+        routers.read_primary()
+    return current
+
+
+def generation(scope):
+    return generations(scope)[0]
+
+
+def bump(*scopes):
+    """Переводит области на новое поколение."""
+    now = time.time()
+    cache.set_many(
+        {GENERATION_KEY.format(scope): now for scope in scopes},
+        timeout=None,
+    )
+
+
+def bump_on_commit(*scopes, using=None):
+    """bump после коммита транзакции базы using: иначе параллельный
+    запрос успел бы закешировать ещё не закоммиченные данные под
+    новым поколением."""
+    transaction.on_commit(lambda: bump(*scopes), using=using)
+
+
+def post_scopes(post, *group_slugs):
+    """Области, которые меняются вместе с постом."""
+    scopes = [FEED, author_scope(post.author.username), post_scope(post.pk)]
+    scopes.extend(group_scope(slug) for slug in group_slugs if slug)
+    return scopes
+
+
+def anonymous_page(*scopes):
+    """Кеш полного ответа и условный GET для анонимных пользователей.
+    scopes — строки или функции от именованных аргументов URL,
+    возвращающие область; ключ кеша и ETag строятся из пути, запроса
+    и поколений этих областей, Last-Modified — самое свежее поколение.
+    Совпавший валидатор сразу даёт 304. Авторизованные пользователи
+    кеш не видят."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD')
+                    or request.user.is_authenticated):
+                return view(request, *args, **kwargs)
+            current = generations(*(
+                scope(**kwargs) if callable(scope) else scope
+                for scope in scopes
+            ))
+            path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            version = ':'.join(str(value) for value in current)
+            etag = quote_etag(
+                hashlib.md5(f'{path}:{version}'.encode()).hexdigest())
+            last_modified = int(max(current))
+            not_modified = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                not_modified['ETag'] = etag
+                return not_modified
+            key = PAGE_KEY.format(path, version)
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if (response.status_code != 200 or response.cookies
+                        or response.streaming):
+                    return response
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+                # Хранить можно, но перед показом — сверять валидаторы.
+                patch_cache_control(response, no_cache=True)
+                cache.set(key, response, PAGE_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,166 @@
+"""Денормализованные счётчики постов, комментариев и подписок.
+
+Инкременты выполняются одним UPDATE ... SET x = x + 1 и не читают
+значение в Python, поэтому не теряются при параллельных запросах.
+Сдвиги счётчиков — задачи core.tasks: сигналы ставят их через delay().
+С шардированием пересчёт читает посты из всех шардов.
+"""
+from collections import Counter
+
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from core.tasks import task
+
+from . import sharding
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+
+
+def _shift(field, delta):
+    """F(field) + delta; уменьшение не уходит ниже нуля даже при
+    накопленном расхождении (его потом исправит recount)."""
+    if delta < 0:
+        return Greatest(F(field) + delta, 0)
+    return F(field) + delta
+
+
+def _increments(deltas):
+    return {field: _shift(field, delta) for field, delta in deltas.items()}
+
+
+@task()
+def bump_author(user_id, **deltas):
+    """Сдвигает счётчики автора; строка создаётся, если её ещё нет."""
+    stats = AuthorStats.objects.filter(pk=user_id)
+    if not stats.update(**_increments(deltas)):
+        recount_author(user_id)
+
+
+@task()
+def drop_author(user_id, **deltas):
+    """Уменьшает счётчики автора, не создавая строку.
+    Используется при удалении: автор может удаляться вместе с постами."""
+    AuthorStats.objects.filter(pk=user_id).update(**_increments(deltas))
+
+
+@task()
+def bump_group(group_id, delta):
+    if group_id is None:
+        return
+    Group.objects.filter(pk=group_id).update(
+        posts_count=_shift('posts_count', delta))
+
+
+@task()
+def bump_post(post_id, delta, using=None):
+    """using — база поста, если посты шардированы."""
+    Post.objects.using(using).filter(pk=post_id).update(
+        comments_count=_shift('comments_count', delta))
+
+
+def _count(model, field):
+    """Подзапрос COUNT(*) по внешнему ключу field для каждой строки."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    ), 0)
+
+
+def recount_author(user_id):
+    posts = sum(
+        Post.objects.using(shard).filter(author_id=user_id).count()
+        for shard in sharding.shards() or [None])
+    AuthorStats.objects.update_or_create(pk=user_id, defaults={
+        'posts_count': posts,
+        'followers_count': Follow.objects.filter(author_id=user_id).count(),
+        'following_count': Follow.objects.filter(user_id=user_id).count(),
+    })
+
+
+def recount():
+    """Пересчитывает все счётчики по фактическим данным.
+    Возвращает число исправленных строк по каждой модели."""
+    AuthorStats.objects.bulk_create(
+        (AuthorStats(user_id=pk)
+         for pk in User.objects.values_list('pk', flat=True).iterator()),
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+    if sharding.enabled():
+        return _recount_sharded()
+    authors = AuthorStats.objects.annotate(
+        real_posts=_count(Post, 'author'),
+        real_followers=_count(Follow, 'author'),
+        real_following=_count(Follow, 'user'),
+    ).exclude(
+        posts_count=F('real_posts'),
+        followers_count=F('real_followers'),
+        following_count=F('real_following'),
+    )
+    groups = Group.objects.annotate(
+        real_posts=_count(Post, 'group')).exclude(
+        posts_count=F('real_posts'))
+    posts = Post.objects.annotate(
+        real_comments=_count(Comment, 'post')).exclude(
+        comments_count=F('real_comments'))
+    return {
+        'authors': AuthorStats.objects.filter(
+            pk__in=authors.values('pk')).update(
+            posts_count=_count(Post, 'author'),
+            followers_count=_count(Follow, 'author'),
+            following_count=_count(Follow, 'user'),
+        ),
+        'groups': Group.objects.filter(
+            pk__in=groups.values('pk')).update(
+            posts_count=_count(Post, 'group')),
+        'posts': Post.objects.filter(
+            pk__in=posts.values('pk')).update(
+            comments_count=_count(Comment, 'post')),
+    }
+
+
+def _recount_sharded():
+    """recount для шардированных постов: подзапрос к другой базе
+    невозможен, поэтому посты авторов и групп суммируются по шардам
+    в Python, а комментарии считаются в шарде своего поста."""
+    author_posts, group_posts = Counter(), Counter()
+    fixed_posts = 0
+    for shard in sharding.shards():
+        posts = Post.objects.using(shard).order_by()
+        author_posts.update(dict(
+            posts.values_list('author_id').annotate(Count('id'))))
+        group_posts.update(dict(posts.exclude(group=None).values_list(
+            'group_id').annotate(Count('id'))))
+        drifted = posts.annotate(
+            real_comments=_count(Comment, 'post')).exclude(
+            comments_count=F('real_comments'))
+        fixed_posts += posts.filter(pk__in=drifted.values('pk')).update(
+            comments_count=_count(Comment, 'post'))
+
+    fixed_authors = 0
+    authors = AuthorStats.objects.annotate(
+        real_followers=_count(Follow, 'author'),
+        real_following=_count(Follow, 'user'),
+    ).values_list('pk', 'posts_count', 'followers_count',
+                  'following_count', 'real_followers', 'real_following')
+    for pk, *stored, followers, following in authors.iterator():
+        real = [author_posts[pk], followers, following]
+        if stored != real:
+            fixed_authors += AuthorStats.objects.filter(pk=pk).update(
+                posts_count=real[0], followers_count=followers,
+                following_count=following)
+
+    fixed_groups = 0
+    groups = Group.objects.values_list('pk', 'posts_count')
+    for pk, stored in groups.iterator():
+        if stored != group_posts[pk]:
+            fixed_groups += Group.objects.filter(pk=pk).update(
+                posts_count=group_posts[pk])
+    return {
+        'authors': fixed_authors,
+        'groups': fixed_groups,
+        'posts': fixed_posts,
+    }
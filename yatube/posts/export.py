@@ -0,0 +1,174 @@
+"""Потоковая выгрузка данных пользователя.
+
+Строки читаются .values().iterator(chunk_size=...) и сразу пишутся в
+поток, поэтому память не растёт с числом постов. Поля совпадают с тем,
+что принимает import_posts: выгрузку можно загрузить обратно.
+
+С шардированием посты читаются из шарда автора, комментарии — из всех
+шардов. JOIN с пользователями и группами там невозможен, поэтому
+вместо имени автора и слага группы читаются id, а имена подставляются
+из default пачками.
+"""
+import csv
+import zipfile
+from itertools import islice
+
+from django.core.files.storage import default_storage
+
+from . import sharding
+from .api import ndjson_lines
+from .models import Comment, Follow, Group, Post
+
+EXPORT_CHUNK_SIZE = 2000
+FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+# Расширения файлов, по которым import_posts узнаёт формат.
+EXTENSIONS = {'ndjson': 'jsonl', 'csv': 'csv'}
+
+# Поле выгрузки: путь для .values().
+EXPORTS = {
+    'posts': {
+        'id': 'id',
+        'author': 'author__username',
+        'group': 'group__slug',
+        'text': 'text',
+        'pub_date': 'pub_date',
+        'image': 'image',
+    },
+    'comments': {
+        'post': 'post_id',
+        'author': 'author__username',
+        'text': 'text',
+        'created': 'created',
+    },
+    'follows': {
+        'user': 'user__username',
+        'author': 'author__username',
+    },
+}
+# Путь через связь: поле, которое читается из шарда вместо него.
+SHARDED_LOOKUPS = {
+    'author__username': 'author_id',
+    'group__slug': 'group_id',
+}
+
+
+def queryset(kind, user):
+    if kind == 'posts':
+        return Post.objects.filter(author=user).using(
+            sharding.author_shard(user.pk))
+    if kind == 'comments':
+        return Comment.objects.filter(author=user)
+    return Follow.objects.filter(user=user)
+
+
+def sources(kind, user):
+    """Querysets выгрузки: комментарии пользователя с шардированием
+    лежат в шардах постов, то есть во всех."""
+    if kind == 'comments' and sharding.enabled():
+        return [queryset(kind, user).using(shard)
+                for shard in sharding.shards()]
+    return [queryset(kind, user)]
+
+
+def resolved(rows, user):
+    """Строки из шарда с именем автора и слагом группы, как у JOIN.
+    Автор выгрузки постов и комментариев — сам пользователь."""
+    while True:
+        chunk = list(islice(rows, EXPORT_CHUNK_SIZE))
+        if not chunk:
+            return
+        slugs = dict(Group.objects.filter(
+            pk__in={row.get('group_id') for row in chunk} - {None}
+        ).values_list('pk', 'slug'))
+        for row in chunk:
+            row['author__username'] = user.username
+            row['group__slug'] = slugs.get(row.get('group_id'))
+            yield row
+
+
+def records(kind, user):
+    fields = EXPORTS[kind]
+    sharded = sharding.enabled() and kind != 'follows'
+    lookups = [
+        SHARDED_LOOKUPS.get(lookup, lookup) if sharded else lookup
+        for lookup in fields.values()
+    ]
+    for source in sources(kind, user):
+        rows = source.order_by('pk').values(*lookups).iterator(
+            chunk_size=EXPORT_CHUNK_SIZE)
+        if sharded:
+            rows = resolved(rows, user)
+        for row in rows:
+            yield {field: row[lookup] for field, lookup in fields.items()}
+
+
+class Echo:
+    """Файлоподобный объект, который возвращает записанное,
+    а не хранит его: csv.writer пишет строку, генератор её отдаёт."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(kind, items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORTS[kind])
+    for item in items:
+        yield writer.writerow(
+            '' if value is None else value for value in item.values())
+
+
+def lines(kind, user, file_format):
+    items = records(kind, user)
+    if file_format == 'csv':
+        return csv_lines(kind, items)
+    return ndjson_lines(items)
+
+
+class ZipSink:
+    """Поток без seek для zipfile: накопленные байты забираются
+    после каждой записи, и архив никогда не лежит целиком в памяти."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def image_names(user):
+    return queryset('posts', user).exclude(image='').order_by(
+        'pk').values_list('image', flat=True).iterator(
+        chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def zip_images(user):
+    """ZIP картинок постов пользователя кусками по мере чтения файлов
+    из хранилища, без временных копий. Картинки уже сжаты, поэтому
+    складываются без сжатия. Пропавшие файлы пропускаются."""
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+        for name in image_names(user):
+            try:
+                source = default_storage.open(name)
+            except FileNotFoundError:
+                continue
+            with source, archive.open(name, 'w', force_zip64=True) as target:
+                for chunk in source.chunks():
+                    target.write(chunk)
+                    yield sink.take()
+            yield sink.take()
+    yield sink.take()
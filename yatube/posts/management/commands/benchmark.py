@@ -0,0 +1,290 @@
+import json
+import math
+import platform
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.template.base import Template
+from django.test import Client
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from about.urls import urlpatterns as about_urls
+from posts import cache
+from posts.models import Follow, Group, Post
+from posts.urls import urlpatterns as posts_urls
+from users.urls import urlpatterns as users_urls
+
+User = get_user_model()
+
+ROUTES = (('posts', posts_urls), ('users', users_urls), ('about', about_urls))
+DEFAULT_SIZES = (10000,)
+# Во сколько раз p95 может вырасти относительно базовой линии,
+# прежде чем это считается регрессией.
+DEFAULT_TOLERANCE = 1.2
+# Маршруты, которые пишут в базу и на GET: их запросы откатываются.
+WRITE_ROUTES = ('posts:profile_follow', 'posts:profile_unfollow',
+                'users:logout')
+# Суффикс имени маршрута в результатах анонимного прохода.
+ANONYMOUS = ' anonymous'
+
+
+def percentile(values, fraction):
+    """Перцентиль по ближайшему рангу."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+@contextmanager
+def sql_timer():
+    """Время каждого SQL-запроса: в CaptureQueriesContext оно
+    округлено до миллисекунд, для быстрых запросов это ноль."""
+    spent = []
+
+    def timed(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            spent.append(time.perf_counter() - started)
+
+    with connection.execute_wrapper(timed):
+        yield spent
+
+
+@contextmanager
+def render_timer():
+    """Суммирует время внешних Template.render; вложенные include
+    уже входят во время шаблона, который их подключил."""
+    spent = [0.0]
+    depth = [0]
+    original = Template.render
+
+    def render(template, context):
+        depth[0] += 1
+        started = time.perf_counter()
+        try:
+            return original(template, context)
+        finally:
+            depth[0] -= 1
+            if not depth[0]:
+                spent[0] += time.perf_counter() - started
+
+    Template.render = render
+    try:
+        yield spent
+    finally:
+        Template.render = original
+
+
+class Command(BaseCommand):
+    help = ('Замеряет каждый маршрут posts, users и about на наборах '
+            'данных заданного размера: p50/p95 времени ответа, число и '
+            'время SQL-запросов, время рендера шаблонов и пик памяти. '
+            'Авторизованный проход — без кеша страниц, анонимный — с ним. '
+            'Результат пишется в JSON и сравнивается с базовой линией.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+            help='Размеры наборов в постах, например 10000 100000 1000000. '
+                 'Каждый набор создаётся командой seed в отдельной базе.')
+        parser.add_argument(
+            '--current', action='store_true',
+            help='Замерить текущую базу как есть, без seed.')
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Не удалять базы наборов: следующий запуск возьмёт их '
+                 'без повторного seed.')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--route', action='append', dest='routes',
+            help='Имя маршрута, например posts:index (можно несколько раз).')
+        parser.add_argument(
+            '--cached', action='store_true',
+            help='Не сбрасывать кеш страниц перед авторизованным '
+                 'запросом: замерять тёплые страницы.')
+        parser.add_argument('--output', help='Куда записать JSON.')
+        parser.add_argument(
+            '--baseline', help='JSON прошлого запуска для сравнения.')
+        parser.add_argument(
+            '--tolerance', type=float, default=DEFAULT_TOLERANCE)
+
+    def handle(self, *args, **options):
+        results = {}
+        if options['current']:
+            results['current'] = self.measure_database(options)
+        else:
+            for size in options['sizes']:
+                results[str(size)] = self.measure_dataset(size, options)
+        report = {
+            'meta': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+                'cached': options['cached'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as target:
+                json.dump(report, target, ensure_ascii=False, indent=2)
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def measure_dataset(self, size, options):
+        """Отдельная база на набор: создаётся как тестовая, заполняется
+        seed, после замеров удаляется (или остаётся при --keepdb)."""
+        creation = connection.creation
+        settings_dict = connection.settings_dict
+        old_name = settings_dict['NAME']
+        old_test = settings_dict.get('TEST', {})
+        settings_dict['TEST'] = {**old_test, 'NAME': f'benchmark_{size}'}
+        try:
+            creation.create_test_db(
+                verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+            if not Post.objects.exists():
+                self.stdout.write(f'seed: {size} постов...')
+                call_command('seed', posts=size, users=max(size // 20, 10),
+                             stdout=self.stdout)
+            return self.measure_database(options, size)
+        finally:
+            creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            settings_dict['TEST'] = old_test
+
+    def measure_database(self, options, size='current'):
+        post = Post.objects.select_related('author').filter(
+            group__isnull=False).order_by('-pub_date').first()
+        if post is None:
+            raise CommandError('В базе нет постов с группой, нечего мерить.')
+        follow = Follow.objects.select_related('user').first()
+        user = follow.user if follow else post.author
+        kwargs = {
+            'slug': Group.objects.get(pk=post.group_id).slug,
+            'username': post.author.username,
+            'post_id': post.pk,
+            'uidb64': urlsafe_base64_encode(force_bytes(user.pk)),
+            'token': default_token_generator.make_token(user),
+        }
+        # Поколения всех областей, которые показывают замеряемые
+        # страницы: их сдвиг сбрасывает кеш страниц и фрагментов,
+        # но не kvstore миниатюр и не сессии.
+        scopes = (
+            cache.FEED, cache.group_scope(kwargs['slug']),
+            cache.author_scope(kwargs['username']),
+            cache.post_scope(kwargs['post_id']),
+        )
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Набор: {size}'))
+        measured = {}
+        for namespace, patterns in ROUTES:
+            for pattern in patterns:
+                name = f'{namespace}:{pattern.name}'
+                if options['routes'] and name not in options['routes']:
+                    continue
+                url = reverse(name, kwargs={
+                    key: kwargs[key] for key in pattern.pattern.converters})
+                rollback = name in WRITE_ROUTES
+                passes = (
+                    (name, user, () if options['cached'] else scopes),
+                    (name + ANONYMOUS, None, ()),
+                )
+                for label, login, bump in passes:
+                    measured[label] = self.measure(
+                        Client(), login, url, rollback, bump,
+                        options['repeat'])
+                    self.stdout.write(
+                        '  {name:<42} {status} p50 {p50_ms:8.2f} мс  '
+                        'p95 {p95_ms:8.2f} мс  SQL {queries:3} '
+                        '({sql_ms:.2f} мс)  шаблоны {render_ms:.2f} мс  '
+                        'память {peak_kib} КиБ'.format(
+                            name=label, **measured[label]))
+        return measured
+
+    def request(self, client, user, url, rollback, scopes):
+        """Один GET. Запросы маршрутов, которые пишут в базу (подписка,
+        выход), откатываются, чтобы повторы не влияли друг на друга;
+        остальные — нет: иначе откатились бы и записи kvstore миниатюр,
+        и ленты с картинками всегда мерились бы холодными. scopes —
+        области, кеш которых сбрасывается перед запросом."""
+        if user is not None and '_auth_user_id' not in client.session:
+            client.force_login(user)
+        if scopes:
+            cache.bump(*scopes)
+        with transaction.atomic() if rollback else nullcontext():
+            with sql_timer() as spent, render_timer() as rendered:
+                started = time.perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+                elapsed = time.perf_counter() - started
+            if rollback:
+                transaction.set_rollback(True)
+        return response, elapsed, spent, rendered[0]
+
+    def measure(self, client, user, url, rollback, scopes, repeat):
+        """Первый запрос прогревает миниатюры и кеш и не замеряется."""
+        self.request(client, user, url, rollback, scopes)
+        timings, queries, sql, rendered = [], [], [], []
+        for _ in range(repeat):
+            response, elapsed, spent, render = self.request(
+                client, user, url, rollback, scopes)
+            timings.append(elapsed)
+            queries.append(len(spent))
+            sql.append(sum(spent))
+            rendered.append(render)
+        # Память — отдельным запросом: tracemalloc замедляет код
+        # и исказил бы время.
+        tracemalloc.start()
+        try:
+            self.request(client, user, url, rollback, scopes)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {
+            'url': url,
+            'status': response.status_code,
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+            'queries': max(queries),
+            'sql_ms': round(percentile(sql, 0.5) * 1000, 3),
+            'render_ms': round(percentile(rendered, 0.5) * 1000, 3),
+            'peak_kib': peak // 1024,
+        }
+
+    def compare(self, results, path, tolerance):
+        """Регрессия — рост p95 больше чем в tolerance раз или любой
+        рост числа запросов относительно базовой линии."""
+        with open(path, encoding='utf-8') as source:
+            baseline = json.load(source)['results']
+        regressions = []
+        for size, routes in results.items():
+            for name, current in routes.items():
+                previous = baseline.get(size, {}).get(name)
+                if previous is None:
+                    continue
+                if current['p95_ms'] > previous['p95_ms'] * tolerance:
+                    regressions.append(
+                        f'{size} {name}: p95 {previous["p95_ms"]} -> '
+                        f'{current["p95_ms"]} мс')
+                if current['queries'] > previous['queries']:
+                    regressions.append(
+                        f'{size} {name}: SQL {previous["queries"]} -> '
+                        f'{current["queries"]}')
+        if regressions:
+            for line in regressions:
+                self.stderr.write(line)
+            raise CommandError(
+                f'Регрессий относительно {path}: {len(regressions)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Регрессий относительно {path} нет.'))
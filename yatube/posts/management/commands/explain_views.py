@@ -0,0 +1,76 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Follow, Group, Post
+from posts.urls import urlpatterns
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Печатает EXPLAIN QUERY PLAN для каждого SQL-запроса, '
+            'который выполняют представления posts.views.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--view', action='append', dest='views',
+            help='Имя представления из posts.urls (можно несколько раз).')
+        parser.add_argument(
+            '--username',
+            help='Пользователь, от имени которого открываются страницы.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN доступен только в SQLite.')
+        post = Post.objects.select_related('author', 'group').first()
+        if post is None:
+            raise CommandError('В базе нет постов, нечего объяснять.')
+        user = self._get_user(options['username'], post)
+        kwargs = {
+            'slug': (post.group or Group.objects.first() or Group()).slug,
+            'username': post.author.username,
+            'post_id': post.pk,
+        }
+        client = Client()
+        client.force_login(user)
+        for pattern in urlpatterns:
+            if options['views'] and pattern.name not in options['views']:
+                continue
+            url = reverse(
+                f'posts:{pattern.name}',
+                kwargs={name: kwargs[name]
+                        for name in pattern.pattern.converters})
+            self._explain(client, pattern.name, url)
+
+    def _get_user(self, username, post):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'Пользователь {username} не найден.')
+        follow = Follow.objects.select_related('user').first()
+        return follow.user if follow else post.author
+
+    def _explain(self, client, name, url):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{name}: GET {url}'))
+        # Часть представлений пишет в базу (подписка/отписка),
+        # поэтому каждый запрос выполняется в откатываемой транзакции.
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as captured:
+                client.get(url)
+            with connection.cursor() as cursor:
+                for query in captured.captured_queries:
+                    self._explain_query(cursor, query['sql'])
+            transaction.set_rollback(True)
+
+    def _explain_query(self, cursor, sql):
+        self.stdout.write(f'  {sql}')
+        if not sql.lstrip().upper().startswith('SELECT'):
+            return
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        for row in cursor.fetchall():
+            self.stdout.write(f'    -> {row[-1]}')
@@ -0,0 +1,47 @@
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Выгружает посты, комментарии и подписки пользователя в '
+            'NDJSON или CSV (по файлу на вид, в формате import_posts) '
+            'и, по желанию, ZIP с картинками его постов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument(
+            '--output', default='.',
+            help='Каталог для файлов выгрузки.')
+        parser.add_argument(
+            '--format', choices=export.FORMATS, default='ndjson',
+            dest='file_format')
+        parser.add_argument(
+            '--images', action='store_true',
+            help='Добавить images.zip с картинками постов.')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(
+                f'Пользователь {options["username"]} не найден')
+        os.makedirs(options['output'], exist_ok=True)
+        file_format = options['file_format']
+        for kind in export.EXPORTS:
+            name = f'{kind}.{export.EXTENSIONS[file_format]}'
+            path = os.path.join(options['output'], name)
+            with open(path, 'w', newline='', encoding='utf-8') as target:
+                target.writelines(export.lines(kind, user, file_format))
+            self.stdout.write(f'{path}')
+        if options['images']:
+            path = os.path.join(options['output'], 'images.zip')
+            with open(path, 'wb') as target:
+                for chunk in export.zip_images(user):
+                    target.write(chunk)
+            self.stdout.write(f'{path}')
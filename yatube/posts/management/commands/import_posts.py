@@ -0,0 +1,281 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from posts import bulk, sharding
+from posts.models import (Comment, Follow, Group, ImportedPost,
+                          ImportProgress, Post)
+
+User = get_user_model()
+
+KINDS = ('groups', 'posts', 'comments', 'follows')
+FORMATS = ('jsonl', 'csv')
+# Сколько пропущенных записей перечислять в выводе.
+SKIPPED_SHOWN = 20
+
+
+def read_records(path, file_format):
+    """Записи файла по одной, без чтения файла целиком."""
+    with open(path, newline='', encoding='utf-8') as source:
+        if file_format == 'csv':
+            yield from csv.DictReader(source)
+            return
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Importer:
+    """Собирает объекты моделей из записей. Авторы и группы ищутся
+    в словарях в памяти; неизвестные пользователи создаются пачкой
+    на каждую порцию записей.
+
+    Посты получают новые id: id из файла мог уже занять другой пост.
+    Соответствие хранится в ImportedPost отдельно для каждой выгрузки
+    source, по нему комментарии находят свой пост. Записи, которые
+    загрузить нельзя, не вставляются, а возвращаются как пропущенные
+    с причиной."""
+
+    def __init__(self):
+        self.source = ''
+        self.users = dict(User.objects.values_list('username', 'pk'))
+        self.groups = dict(Group.objects.values_list('slug', 'pk'))
+        self.group_slugs = set()
+        self.usernames = set()
+
+    def resolve_users(self, usernames):
+        usernames = set(usernames)
+        missing = usernames - self.users.keys()
+        if missing:
+            password = make_password(None)
+            bulk.insert(
+                User,
+                (User(username=name, password=password)
+                 for name in missing),
+                len(missing),
+                ignore_conflicts=True,
+            )
+            self.users.update(User.objects.filter(
+                username__in=missing).values_list('username', 'pk'))
+        self.usernames.update(usernames)
+
+    def date(self, value):
+        return (parse_datetime(value) if value else None) or timezone.now()
+
+    def load(self, kind, records, batch_size):
+        """Вставляет записи порции. Возвращает [(номер записи в порции,
+        причина пропуска)]."""
+        skipped = []
+        model, objects = getattr(self, f'build_{kind}')(records, skipped)
+        # raw: даты из файла не подменяются на текущее время.
+        bulk.insert(model, objects, batch_size, raw=True)
+        if kind == 'posts':
+            bulk.insert(ImportedPost, (
+                ImportedPost(source=self.source, source_id=post.source_id,
+                             post_id=post.pk)
+                for post in objects if post.source_id is not None
+            ), batch_size)
+        return skipped
+
+    def build_groups(self, records, skipped):
+        slugs = {record['slug'] for record in records}
+        existing = set(Group.objects.filter(
+            slug__in=slugs).values_list('slug', flat=True))
+        self.group_slugs.update(slugs)
+        groups = {}
+        for number, record in enumerate(records):
+            if record['slug'] in existing or record['slug'] in groups:
+                skipped.append((number, f'группа {record["slug"]} уже есть'))
+                continue
+            groups[record['slug']] = Group(
+                slug=record['slug'], title=record['title'],
+                description=record.get('description', ''))
+        return Group, list(groups.values())
+
+    def build_follows(self, records, skipped):
+        self.resolve_users(
+            name for record in records
+            for name in (record['user'], record['author']))
+        pairs = [(self.users[record['user']], self.users[record['author']])
+                 for record in records]
+        existing = set(Follow.objects.filter(
+            user_id__in={user_id for user_id, _ in pairs}).values_list(
+            'user_id', 'author_id'))
+        follows = []
+        for number, (user_id, author_id) in enumerate(pairs):
+            if user_id == author_id:
+                skipped.append((number, 'подписка на себя'))
+            elif (user_id, author_id) in existing:
+                skipped.append((number, 'подписка уже есть'))
+            else:
+                existing.add((user_id, author_id))
+                follows.append(Follow(user_id=user_id, author_id=author_id))
+        return Follow, follows
+
+    def imported_posts(self, source_ids):
+        return dict(ImportedPost.objects.filter(
+            source=self.source, source_id__in=source_ids).values_list(
+            'source_id', 'post_id'))
+
+    def build_posts(self, records, skipped):
+        self.resolve_users(record['author'] for record in records)
+        slugs = {record.get('group') for record in records} - {None, ''}
+        self.group_slugs.update(slugs)
+        source_ids = [int(record['id']) if record.get('id') else None
+                      for record in records]
+        loaded = self.imported_posts(set(source_ids) - {None})
+        posts = []
+        for number, (record, source_id) in enumerate(
+                zip(records, source_ids)):
+            if source_id in loaded:
+                skipped.append((
+                    number,
+                    f'пост {source_id} уже загружен как {loaded[source_id]}'))
+                continue
+            if source_id is not None:
+                loaded[source_id] = None
+            post = Post(author_id=self.users[record['author']],
+                        group_id=self.groups.get(record.get('group')),
+                        text=record['text'],
+                        pub_date=self.date(record.get('pub_date')),
+                        image=record.get('image') or '')
+            post.source_id = source_id
+            posts.append(post)
+        self.assign_ids(posts)
+        return Post, posts
+
+    def assign_ids(self, posts):
+        """Новые id выдаются явно, как в seed: bulk_create в SQLite
+        не возвращает id вставленных строк. Транзакция порции держит
+        блокировку записи, поэтому id не займёт параллельный запрос."""
+        start = (Post.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+        for number, post in enumerate(posts):
+            post.pk = start + number
+
+    def build_comments(self, records, skipped):
+        """post — id поста в файле постов той же выгрузки. Если такой
+        пост не загружался, это id поста на сайте."""
+        self.resolve_users(record['author'] for record in records)
+        source_ids = {int(record['post']) for record in records}
+        post_ids = self.imported_posts(source_ids)
+        unmapped = source_ids - post_ids.keys()
+        post_ids.update((pk, pk) for pk in Post.objects.filter(
+            pk__in=unmapped).values_list('pk', flat=True))
+        comments = []
+        for number, record in enumerate(records):
+            post_id = post_ids.get(int(record['post']))
+            if post_id is None:
+                skipped.append((number, f'нет поста {record["post"]}'))
+                continue
+            comments.append(Comment(
+                post_id=post_id,
+                author_id=self.users[record['author']],
+                text=record['text'],
+                created=self.date(record.get('created'))))
+        return Comment, comments
+
+    def refresh_groups(self):
+        self.groups = dict(Group.objects.values_list('slug', 'pk'))
+
+
+class Command(BaseCommand):
+    help = ('Загружает группы, посты, комментарии и подписки из JSONL '
+            'или CSV. Пишет bulk_create пачками в отдельных транзакциях, '
+            'после обрыва продолжает с места остановки; счётчики, поиск '
+            'и ленты обновляются один раз в конце.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='+',
+            help='Файлы для загрузки, по порядку: группы и пользователи '
+                 'раньше постов, посты раньше комментариев.')
+        parser.add_argument(
+            '--kind', choices=KINDS,
+            help='Что лежит в файлах. По умолчанию — по имени файла '
+                 '(posts.jsonl, comments.csv...).')
+        parser.add_argument(
+            '--format', choices=FORMATS, dest='file_format',
+            help='Формат файлов. По умолчанию — по расширению.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Строк в одном INSERT.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Записей в одной транзакции.')
+        parser.add_argument(
+            '--source',
+            help='Имя выгрузки: id постов сопоставляются только между '
+                 'файлами одной выгрузки. По умолчанию — каталог файла.')
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Забыть сохранённый прогресс и загрузить файлы заново.')
+
+    def handle(self, *args, **options):
+        if sharding.enabled():
+            # bulk_create пишет в default, мимо шарда автора.
+            raise CommandError(
+                'С POST_SHARDS загрузка не поддерживается: посты попали '
+                'бы в default, а не в шарды своих авторов.')
+        importer = Importer()
+        for path in options['paths']:
+            self.import_file(importer, path, options)
+        self.stdout.write('Пересчёт счётчиков, поиска и лент...')
+        bulk.finish(importer.group_slugs, importer.usernames)
+        self.stdout.write('Готово.')
+
+    def import_file(self, importer, path, options):
+        name, extension = os.path.splitext(os.path.basename(path))
+        kind = options['kind'] or name
+        file_format = options['file_format'] or extension.lstrip('.')
+        if kind not in KINDS:
+            raise CommandError(f'{path}: укажите --kind, одно из {KINDS}')
+        if file_format not in FORMATS:
+            raise CommandError(f'{path}: укажите --format, одно из {FORMATS}')
+
+        importer.source = (
+            options['source'] or os.path.dirname(os.path.abspath(path)))
+        progress, _ = ImportProgress.objects.get_or_create(
+            source=f'{kind}:{os.path.abspath(path)}')
+        if options['restart']:
+            progress.position = 0
+        records = islice(
+            read_records(path, file_format), progress.position, None)
+        started = time.monotonic()
+        loaded = 0
+        skipped = []
+        while True:
+            chunk = list(islice(records, options['chunk_size']))
+            if not chunk:
+                break
+            with transaction.atomic():
+                skipped.extend(
+                    (progress.position + number + 1, reason)
+                    for number, reason in importer.load(
+                        kind, chunk, options['batch_size']))
+                progress.position += len(chunk)
+                ImportProgress.objects.filter(pk=progress.pk).update(
+                    position=progress.position)
+            loaded += len(chunk)
+        if kind == 'groups':
+            importer.refresh_groups()
+        elapsed = time.monotonic() - started
+        rate = loaded / elapsed if elapsed else loaded
+        self.stdout.write(
+            f'{path}: {kind} — {loaded} записей за {elapsed:.1f} с '
+            f'({rate:.0f} в секунду), пропущено {len(skipped)}, '
+            f'всего обработано {progress.position}')
+        for number, reason in skipped[:SKIPPED_SHOWN]:
+            self.stderr.write(f'{path}: запись {number} пропущена: {reason}')
+        if len(skipped) > SKIPPED_SHOWN:
+            self.stderr.write(
+                f'{path}: и ещё {len(skipped) - SKIPPED_SHOWN} пропущено')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = ('Перестраивает полнотекстовый индекс постов, например после '
+            'массовой загрузки в обход сигналов.')
+
+    def handle(self, *args, **options):
+        if not search.available():
+            self.stdout.write('Полнотекстовый индекс нужен только для SQLite.')
+            return
+        with transaction.atomic():
+            indexed = search.rebuild()
+        self.stdout.write(f'Проиндексировано постов: {indexed}')
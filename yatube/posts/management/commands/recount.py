@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.counters import recount
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает денормализованные счётчики постов, '
+            'комментариев и подписок по фактическим данным.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = recount()
+        for name, rows in fixed.items():
+            self.stdout.write(f'{name}: исправлено строк — {rows}')
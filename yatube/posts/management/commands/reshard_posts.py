@@ -0,0 +1,69 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import sharding
+
+User = get_user_model()
+
+# Секунды между запретом записи и копированием: запросы, выбравшие
+# прежний шард до запрета, успевают дописать.
+DEFAULT_GRACE = 1.0
+
+
+class Command(BaseCommand):
+    help = ('Переносит авторов вместе с постами и комментариями между '
+            'шардами POST_SHARDS без остановки сайта: на время переноса '
+            'запись для автора запрещена, чтение идёт из прежнего шарда.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', metavar='username')
+        parser.add_argument('--to', dest='target', help='Шард назначения.')
+        parser.add_argument(
+            '--rebalance', action='store_true',
+            help='Выровнять число постов по шардам, перенося целых '
+                 'авторов, например после добавления шарда.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать переносы.')
+        parser.add_argument('--grace', type=float, default=DEFAULT_GRACE)
+        parser.add_argument(
+            '--batch-size', type=int, default=sharding.MOVE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('POST_SHARDS не задан: шардирование выключено.')
+        if options['rebalance']:
+            moves = sharding.rebalance_plan(sharding.loads())
+        elif options['usernames'] and options['target']:
+            moves = self.author_moves(options['usernames'], options['target'])
+        else:
+            raise CommandError('Укажите авторов и --to или --rebalance.')
+        names = dict(User.objects.filter(
+            pk__in=[author_id for author_id, _, _ in moves]).values_list(
+            'pk', 'username'))
+        for author_id, source, target in moves:
+            name = names.get(author_id, author_id)
+            if options['dry_run']:
+                self.stdout.write(f'{name}: {source} -> {target}')
+                continue
+            posts, comments = sharding.move_author(
+                author_id, target, options['grace'], options['batch_size'])
+            self.stdout.write(
+                f'{name}: {source} -> {target}, постов {posts}, '
+                f'комментариев {comments}')
+
+    def author_moves(self, usernames, target):
+        if target not in sharding.shards():
+            raise CommandError(f'Шарда {target} нет в POST_SHARDS.')
+        authors = dict(User.objects.filter(
+            username__in=usernames).values_list('username', 'pk'))
+        missing = set(usernames) - set(authors)
+        if missing:
+            raise CommandError(
+                f'Нет пользователей: {", ".join(sorted(missing))}')
+        moves = []
+        for username in usernames:
+            source = sharding.author_shard(authors[username])
+            if source != target:
+                moves.append((authors[username], source, target))
+        return moves
@@ -0,0 +1,316 @@
+import io
+import random
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from posts import bulk, sharding
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+# Предложений в словаре, из которого собираются тексты.
+TEXT_POOL_SIZE = 2000
+# Показатель распределения Парето для подписок и комментариев: хвост
+# тяжёлый, среднее равно заданному.
+PARETO_ALPHA = 2.0
+GROUP_RATIO = 0.7
+IMAGE_SIZE = (960, 339)
+# Пачек в работе на один процесс пула: готовые строки не копятся
+# в памяти, пока единственный пишущий процесс отстаёт.
+BATCHES_PER_WORKER = 2
+
+# Параметры генерации; воркеры получают их целиком, поэтому любая
+# пачка воспроизводится по (seed, вид, номер пачки) независимо от того,
+# какой процесс её строит.
+Spec = namedtuple('Spec', [
+    'seed', 'users', 'groups', 'posts', 'comments', 'follows', 'skew',
+    'images', 'image_ratio', 'start', 'days', 'chunk_size', 'batch_size',
+    'user_base', 'group_base', 'post_base',
+])
+
+
+def rng_for(spec, kind, batch):
+    return random.Random(f'{spec.seed}:{kind}:{batch}')
+
+
+@lru_cache(maxsize=None)
+def zipf_weights(size, skew):
+    """Накопленные веса закона Ципфа: первые элементы популярнее."""
+    return list(accumulate(1 / (rank + 1) ** skew for rank in range(size)))
+
+
+@lru_cache(maxsize=None)
+def text_pool(seed):
+    try:
+        from faker import Faker
+    except ImportError:
+        raise CommandError('Для seed нужен Faker из requirements.txt')
+    fake = Faker('ru_RU')
+    fake.seed_instance(seed)
+    return [fake.sentence(nb_words=12) for _ in range(TEXT_POOL_SIZE)]
+
+
+def heavy_tail(rng, mean):
+    return int(mean * (rng.paretovariate(PARETO_ALPHA) - 1) + 0.5)
+
+
+def pick_users(rng, spec, count):
+    weights = zipf_weights(spec.users, spec.skew)
+    return rng.choices(range(spec.users), cum_weights=weights, k=count)
+
+
+def post_rows(spec, batch):
+    """Посты пачки: (id, автор, группа, текст, дата, картинка)."""
+    rng = rng_for(spec, 'posts', batch)
+    texts = text_pool(spec.seed)
+    first = batch * spec.chunk_size
+    last = min(first + spec.chunk_size, spec.posts)
+    authors = pick_users(rng, spec, last - first)
+    group_weights = zipf_weights(spec.groups, spec.skew)
+    step = timedelta(days=spec.days) / max(spec.posts, 1)
+    rows = []
+    for number, author in zip(range(first, last), authors):
+        group = None
+        if spec.groups and rng.random() < GROUP_RATIO:
+            group = spec.group_base + rng.choices(
+                range(spec.groups), cum_weights=group_weights)[0]
+        image = ''
+        if spec.images and rng.random() < spec.image_ratio:
+            image = image_name(spec, rng.randrange(spec.images))
+        rows.append((
+            spec.post_base + number,
+            spec.user_base + author,
+            group,
+            ' '.join(rng.choices(texts, k=rng.randint(1, 6))),
+            spec.start + step * number + timedelta(
+                seconds=rng.randrange(3600)),
+            image,
+        ))
+    return rows
+
+
+def comment_rows(spec, batch):
+    """Комментарии к постам пачки: (пост, автор, текст, дата)."""
+    rng = rng_for(spec, 'comments', batch)
+    texts = text_pool(spec.seed)
+    first = batch * spec.chunk_size
+    last = min(first + spec.chunk_size, spec.posts)
+    step = timedelta(days=spec.days) / max(spec.posts, 1)
+    rows = []
+    for number in range(first, last):
+        count = heavy_tail(rng, spec.comments)
+        created = spec.start + step * number
+        for author in pick_users(rng, spec, count):
+            created += timedelta(seconds=rng.randrange(1, 3600))
+            rows.append((spec.post_base + number, spec.user_base + author,
+                         rng.choice(texts), created))
+    return rows
+
+
+def follow_rows(spec, batch):
+    """Подписки пользователей пачки: (подписчик, автор). Число подписок
+    распределено по Парето, авторы выбираются по популярности."""
+    rng = rng_for(spec, 'follows', batch)
+    first = batch * spec.chunk_size
+    last = min(first + spec.chunk_size, spec.users)
+    rows = []
+    for user in range(first, last):
+        count = min(heavy_tail(rng, spec.follows), spec.users - 1)
+        authors = set(pick_users(rng, spec, count)) - {user}
+        rows.extend((spec.user_base + user, spec.user_base + author)
+                    for author in sorted(authors))
+    return rows
+
+
+def bounded_map(pool, window, build_rows, spec, batches):
+    """Как pool.map, но в работе не больше window пачек сразу;
+    результаты идут в порядке пачек."""
+    pending = deque()
+    for batch in batches:
+        pending.append(pool.submit(build_rows, spec, batch))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def image_name(spec, number):
+    return f'posts/seed/seed_{spec.seed}_{number}.jpg'
+
+
+def image_bytes(spec, number):
+    from PIL import Image
+
+    rng = rng_for(spec, 'images', number)
+    color = tuple(rng.randrange(256) for _ in range(3))
+    buffer = io.BytesIO()
+    Image.new('RGB', IMAGE_SIZE, color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими данными для нагрузочных тестов: '
+            'пользователи с неравномерной активностью, группы, посты, '
+            'граф подписок со степенным распределением, комментарии и '
+            'картинки. При одинаковом --seed на пустой базе результат '
+            'одинаков.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument(
+            '--comments', type=float, default=2,
+            help='Среднее число комментариев на пост.')
+        parser.add_argument(
+            '--follows', type=float, default=10,
+            help='Среднее число подписок на пользователя.')
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help='Показатель закона Ципфа для авторов и групп.')
+        parser.add_argument(
+            '--images', type=int, default=10,
+            help='Сколько разных картинок создать.')
+        parser.add_argument(
+            '--image-ratio', type=float, default=0.2,
+            help='Доля постов с картинкой.')
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько дней от 2020-01-01 распределить посты.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Строк в одном INSERT.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Строк в одной пачке генерации и транзакции.')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Процессов, генерирующих строки; пишет в базу один.')
+
+    def handle(self, *args, **options):
+        if sharding.enabled():
+            # bulk_create пишет в default, мимо шарда автора.
+            raise CommandError(
+                'С POST_SHARDS seed не поддерживается: посты попали бы '
+                'в default, а не в шарды своих авторов.')
+        spec = Spec(
+            seed=options['seed'],
+            users=options['users'],
+            groups=options['groups'],
+            posts=options['posts'],
+            comments=options['comments'],
+            follows=options['follows'],
+            skew=options['skew'],
+            images=options['images'],
+            image_ratio=options['image_ratio'],
+            start=datetime(2020, 1, 1, tzinfo=timezone.utc),
+            days=options['days'],
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+            user_base=self.next_id(User),
+            group_base=self.next_id(Group),
+            post_base=self.next_id(Post),
+        )
+        if spec.users < 1:
+            raise CommandError('Нужен хотя бы один пользователь')
+        if (User.objects.filter(username=f'seed{spec.seed}_0').exists()
+                or Group.objects.filter(slug=f'seed{spec.seed}-0').exists()):
+            raise CommandError(
+                f'Данные с --seed {spec.seed} уже загружены: имена '
+                f'пользователей и слаги групп совпали бы. Выберите '
+                f'другой --seed.')
+        self.seed_users(spec)
+        self.seed_groups(spec)
+        self.seed_images(spec)
+        pool = None
+        if options['workers'] > 1:
+            pool = ProcessPoolExecutor(max_workers=options['workers'])
+        self.window = BATCHES_PER_WORKER * options['workers']
+        try:
+            self.load(pool, spec, post_rows, spec.posts, Post, (
+                'id', 'author_id', 'group_id', 'text', 'pub_date', 'image'))
+            self.load(pool, spec, comment_rows, spec.posts, Comment, (
+                'post_id', 'author_id', 'text', 'created'))
+            self.load(pool, spec, follow_rows, spec.users, Follow, (
+                'user_id', 'author_id'))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write('Пересчёт счётчиков, поиска и лент...')
+        bulk.finish(
+            Group.objects.filter(pk__gte=spec.group_base).values_list(
+                'slug', flat=True),
+            User.objects.filter(pk__gte=spec.user_base).values_list(
+                'username', flat=True),
+        )
+        self.stdout.write('Готово.')
+
+    def next_id(self, model):
+        return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+    def seed_users(self, spec):
+        password = make_password(None)
+        bulk.insert(
+            User,
+            (User(id=spec.user_base + number,
+                  username=f'seed{spec.seed}_{number}', password=password)
+             for number in range(spec.users)),
+            spec.batch_size,
+        )
+
+    def seed_groups(self, spec):
+        bulk.insert(
+            Group,
+            (Group(id=spec.group_base + number,
+                   slug=f'seed{spec.seed}-{number}',
+                   title=f'Группа {number}',
+                   description=text_pool(spec.seed)[
+                       number % TEXT_POOL_SIZE])
+             for number in range(spec.groups)),
+            spec.batch_size,
+        )
+
+    def seed_images(self, spec):
+        for number in range(spec.images):
+            name = image_name(spec, number)
+            if not default_storage.exists(name):
+                default_storage.save(
+                    name, ContentFile(image_bytes(spec, number)))
+
+    def load(self, pool, spec, build_rows, total, model, fields):
+        """Строки пачек строятся в пуле процессов (или здесь же),
+        порядок пачек сохраняется; запись — пачками в транзакциях."""
+        batches = range(-(-total // spec.chunk_size))
+        if pool:
+            rows_by_batch = bounded_map(
+                pool, self.window, build_rows, spec, batches)
+        else:
+            rows_by_batch = (build_rows(spec, batch) for batch in batches)
+        started = time.monotonic()
+        loaded = 0
+        for rows in rows_by_batch:
+            with transaction.atomic():
+                # raw: даты постов и комментариев сохраняются как есть.
+                bulk.insert(
+                    model, (model(**dict(zip(fields, row))) for row in rows),
+                    spec.batch_size, raw=True)
+            loaded += len(rows)
+        elapsed = time.monotonic() - started
+        rate = loaded / elapsed if elapsed else loaded
+        self.stdout.write(
+            f'{model._meta.verbose_name_plural}: {loaded} строк '
+            f'за {elapsed:.1f} с ({rate:.0f} в секунду)')
@@ -0,0 +1,51 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, repeat
+
+from django.core.management.base import BaseCommand
+
+from posts import sharding
+from posts.models import Post
+from posts.thumbnails import generate_in_worker
+
+
+class Command(BaseCommand):
+    help = ('Параллельно создаёт миниатюры и адаптивные варианты для '
+            'всех картинок постов. Готовые файлы повторно не '
+            'пересчитываются. С шардированием обходит все шарды.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Число потоков генерации.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Сколько картинок читать из базы за раз.')
+
+    def images(self, shard, chunk_size):
+        """Пары (id, картинка) постов шарда; shard=None — без
+        шардирования."""
+        return Post.objects.using(shard).exclude(image='').values_list(
+            'pk', 'image').order_by().iterator(chunk_size=chunk_size)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for shard in sharding.shards() or [None]:
+                images = self.images(shard, options['chunk_size'])
+                # Пачками, чтобы не держать в памяти future
+                # на каждую картинку.
+                while True:
+                    chunk = list(islice(images, options['chunk_size']))
+                    if not chunk:
+                        break
+                    post_ids, names = zip(*chunk)
+                    for errors in pool.map(generate_in_worker, post_ids,
+                                           names, repeat(shard)):
+                        done += 1
+                        failed += bool(errors)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Картинок обработано: {done}, с ошибками: {failed}, '
+            f'за {elapsed:.1f} с')
@@ -0,0 +1,26 @@
+from django.http import HttpResponse
+
+from . import sharding
+
+# Секунды до повтора: перенос автора обычно короче.
+SHARD_MOVING_RETRY_AFTER = 5
+
+
+class ShardMovingMiddleware:
+    """Запись автора, которого переносит reshard_posts, — не ошибка
+    сервера: 503 с Retry-After, форму можно отправить ещё раз."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, sharding.ShardMoving):
+            return None
+        response = HttpResponse(
+            'Посты автора сейчас переносятся. Повторите через несколько '
+            'секунд.', status=503, content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = SHARD_MOVING_RETRY_AFTER
+        return response
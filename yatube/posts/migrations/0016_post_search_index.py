@@ -0,0 +1,34 @@
+from django.db import DEFAULT_DB_ALIAS, migrations
+
+# Таблица и её заполнение записаны здесь, а не берутся из posts.search:
+# миграция не должна меняться вместе с текущим кодом.
+SEARCH_TABLE = 'posts_post_fts'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} '
+        f"USING fts5(text, tokenize='unicode61')")
+    # Индекс поиска живёт в default; шардам постов нужна только схема.
+    if schema_editor.connection.alias == DEFAULT_DB_ALIAS:
+        schema_editor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, text) '
+            f'SELECT id, text FROM posts_post')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_post_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
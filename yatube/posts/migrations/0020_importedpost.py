@@ -0,0 +1,30 @@
+# Generated by Django 2.2.19 on 2026-10-18 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_sharding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedPost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=500, verbose_name='Выгрузка')),
+                ('source_id', models.BigIntegerField(verbose_name='Id в файле')),
+                ('post_id', models.BigIntegerField(verbose_name='Id поста')),
+            ],
+            options={
+                'verbose_name': 'Загруженный пост',
+                'verbose_name_plural': 'Загруженные посты',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='importedpost',
+            constraint=models.UniqueConstraint(fields=('source', 'source_id'), name='unique_imported_post'),
+        ),
+    ]
@@ -9,6 +9,8 @@ class Group(models.Model):
     title = models.CharField('Группа', max_length=200)
     slug = models.SlugField('Слаг', unique=True, max_length=200)
     description = models.TextField('Описание группы')
+    posts_count = models.PositiveIntegerField(
+        'Число постов', default=0, editable=False)
 
     def __str__(self):
         return self.title
@@ -22,11 +24,14 @@ class Post(models.Model):
     text = models.TextField('Текст поста',
                             help_text='Введите текст поста')
     pub_date = models.DateTimeField('Дата поста', auto_now_add=True)
+    # Автор и группа живут в default, а пост может лежать в шарде
+    # (posts.sharding): ограничения внешних ключей только на уровне ORM.
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         verbose_name='Автор',
-        related_name='posts'
+        related_name='posts',
+        db_constraint=False
     )
     group = models.ForeignKey(
         Group,
@@ -35,7 +40,8 @@ class Post(models.Model):
         null=True,
         related_name='posts',
         verbose_name='Группа',
-        help_text='Группа, к которой будет относиться пост'
+        help_text='Группа, к которой будет относиться пост',
+        db_constraint=False
     )
 
     # Поле для картинки (необязательное)
@@ -46,14 +52,29 @@ class Post(models.Model):
     )
     # Аргумент upload_to указывает директорию,
     # в которую будут загружаться пользовательские файлы.
+    # Манифест адаптивных вариантов картинки (JSON), см. posts.thumbnails.
+    image_variants = models.TextField(
+        'Варианты картинки', blank=True, editable=False)
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев', default=0, editable=False)
 
     def __str__(self):
         return self.text[:POST_TEXT]
 
     class Meta:
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Индексы повторяют порядок курсорной пагинации (pub_date, id),
+        # поэтому ленты читаются срезом индекса без сортировки.
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_idx'),
+        ]
 
 
 class Comment(models.Model):
@@ -65,7 +86,8 @@ class Comment(models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
-        related_name='comments'
+        related_name='comments',
+        db_constraint=False
     )
     text = models.TextField(
         'Текст комментария',
@@ -75,6 +97,15 @@ class Comment(models.Model):
     def __str__(self):
         return self.text
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created', 'id'],
+                         name='comment_post_created_idx'),
+            # Порядок списка комментариев в админке.
+            models.Index(fields=['-created', '-id'],
+                         name='comment_created_idx'),
+        ]
+
 
 class Follow(models.Model):
     """user — ссылка на объект пользователя, который подписывается.
@@ -95,3 +126,110 @@ class Follow(models.Model):
             models.UniqueConstraint(fields=['user', 'author'],
                                     name='unique_follow'),
         ]
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
+
+
+class AuthorStats(models.Model):
+    """Денормализованные счётчики автора.
+    Обновляются сигналами в той же транзакции, что и изменение данных;
+    расхождения чинит команда recount."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Число подписок', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчики автора'
+        verbose_name_plural = 'Счётчики авторов'
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента подписок (fan-out-on-write).
+    Строка на пару подписчик — пост; pub_date и author продублированы,
+    чтобы страница ленты читалась одним срезом индекса."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_feed_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author_idx'),
+        ]
+
+
+class ImportProgress(models.Model):
+    """Сколько записей файла уже загрузила команда import_posts.
+    Обновляется в одной транзакции с загруженной пачкой, поэтому
+    прерванный импорт продолжается ровно с места остановки."""
+    source = models.CharField('Источник', max_length=500, unique=True)
+    position = models.PositiveIntegerField('Загружено записей', default=0)
+
+    class Meta:
+        verbose_name = 'Прогресс импорта'
+        verbose_name_plural = 'Прогресс импорта'
+
+
+class ImportedPost(models.Model):
+    """Id поста в файле import_posts и id, под которым он загружен.
+    source — выгрузка, из которой взят файл: id из разных выгрузок
+    совпадают, не означая один пост. По паре (source, source_id)
+    комментарии из файла находят свой пост, а повторно загружаемый
+    пост пропускается."""
+    source = models.CharField('Выгрузка', max_length=500)
+    source_id = models.BigIntegerField('Id в файле')
+    post_id = models.BigIntegerField('Id поста')
+
+    class Meta:
+        verbose_name = 'Загруженный пост'
+        verbose_name_plural = 'Загруженные посты'
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'source_id'],
+                                    name='unique_imported_post'),
+        ]
+
+
+class AuthorShard(models.Model):
+    """Шард, в котором лежат посты автора и комментарии к ним.
+    Строка появляется при первой записи автора; moving — автор
+    переносится командой reshard_posts, запись для него запрещена."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='+'
+    )
+    shard = models.CharField('Шард', max_length=100)
+    moving = models.BooleanField('Переносится', default=False)
+
+    class Meta:
+        verbose_name = 'Шард автора'
+        verbose_name_plural = 'Шарды авторов'
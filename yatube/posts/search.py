@@ -0,0 +1,152 @@
+"""Полнотекстовый поиск по постам на SQLite FTS5.
+
+Текст постов копируется в виртуальную таблицу FTS5 с rowid, равным id
+поста; сигналы держат её в актуальном состоянии, команда
+rebuild_search_index перестраивает целиком. На других СУБД поиск
+сводится к icontains без ранжирования.
+"""
+import re
+from itertools import islice
+
+from django.db import connection
+
+from . import sharding
+from .models import Post
+from .utils import CURSOR_NEXT, CursorPaginator
+
+SEARCH_TABLE = 'posts_post_fts'
+# Постов в одной пачке при перестройке индекса из шардов.
+REBUILD_BATCH_SIZE = 2000
+# Слова запроса; знаки операторов FTS5 в запрос не попадают.
+WORD_RE = re.compile(r'\w+')
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """Запрос пользователя в выражение MATCH: все слова обязательны,
+    последнее ищется по префиксу. Пустая строка — искать нечего."""
+    words = WORD_RE.findall(query.lower())
+    if not words:
+        return ''
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def index_post(post):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, text) VALUES (%s, %s)',
+            [post.pk, post.text])
+
+
+def remove_post(post_id):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [post_id])
+
+
+def rebuild():
+    """Перестраивает индекс по всем постам. Возвращает число постов.
+    С шардированием посты читаются из каждого шарда пачками: индекс
+    лежит в default, и INSERT ... SELECT видит только его посты."""
+    if not available():
+        return 0
+    table = Post._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        if not sharding.enabled():
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, text) '
+                f'SELECT id, text FROM {table}')
+        for shard in sharding.shards():
+            rows = Post.objects.using(shard).values_list(
+                'id', 'text').iterator(chunk_size=REBUILD_BATCH_SIZE)
+            while True:
+                batch = list(islice(rows, REBUILD_BATCH_SIZE))
+                if not batch:
+                    break
+                cursor.executemany(
+                    f'INSERT INTO {SEARCH_TABLE} (rowid, text) '
+                    f'VALUES (%s, %s)', batch)
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) "
+            f"VALUES ('optimize')")
+    return sum(Post.objects.using(shard).count()
+               for shard in sharding.shards() or [None])
+
+
+def filter_posts(queryset, query):
+    """Посты queryset, подходящие под запрос (без ранжирования)."""
+    if not available():
+        return queryset.filter(text__icontains=query)
+    match = match_expression(query)
+    if not match:
+        return queryset.none()
+    # pk__in=RawSQL(...) даёт IN ((SELECT ...)), а SQLite считает
+    # подзапрос в двойных скобках скалярным — только первая строка.
+    table = queryset.model._meta.db_table
+    return queryset.extra(where=[
+        f'"{table}"."id" IN (SELECT rowid FROM {SEARCH_TABLE} '
+        f'WHERE {SEARCH_TABLE} MATCH %s)'], params=[match])
+
+
+class SearchPaginator(CursorPaginator):
+    """Результаты поиска по убыванию релевантности (-bm25), затем id.
+    Курсор хранит пару (релевантность, id), как ленты — (дату, id)."""
+    dump_value = staticmethod(repr)
+    load_value = staticmethod(float)
+
+    def __init__(self, query, per_page):
+        queryset = Post.objects.select_related('author', 'group')
+        super().__init__(queryset, per_page, date_field='score')
+        self.match = match_expression(query)
+
+    def fetch(self, position, direction, limit):
+        if not self.match:
+            return []
+        sql = (
+            f'SELECT id, score FROM ('
+            f'SELECT rowid AS id, -bm25({SEARCH_TABLE}) AS score '
+            f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s)')
+        params = [self.match]
+        if position is not None:
+            score, pk = position
+            sign = '<' if direction == CURSOR_NEXT else '>'
+            sql += (f' WHERE score {sign} %s '
+                    f'OR (score = %s AND id {sign} %s)')
+            params += [score, score, pk]
+        order = 'DESC' if direction == CURSOR_NEXT else 'ASC'
+        sql += f' ORDER BY score {order}, id {order} LIMIT %s'
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            ranked = cursor.fetchall()
+        posts = sharding.in_bulk(
+            self.object_list, [pk for pk, _ in ranked])
+        result = []
+        for pk, score in ranked:
+            # Пост мог быть удалён между запросами.
+            if pk in posts:
+                posts[pk].score = score
+                result.append(posts[pk])
+        return result
+
+
+def search_paginator(query, per_page):
+    """Ранжированная выдача на FTS5, иначе — совпадения подстроки
+    в обычном порядке лент."""
+    if available():
+        return SearchPaginator(query, per_page)
+    return CursorPaginator(
+        filter_posts(Post.objects.select_related('author', 'group'), query),
+        per_page)
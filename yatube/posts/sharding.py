@@ -0,0 +1,350 @@
+"""Шардирование постов и комментариев по автору.
+
+Посты автора и комментарии к ним лежат в одной базе из
+settings.POST_SHARDS; пользователи, группы, подписки, счётчики и
+поисковый индекс остаются в default. Шард автора записывается в
+каталог AuthorShard (в default) при первой записи. Автор без записи
+живёт в первом шарде — там же остаются данные, созданные до
+шардирования, поэтому POST_SHARDS = ['default', ...] включает
+шардирование без переноса. Переносит авторов команда reshard_posts.
+
+Id постов и комментариев выдаёт next_id: они уникальны во всех шардах
+и не меняются при переносе. Ленты читаются со всех нужных шардов и
+сливаются по (pub_date, id); автор и группа подставляются из default
+отдельными запросами, JOIN между базами невозможен.
+
+Шард выбирает ShardRouter при save(); QuerySet.create и bulk_create
+передают базу явно и пишут в default. Без POST_SHARDS всё хранится
+в default, как раньше.
+"""
+import os
+import threading
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+
+from . import bulk
+from .models import (AuthorShard, Comment, Follow, Post, TimelineEntry,
+                     User)
+from .timeline import MergedCursorPaginator
+from .utils import CursorPaginator
+
+# Связи, которые подставляются из default.
+RELATIONS = {Post: ('author', 'group'), Comment: ('author',)}
+MOVE_BATCH_SIZE = 500
+
+# Id: миллисекунды от ID_EPOCH_MS, номер процесса и счётчик внутри
+# миллисекунды, как в Snowflake. Хватает на 69 лет и 4096 id
+# в миллисекунду на процесс.
+ID_EPOCH_MS = 1609459200000  # 2021-01-01 UTC
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+
+_id_lock = threading.Lock()
+# Миллисекунда и счётчик последнего выданного id.
+_last_id = [0, 0]
+
+# Удаление автора из прежнего шарда после переноса. Сырой SQL:
+# delete() отправил бы сигналы и уменьшил счётчики и индекс поиска.
+DELETE_SQL = [
+    sql.format(
+        comment=Comment._meta.db_table,
+        post=Post._meta.db_table,
+        timeline=TimelineEntry._meta.db_table,
+    )
+    for sql in (
+        'DELETE FROM {comment} WHERE post_id IN '
+        '(SELECT id FROM {post} WHERE author_id = %s)',
+        # Ленты подписок есть только у постов, созданных
+        # до шардирования в default.
+        'DELETE FROM {timeline} WHERE post_id IN '
+        '(SELECT id FROM {post} WHERE author_id = %s)',
+        'DELETE FROM {post} WHERE author_id = %s',
+    )
+]
+
+
+class ShardMoving(Exception):
+    """Автор переносится между шардами: запись нужно повторить позже."""
+
+
+def enabled():
+    return bool(settings.POST_SHARDS)
+
+
+def shards():
+    return settings.POST_SHARDS
+
+
+def worker_id():
+    """Номер процесса в id; POST_SHARD_WORKER_ID задаёт его явно,
+    когда процессы работают на нескольких машинах."""
+    if settings.POST_SHARD_WORKER_ID is not None:
+        return settings.POST_SHARD_WORKER_ID
+    return os.getpid() % (1 << WORKER_BITS)
+
+
+def next_id():
+    with _id_lock:
+        now = int(time.time() * 1000) - ID_EPOCH_MS
+        last, sequence = _last_id
+        if now > last:
+            sequence = 0
+        else:
+            # Та же миллисекунда или часы отстали: продолжаем от last.
+            now = last
+            sequence = (sequence + 1) & SEQUENCE_MASK
+            if not sequence:
+                now += 1
+        _last_id[:] = now, sequence
+    return (now << WORKER_BITS | worker_id()) << SEQUENCE_BITS | sequence
+
+
+def author_shard(author_id):
+    """Шард, из которого читаются посты автора; None без шардирования."""
+    if not enabled():
+        return None
+    entry = AuthorShard.objects.using(DEFAULT_DB_ALIAS).filter(
+        pk=author_id).values_list('shard', flat=True).first()
+    return entry or shards()[0]
+
+
+def shard_for_write(author_id):
+    """Шард для записи постов автора. При первой записи автор
+    закрепляется за шардом: за первым, если там его старые посты,
+    иначе по остатку от деления id."""
+    first = shards()[0]
+    entry = AuthorShard.objects.using(DEFAULT_DB_ALIAS).filter(
+        pk=author_id).first()
+    if entry is None:
+        shard = shards()[author_id % len(shards())]
+        if Post.objects.using(first).filter(author_id=author_id).exists():
+            shard = first
+        entry, _ = AuthorShard.objects.using(
+            DEFAULT_DB_ALIAS).get_or_create(
+            pk=author_id, defaults={'shard': shard})
+    if entry.moving:
+        raise ShardMoving(f'Автор {author_id} переносится из {entry.shard}.')
+    return entry.shard
+
+
+def placement(author_ids):
+    """{шард: [id авторов]} одним запросом к каталогу."""
+    author_ids = set(author_ids)
+    placed = {}
+    for author_id, shard in AuthorShard.objects.using(
+            DEFAULT_DB_ALIAS).filter(pk__in=author_ids).values_list(
+            'pk', 'shard'):
+        placed.setdefault(shard, []).append(author_id)
+        author_ids.discard(author_id)
+    if author_ids:
+        placed.setdefault(shards()[0], []).extend(author_ids)
+    return placed
+
+
+def post_shard(post_id):
+    """Шард поста по id; None без шардирования или если поста нет."""
+    if not enabled():
+        return None
+    for shard in shards():
+        if Post.objects.using(shard).filter(pk=post_id).exists():
+            return shard
+    return None
+
+
+def attach(objects):
+    """Подставляет связи из RELATIONS одним запросом на связь."""
+    objects = list(objects)
+    if not objects:
+        return objects
+    model = type(objects[0])
+    for name in RELATIONS[model]:
+        field = model._meta.get_field(name)
+        related = field.related_model._default_manager.in_bulk(
+            {getattr(obj, field.attname) for obj in objects} - {None})
+        for obj in objects:
+            field.set_cached_value(
+                obj, related.get(getattr(obj, field.attname)))
+    return objects
+
+
+def get_post_or_404(queryset, **lookup):
+    """get_object_or_404 для постов: с шардированием пост ищется
+    по всем шардам."""
+    if not enabled():
+        return get_object_or_404(queryset, **lookup)
+    queryset = queryset.select_related(None)
+    for shard in shards():
+        post = queryset.using(shard).filter(**lookup).first()
+        if post is not None:
+            return attach([post])[0]
+    raise Http404('Пост не найден.')
+
+
+def in_bulk(queryset, ids):
+    """QuerySet.in_bulk по всем шардам."""
+    if not enabled():
+        return queryset.in_bulk(ids)
+    queryset = queryset.select_related(None)
+    found = {}
+    for shard in shards():
+        found.update(queryset.using(shard).in_bulk(ids))
+    attach(found.values())
+    return found
+
+
+class ShardedPaginator(MergedCursorPaginator):
+    """Курсорная лента из нескольких шардов: срез каждого и k-way
+    слияние. Строка, которая во время переноса автора есть в двух
+    шардах, попадает на страницу один раз."""
+
+    def __init__(self, querysets, per_page, **kwargs):
+        super().__init__(
+            (CursorPaginator(queryset.select_related(None), per_page,
+                             **kwargs) for queryset in querysets),
+            per_page, **kwargs)
+
+    def fetch(self, position, direction, limit):
+        return attach(super().fetch(position, direction, limit))
+
+
+def paginator(queryset, per_page, shard=None, **kwargs):
+    """CursorPaginator по queryset; с шардированием — по шарду shard
+    или по всем шардам."""
+    if not enabled():
+        return CursorPaginator(queryset, per_page, **kwargs)
+    names = [shard] if shard else shards()
+    return ShardedPaginator(
+        [queryset.using(name) for name in names], per_page, **kwargs)
+
+
+def follow_paginator(user, per_page):
+    """Лента подписок при чтении: материализованная TimelineEntry
+    ссылается на посты в default, поэтому с шардами не ведётся.
+    Каждый шард читается только по своим авторам."""
+    authors = Follow.objects.filter(user=user).values_list(
+        'author_id', flat=True)
+    return ShardedPaginator(
+        [Post.objects.using(shard).filter(author_id__in=author_ids)
+         for shard, author_ids in placement(authors).items()],
+        per_page)
+
+
+class ShardRouter:
+    """Пост пишется в шард автора, комментарий — в шард поста.
+    Чтения по связанным объектам идут туда, где лежит объект.
+    Остальное решают следующие роутеры."""
+
+    def db_for_read(self, model, **hints):
+        if not enabled() or model not in RELATIONS:
+            return None
+        instance = hints.get('instance')
+        if (isinstance(instance, (Post, Comment))
+                and not instance._state.adding):
+            return instance._state.db
+        if model is Post and isinstance(instance, Comment):
+            # Пост нового комментария, ещё не загруженный.
+            return post_shard(instance.post_id)
+        if model is Post and isinstance(instance, User):
+            return author_shard(instance.pk)
+        return None
+
+    def db_for_write(self, model, **hints):
+        if not enabled() or model not in RELATIONS:
+            return None
+        instance = hints.get('instance')
+        if isinstance(instance, Comment):
+            instance = instance.post
+        if isinstance(instance, Post):
+            return shard_for_write(instance.author_id)
+        if model is Post and isinstance(instance, User):
+            return shard_for_write(instance.pk)
+        return None
+
+
+def copy_rows(queryset, target, batch_size):
+    """Копирует строки queryset в target пачками, не держа их все
+    в памяти. Уже скопированные прерванным переносом пропускаются,
+    даты постов и комментариев не меняются."""
+    rows = queryset.order_by('pk').iterator(chunk_size=batch_size)
+    copied = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return copied
+        bulk.insert(queryset.model, batch, batch_size, using=target,
+                    raw=True, ignore_conflicts=True)
+        copied += len(batch)
+
+
+def move_author(author_id, target, grace=0, batch_size=MOVE_BATCH_SIZE):
+    """Переносит посты автора и комментарии к ним в шард target.
+
+    Запись для автора запрещается, через grace секунд начатые раньше
+    записи заканчиваются, строки копируются в target одной транзакцией,
+    каталог переключается на target, затем строки удаляются из прежнего
+    шарда. Чтение всё время идёт из прежнего шарда, а после
+    переключения — из нового. Возвращает (постов, комментариев)."""
+    source = author_shard(author_id)
+    if source == target:
+        return 0, 0
+    directory = AuthorShard.objects.using(DEFAULT_DB_ALIAS)
+    directory.update_or_create(
+        pk=author_id, defaults={'shard': source, 'moving': True})
+    try:
+        time.sleep(grace)
+        posts = Post.objects.using(source).filter(author_id=author_id)
+        comments = Comment.objects.using(source).filter(
+            post__author_id=author_id)
+        with transaction.atomic(using=target):
+            moved = (copy_rows(posts, target, batch_size),
+                     copy_rows(comments, target, batch_size))
+        directory.filter(pk=author_id).update(shard=target, moving=False)
+    except BaseException:
+        directory.filter(pk=author_id).update(moving=False)
+        raise
+    with transaction.atomic(using=source), \
+            connections[source].cursor() as cursor:
+        for sql in DELETE_SQL:
+            cursor.execute(sql, [author_id])
+    return moved
+
+
+def loads():
+    """{шард: {id автора: число постов}}."""
+    return {
+        shard: dict(Post.objects.using(shard).order_by().values_list(
+            'author_id').annotate(Count('id')))
+        for shard in shards()
+    }
+
+
+def rebalance_plan(shard_loads):
+    """Переносы целых авторов, выравнивающие число постов по шардам:
+    пока в самом загруженном шарде есть автор меньше разрыва с самым
+    свободным, перенос самого крупного из таких сокращает разрыв.
+    Возвращает [(id автора, откуда, куда)]."""
+    authors = {shard: dict(load) for shard, load in shard_loads.items()}
+    totals = {shard: sum(load.values()) for shard, load in authors.items()}
+    moves = []
+    while True:
+        heavy = max(totals, key=totals.get)
+        light = min(totals, key=totals.get)
+        gap = totals[heavy] - totals[light]
+        candidates = [
+            (count, author_id)
+            for author_id, count in authors[heavy].items() if count < gap
+        ]
+        if not candidates:
+            return moves
+        count, author_id = max(candidates)
+        authors[light][author_id] = authors[heavy].pop(author_id)
+        totals[heavy] -= count
+        totals[light] += count
+        moves.append((author_id, heavy, light))
@@ -0,0 +1,159 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import cache, counters, search, sharding, thumbnails, timeline
+from .models import AuthorStats, Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def create_author_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        AuthorStats.objects.get_or_create(user=instance)
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Comment)
+def assign_sharded_id(sender, instance, raw=False, **kwargs):
+    """С шардами id выдаёт приложение: автоинкремент у каждой базы свой."""
+    if not raw and instance.pk is None and sharding.enabled():
+        instance.pk = sharding.next_id()
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous_post(sender, instance, raw=False, **kwargs):
+    """Запоминает прежние группу и картинку: при смене группы переносится
+    счётчик, при смене картинки заново готовятся миниатюры."""
+    if raw or instance._state.adding:
+        return
+    previous = Post.objects.using(instance._state.db).filter(
+        pk=instance.pk).values(
+        'group_id', 'image').first() or {}
+    instance._previous_group_id = previous.get('group_id')
+    instance._previous_image = previous.get('image')
+    if instance.image.name != instance._previous_image:
+        # Варианты прежней картинки больше не подходят.
+        instance.image_variants = ''
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, raw=False, **kwargs):
+    """Новый пост попадает в ленты подписчиков автора. С шардами ленты
+    собираются при чтении (sharding.follow_paginator)."""
+    if created and not raw and not sharding.enabled():
+        timeline.fan_out.delay(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def pregenerate_thumbnails(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created or instance.image.name != getattr(
+            instance, '_previous_image', None):
+        thumbnails.schedule(instance)
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.bump_author.delay(instance.author_id, posts_count=1)
+        counters.bump_group.delay(instance.group_id, 1)
+        return
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    if previous_group_id != instance.group_id:
+        counters.bump_group.delay(previous_group_id, -1)
+        counters.bump_group.delay(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, **kwargs):
+    counters.drop_author.delay(instance.author_id, posts_count=-1)
+    counters.bump_group.delay(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_caches(sender, instance, raw=False, **kwargs):
+    """Новое поколение ленты, автора и групп поста (прежней и текущей)."""
+    if raw:
+        return
+    group_ids = {instance.group_id,
+                 getattr(instance, '_previous_group_id', None)} - {None}
+    slugs = []
+    if group_ids:
+        slugs = Group.objects.filter(pk__in=group_ids).values_list(
+            'slug', flat=True)
+    cache.bump_on_commit(*cache.post_scopes(instance, *slugs),
+                         using=instance._state.db)
+
+
+@receiver(post_save, sender=Post)
+def index_post_text(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post_text(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_post.delay(instance.post_id, 1, instance._state.db)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    counters.bump_post.delay(instance.post_id, -1, instance._state.db)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_author.delay(instance.author_id, followers_count=1)
+        counters.bump_author.delay(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    if sharding.enabled():
+        counters.drop_author.delay(instance.author_id, followers_count=-1)
+    else:
+        # Автор может опуститься ниже порога чтения ленты подписок.
+        timeline.drop_follower.delay(instance.author_id)
+    counters.drop_author.delay(instance.user_id, following_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_caches(sender, instance, raw=False, **kwargs):
+    if not raw:
+        cache.bump_on_commit(cache.post_scope(instance.post_id),
+                             using=instance._state.db)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_caches(sender, instance, raw=False, **kwargs):
+    """Число подписчиков выводится на странице автора."""
+    if not raw:
+        cache.bump_on_commit(
+            cache.author_scope(instance.author.username),
+            using=instance._state.db)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and not sharding.enabled():
+        timeline.backfill.delay(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_timeline(sender, instance, **kwargs):
+    timeline.trim.delay(instance.user_id, instance.author_id)
@@ -0,0 +1,26 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def prefetch_thumbnails(posts):
+    """Миниатюры всех постов страницы одним обращением к kvstore:
+    {% prefetch_thumbnails page_obj as thumbnails %}."""
+    return thumbnails.prefetch_for_posts(posts)
+
+
+@register.filter
+def thumbnail_for(prefetched, post):
+    """Миниатюра поста из заранее загруженного словаря."""
+    if not post.image:
+        return None
+    return prefetched.get(post.image.name)
+
+
+@register.simple_tag
+def post_image_sources(post):
+    """srcset и размеры адаптивных вариантов картинки поста."""
+    return thumbnails.variant_sources(post)
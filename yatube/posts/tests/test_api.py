@@ -0,0 +1,93 @@
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post, User
+from ..utils import COUNT_PAGES
+
+POSTS_TOTAL = COUNT_PAGES + 3
+
+
+class FeedApiTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='api_author')
+        cls.reader = User.objects.create_user(username='api_reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='api-group', description='Описание')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for index in range(POSTS_TOTAL):
+            Post.objects.create(
+                author=cls.author, group=cls.group, text=f'Пост {index}')
+        cls.post = Post.objects.first()
+        Comment.objects.create(
+            post=cls.post, author=cls.reader, text='Отзыв')
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_feeds_paginate_by_cursor(self):
+        """Все ленты отдают посты постранично без повторов."""
+        urls = {
+            'index': reverse('api:index'),
+            'group': reverse('api:group_list', args=[self.group.slug]),
+            'profile': reverse('api:profile', args=[self.author.username]),
+            'follow': reverse('api:follow_index'),
+        }
+        expected = list(Post.objects.values_list('id', flat=True))
+        for name, url in urls.items():
+            with self.subTest(feed=name):
+                first = self.reader_client.get(url).json()
+                self.assertEqual(len(first['results']), COUNT_PAGES)
+                second = self.reader_client.get(
+                    url, {'cursor': first['next']}).json()
+                self.assertIsNone(second['next'])
+                ids = [item['id'] for item in
+                       first['results'] + second['results']]
+                self.assertEqual(ids, expected)
+
+    def test_values_without_model_instances(self):
+        """Выдача строится из .values(), экземпляры Post не создаются."""
+        with mock.patch.object(Post, 'from_db', side_effect=AssertionError):
+            response = self.client.get(reverse('api:index'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_sparse_fields(self):
+        response = self.client.get(
+            reverse('api:index'), {'fields': 'text,author'})
+        item = response.json()['results'][0]
+        self.assertEqual(
+            item, {'text': self.post.text, 'author': 'api_author'})
+        response = self.client.get(
+            reverse('api:index'), {'fields': 'text,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_ndjson_stream(self):
+        """?format=ndjson отдаёт всю ленту потоком, по посту в строке."""
+        response = self.client.get(
+            reverse('api:profile', args=[self.author.username]),
+            {'format': 'ndjson', 'fields': 'id'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), POSTS_TOTAL)
+        self.assertEqual(json.loads(lines[0]), {'id': self.post.pk})
+
+    def test_post_detail_with_comments(self):
+        data = self.client.get(
+            reverse('api:post_detail', args=[self.post.pk])).json()
+        self.assertEqual(data['text'], self.post.text)
+        self.assertEqual(data['comments_count'], 1)
+        self.assertEqual(
+            [comment['text'] for comment in data['comments']['results']],
+            ['Отзыв'])
+
+    def test_follow_requires_login(self):
+        response = self.client.get(reverse('api:follow_index'))
+        self.assertEqual(response.status_code, 401)
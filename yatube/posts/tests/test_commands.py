@@ -0,0 +1,423 @@
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from sorl.thumbnail import get_thumbnail
+
+from .. import bulk, search, thumbnails
+from ..models import AuthorStats, Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+class ExplainViewsCommandTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='explain_author')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='explain-slug',
+            description='Тестовое описание',
+        )
+        Post.objects.create(author=cls.user, text='Пост', group=cls.group)
+
+    def test_group_feed_uses_composite_index(self):
+        """Лента группы читается по индексу (group, pub_date, id)."""
+        out = StringIO()
+        call_command('explain_views', views=['group_list'], stdout=out)
+        self.assertIn('post_group_pub_date_idx', out.getvalue())
+
+
+class RecountCommandTest(TestCase):
+    def test_recount_repairs_drift(self):
+        """recount возвращает счётчики к фактическим значениям."""
+        user = User.objects.create_user(username='recount_author')
+        group = Group.objects.create(
+            title='Группа', slug='recount-slug', description='Описание')
+        Post.objects.create(author=user, text='Пост', group=group)
+        AuthorStats.objects.filter(user=user).update(posts_count=42)
+        Group.objects.filter(pk=group.pk).update(posts_count=0)
+
+        call_command('recount', stdout=StringIO())
+
+        group.refresh_from_db()
+        self.assertEqual(AuthorStats.objects.get(user=user).posts_count, 1)
+        self.assertEqual(group.posts_count, 1)
+
+
+class ImportPostsCommandTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as target:
+            target.write(text)
+        return path
+
+    def test_import_all_kinds(self):
+        """Группы, посты, комментарии и подписки загружаются с исходными
+        датами, после чего счётчики, поиск и ленты согласованы."""
+        paths = [
+            self.write('groups.jsonl', json.dumps(
+                {'slug': 'import', 'title': 'Импорт'}) + '\n'),
+            self.write(
+                'posts.csv',
+                'id,author,group,text,pub_date\n'
+                '501,writer,import,Первый импортный пост,'
+                '2020-01-02T03:04:05+00:00\n'
+                '502,writer,,Второй импортный пост,\n'),
+            self.write('comments.jsonl', json.dumps(
+                {'post': 501, 'author': 'reader', 'text': 'Отзыв'}) + '\n'),
+            self.write('follows.jsonl', json.dumps(
+                {'user': 'reader', 'author': 'writer'}) + '\n'),
+        ]
+        out = StringIO()
+        call_command('import_posts', *paths, stdout=out)
+        self.assertIn('в секунду', out.getvalue())
+
+        post = Post.objects.get(text='Первый импортный пост')
+        self.assertEqual(post.pub_date.year, 2020)
+        self.assertEqual(post.group.slug, 'import')
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(post.group.posts_count, 1)
+        writer = User.objects.get(username='writer')
+        self.assertEqual(writer.stats.posts_count, 2)
+        self.assertEqual(writer.stats.followers_count, 1)
+        reader = User.objects.get(username='reader')
+        self.assertEqual(reader.timeline.count(), 2)
+        self.assertEqual(
+            list(search.filter_posts(Post.objects.all(), 'импортный')
+                 .order_by('pk').values_list('text', flat=True)),
+            ['Первый импортный пост', 'Второй импортный пост'])
+
+    def test_imported_posts_get_new_ids(self):
+        """Id из файла, занятый постом на сайте, не теряет импортный
+        пост и не привязывает его комментарии к чужому посту;
+        повторная загрузка пропускается с объяснением."""
+        owner = User.objects.create_user(username='owner')
+        existing = Post.objects.create(author=owner, text='Свой пост')
+        posts = self.write('posts.jsonl', json.dumps(
+            {'id': existing.pk, 'author': 'writer', 'text': 'Чужой'}) + '\n')
+        comments = self.write('comments.jsonl', json.dumps(
+            {'post': existing.pk, 'author': 'reader', 'text': 'Отзыв'}) + '\n')
+        call_command('import_posts', posts, comments, stdout=StringIO())
+
+        imported = Post.objects.get(text='Чужой')
+        self.assertNotEqual(imported.pk, existing.pk)
+        self.assertEqual(Comment.objects.get().post, imported)
+        self.assertFalse(existing.comments.exists())
+
+        err = StringIO()
+        call_command('import_posts', posts, restart=True, stdout=StringIO(),
+                     stderr=err)
+        self.assertIn(f'пост {existing.pk} уже загружен как {imported.pk}',
+                      err.getvalue())
+        self.assertEqual(Post.objects.filter(text='Чужой').count(), 1)
+
+    def test_sources_keep_their_own_ids(self):
+        """Id постов разных выгрузок совпадают, но это разные посты:
+        комментарии второй выгрузки находят пост своей выгрузки."""
+        for source in ('first', 'second'):
+            directory = os.path.join(self.directory, source)
+            os.mkdir(directory)
+            posts = os.path.join(directory, 'posts.jsonl')
+            comments = os.path.join(directory, 'comments.jsonl')
+            with open(posts, 'w', encoding='utf-8') as target:
+                target.write(json.dumps(
+                    {'id': 1, 'author': 'writer', 'text': source}) + '\n')
+            with open(comments, 'w', encoding='utf-8') as target:
+                target.write(json.dumps(
+                    {'post': 1, 'author': 'reader', 'text': source}) + '\n')
+            call_command('import_posts', posts, comments,
+                         stdout=StringIO(), stderr=StringIO())
+        for source in ('first', 'second'):
+            post = Post.objects.get(text=source)
+            self.assertEqual(
+                list(post.comments.values_list('text', flat=True)),
+                [source])
+
+    def test_resume_after_failure(self):
+        """После ошибки повторный запуск продолжает с первой
+        незагруженной записи и не дублирует загруженные."""
+        User.objects.create_user(username='writer')
+        post = Post.objects.create(
+            author=User.objects.get(username='writer'), text='Пост')
+        good = {'post': post.pk, 'author': 'reader', 'text': 'Отзыв'}
+        broken = {'post': post.pk, 'text': 'Без автора'}
+        path = self.write('comments.jsonl', '\n'.join(
+            json.dumps(record) for record in (good, broken, good)))
+        with self.assertRaises(KeyError):
+            call_command('import_posts', path, chunk_size=1,
+                         stdout=StringIO())
+        self.assertEqual(Comment.objects.count(), 1)
+
+        broken['author'] = 'reader'
+        self.write('comments.jsonl', '\n'.join(
+            json.dumps(record) for record in (good, broken, good)))
+        call_command('import_posts', path, chunk_size=1, stdout=StringIO())
+        self.assertEqual(Comment.objects.count(), 3)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 3)
+
+
+class ExportPostsCommandTest(TestCase):
+    def test_export_round_trips_through_import(self):
+        """Выгрузка пишет файлы в формате import_posts: загруженные
+        обратно, они дают те же посты."""
+        user = User.objects.create_user(username='exporter')
+        group = Group.objects.create(
+            title='Группа', slug='export', description='Описание')
+        Post.objects.create(author=user, group=group, text='Первый')
+        Post.objects.create(author=user, text='Второй')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        call_command('export_posts', 'exporter', output=directory,
+                     file_format='csv', stdout=StringIO())
+        path = os.path.join(directory, 'posts.csv')
+        with open(path, encoding='utf-8') as exported:
+            self.assertEqual(len(exported.readlines()), 3)
+
+        expected = list(Post.objects.values_list('text', 'group', 'pub_date'))
+        Post.objects.all().delete()
+        call_command('import_posts', path, stdout=StringIO())
+        self.assertEqual(
+            list(Post.objects.values_list('text', 'group', 'pub_date')),
+            expected)
+
+
+class BulkInsertTest(TestCase):
+    def test_raw_insert_keeps_dates(self):
+        """raw=True сохраняет переданные даты и не трогает auto_now_add:
+        обычное сохранение в это время по-прежнему ставит текущее."""
+        user = User.objects.create_user(username='bulk_author')
+        old = timezone.now() - timedelta(days=365)
+        post, = bulk.insert(Post, [Post(id=10 ** 6, author=user, text='Пост',
+                                        pub_date=old)], 100, raw=True)
+        bulk.insert(Comment, [Comment(post=post, author=user, text='Отзыв',
+                                      created=old)], 100, raw=True)
+        self.assertEqual(Post.objects.get(pk=post.pk).pub_date, old)
+        self.assertEqual(Comment.objects.get().created, old)
+        self.assertTrue(Post._meta.get_field('pub_date').auto_now_add)
+        fresh = Post.objects.create(author=user, text='Новый', pub_date=old)
+        self.assertGreater(fresh.pub_date, old)
+
+
+class SeedCommandTest(TestCase):
+    def seed(self, chunk_size=100, workers=1):
+        call_command('seed', seed=7, users=30, groups=3, posts=300,
+                     comments=2, follows=4, images=0, chunk_size=chunk_size,
+                     workers=workers, stdout=StringIO())
+        return (
+            list(Post.objects.order_by('pub_date').values_list(
+                'author__username', 'group__slug', 'text', 'pub_date')),
+            list(Comment.objects.order_by('created', 'id').values_list(
+                'post__text', 'author__username', 'created')),
+            list(Follow.objects.order_by(
+                'user__username', 'author__username').values_list(
+                'user__username', 'author__username')),
+        )
+
+    def test_seed_is_deterministic_and_skewed(self):
+        """Тот же seed даёт те же данные; у самого активного автора
+        постов намного больше среднего, счётчики согласованы."""
+        first = self.seed()
+        posts, comments, follows = first
+        self.assertEqual(len(posts), 300)
+        self.assertTrue(comments)
+        self.assertTrue(follows)
+        top = Counter(author for author, *_ in posts).most_common(1)[0][1]
+        self.assertGreater(top, 3 * len(posts) / 30)
+        self.assertEqual(
+            sum(AuthorStats.objects.values_list('posts_count', flat=True)),
+            300)
+
+        Post.objects.all().delete()
+        Follow.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        self.assertEqual(self.seed(), first)
+
+    def test_seed_refuses_loaded_seed(self):
+        call_command('seed', seed=3, users=2, groups=1, posts=2, images=0,
+                     stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('seed', seed=3, users=2, groups=1, posts=2,
+                         images=0, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 2)
+
+    def test_seed_with_workers_matches_serial(self):
+        """Пачки из пула процессов идут в том же порядке, что и без
+        него, даже когда их больше окна."""
+        serial = self.seed(chunk_size=10)
+        Post.objects.all().delete()
+        Follow.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        self.assertEqual(self.seed(chunk_size=10, workers=2), serial)
+
+
+class BenchmarkCommandTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='bench_author')
+        reader = User.objects.create_user(username='bench_reader')
+        group = Group.objects.create(
+            title='Группа', slug='bench-group', description='Описание')
+        Follow.objects.create(user=reader, author=author)
+        Post.objects.create(author=author, group=group, text='Пост')
+
+    def test_results_and_baseline(self):
+        """Замер проходит по всем маршрутам трёх приложений и пишет JSON;
+        рост числа запросов относительно базовой линии — ошибка."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output = os.path.join(directory, 'benchmark.json')
+        call_command('benchmark', current=True, repeat=2, output=output,
+                     stdout=StringIO())
+        with open(output, encoding='utf-8') as source:
+            results = json.load(source)['results']['current']
+        for name in ('posts:index', 'posts:post_detail', 'users:login',
+                     'about:tech'):
+            with self.subTest(route=name):
+                self.assertEqual(results[name]['status'], 200)
+                self.assertGreater(results[name]['p95_ms'], 0)
+        self.assertGreater(results['posts:index']['queries'], 0)
+        # Анонимный проход мерит страницы из кеша.
+        self.assertEqual(results['posts:index anonymous']['queries'], 0)
+        self.assertEqual(
+            results['posts:post_detail anonymous']['status'], 200)
+
+        for result in results.values():
+            result['queries'] = 0
+        with open(output, 'w', encoding='utf-8') as target:
+            json.dump({'results': {'current': results}}, target)
+        with self.assertRaises(CommandError):
+            call_command('benchmark', current=True, repeat=1,
+                         baseline=output, route=['posts:index'],
+                         stdout=StringIO(), stderr=StringIO())
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+# Миниатюра ленты и по одному варианту каждого формата: SMALL_GIF
+# уже самой узкой адаптивной ширины.
+FILES_PER_IMAGE = 1 + len(thumbnails.VARIANT_FORMATS)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class WarmThumbnailsCommandTest(TransactionTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # Kvstore sorl кеширует миниатюры и в кеше Django.
+        cache.clear()
+        shutil.rmtree(os.path.join(TEMP_MEDIA_ROOT, 'cache'),
+                      ignore_errors=True)
+
+    def _thumbnails(self):
+        cache_dir = os.path.join(TEMP_MEDIA_ROOT, 'cache')
+        return {
+            os.path.join(root, name): os.path.getmtime(
+                os.path.join(root, name))
+            for root, _, files in os.walk(cache_dir) for name in files
+        }
+
+    def _image(self, name):
+        return SimpleUploadedFile(name, SMALL_GIF, 'image/gif')
+
+    def test_thumbnails_pregenerated_and_backfilled(self):
+        """Миниатюра создаётся при сохранении поста; команда дозаполняет
+        посты без миниатюр и не пересоздаёт готовые."""
+        user = User.objects.create_user(username='thumbnail_author')
+        Post.objects.create(
+            author=user, text='Пост', image=self._image('first.gif'))
+        pregenerated = self._thumbnails()
+        self.assertEqual(len(pregenerated), FILES_PER_IMAGE)
+
+        # bulk_create не отправляет сигналы — миниатюры нет.
+        second = Post(author=user, text='Пост без миниатюры')
+        second.image.save('second.gif', self._image('second.gif'),
+                          save=False)
+        Post.objects.bulk_create([second])
+
+        out = StringIO()
+        call_command('warm_thumbnails', workers=2, stdout=out)
+        self.assertIn('Картинок обработано: 2, с ошибками: 0', out.getvalue())
+        warmed = self._thumbnails()
+        self.assertEqual(len(warmed), 2 * FILES_PER_IMAGE)
+        for path, mtime in pregenerated.items():
+            self.assertEqual(warmed[path], mtime)
+        self.assertTrue(Post.objects.get(
+            image=second.image.name).image_variants)
+
+    def test_responsive_variants_in_feed(self):
+        """После загрузки у поста есть WebP и JPEG варианты, а лента
+        выводит их через srcset с ленивой загрузкой."""
+        user = User.objects.create_user(username='variants_author')
+        post = Post.objects.create(
+            author=user, text='Пост', image=self._image('variants.gif'))
+        post.refresh_from_db()
+        manifest = json.loads(post.image_variants)
+        self.assertEqual(set(manifest), set(thumbnails.VARIANT_FORMATS))
+        webp_name = manifest['WEBP'][0][2]
+        self.assertTrue(webp_name.endswith('.webp'))
+
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, webp_name)
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_prefetch_matches_thumbnail_tag(self):
+        """Пакетная загрузка отдаёт те же миниатюры, что {% thumbnail %},
+        и читает kvstore одним запросом на страницу."""
+        user = User.objects.create_user(username='prefetch_author')
+        posts = [
+            Post.objects.create(author=user, text=f'Пост {index}',
+                                image=self._image(f'prefetch_{index}.gif'))
+            for index in range(3)
+        ]
+        geometry, options = thumbnails.FEED_THUMBNAIL
+        names = [post.image.name for post in posts]
+        expected = {
+            name: get_thumbnail(name, geometry, **options).url
+            for name in names
+        }
+        cache.clear()
+        with self.assertNumQueries(1):
+            prefetched = thumbnails.prefetch(names, geometry, options)
+        self.assertEqual(
+            {name: image.url for name, image in prefetched.items()},
+            expected,
+        )
+        with self.assertNumQueries(0):
+            thumbnails.prefetch(names, geometry, options)
@@ -1,7 +1,7 @@
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 
-from ..models import Group, Post, POST_TEXT
+from ..models import AuthorStats, Comment, Follow, Group, Post, POST_TEXT
 
 User = get_user_model()
 
@@ -54,3 +54,57 @@ class PostModelTest(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     post._meta.get_field(field).help_text, expected_value)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='counter_author')
+        cls.reader = User.objects.create_user(username='counter_reader')
+        cls.group = Group.objects.create(
+            title='Группа 1', slug='counter-1', description='Описание')
+        cls.group_second = Group.objects.create(
+            title='Группа 2', slug='counter-2', description='Описание')
+
+    def _stats(self, user):
+        return AuthorStats.objects.get(user=user)
+
+    def test_post_counters_follow_create_edit_delete(self):
+        """Счётчики постов автора и группы меняются при создании,
+        смене группы и удалении поста."""
+        post = Post.objects.create(
+            author=self.user, text='Пост', group=self.group)
+        self.assertEqual(self._stats(self.user).posts_count, 1)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 1)
+
+        post.group = self.group_second
+        post.save()
+        self.group.refresh_from_db()
+        self.group_second.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(self.group_second.posts_count, 1)
+
+        post.delete()
+        self.group_second.refresh_from_db()
+        self.assertEqual(self._stats(self.user).posts_count, 0)
+        self.assertEqual(self.group_second.posts_count, 0)
+
+    def test_comment_and_follow_counters(self):
+        """Счётчики комментариев поста и подписок автора."""
+        post = Post.objects.create(author=self.user, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий')
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+
+        Follow.objects.create(user=self.reader, author=self.user)
+        self.assertEqual(self._stats(self.user).followers_count, 1)
+        self.assertEqual(self._stats(self.reader).following_count, 1)
+        Follow.objects.filter(user=self.reader).delete()
+        self.assertEqual(self._stats(self.user).followers_count, 0)
+        self.assertEqual(self._stats(self.reader).following_count, 0)
@@ -0,0 +1,125 @@
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from about.urls import urlpatterns as about_urls
+from core.testing import QueryBudgetMixin
+from users.urls import urlpatterns as users_urls
+
+from ..models import Comment, Follow, Group, Post, User
+from ..urls import urlpatterns as posts_urls
+from ..utils import COUNT_COMMENTS, COUNT_PAGES
+
+ROUTES = (('posts', posts_urls), ('users', users_urls), ('about', about_urls))
+
+# Бюджет запросов на маршрут для авторизованного пользователя,
+# с учётом чтения сессии и пользователя. Не зависит от числа постов
+# и комментариев на странице.
+QUERY_BUDGETS = {
+    'posts:index': 3,
+    'posts:search': 4,
+    'posts:group_list': 4,
+    'posts:profile': 5,
+    'posts:post_detail': 4,
+    'posts:post_create': 3,
+    'posts:post_edit': 4,
+    'posts:post_comments': 3,
+    'posts:add_comment': 3,
+    'posts:follow_index': 4,
+    'posts:export': 3,
+    'posts:profile_follow': 4,
+    'posts:profile_unfollow': 9,
+    'users:signup': 2,
+    'users:login': 2,
+    'users:logout': 4,
+    'users:password_change': 2,
+    'users:password_change_done': 2,
+    'users:password_reset_form': 2,
+    'users:password_reset_done': 2,
+    'users:password_reset_confirm': 3,
+    'users:password_reset_complete': 2,
+    'about:author': 2,
+    'about:tech': 2,
+    'core:page_not_found': 2,
+}
+# Сколько постов и комментариев создаётся на каждом шаге: от пустой
+# страницы до полной, где N+1 уже не спрятать.
+DATA_SIZES = (1, max(COUNT_PAGES, COUNT_COMMENTS) + 2)
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='budget_reader')
+        cls.author = User.objects.create_user(username='budget_author')
+        cls.group = Group.objects.create(
+            title='Группа', slug='budget-group', description='Описание')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def grow(self, size):
+        """Доводит число постов автора и комментариев к первому посту
+        до size; у каждого поста и комментария свой второй участник,
+        чтобы ленивые связи давали отдельные запросы."""
+        for index in range(Post.objects.count(), size):
+            Post.objects.create(
+                author=self.author, group=self.group, text=f'Пост {index}')
+        post = Post.objects.order_by('id').first()
+        for index in range(post.comments.count(), size):
+            commenter = User.objects.create_user(
+                username=f'budget_commenter_{index}')
+            Comment.objects.create(
+                post=post, author=commenter, text=f'Отзыв {index}')
+        return post
+
+    def urls(self, post):
+        kwargs = {
+            'slug': self.group.slug,
+            'username': self.author.username,
+            'post_id': post.pk,
+            'uidb64': urlsafe_base64_encode(force_bytes(self.reader.pk)),
+            'token': default_token_generator.make_token(self.reader),
+        }
+        urls = {}
+        for namespace, patterns in ROUTES:
+            for pattern in patterns:
+                urls[f'{namespace}:{pattern.name}'] = reverse(
+                    f'{namespace}:{pattern.name}', kwargs={
+                        key: kwargs[key]
+                        for key in pattern.pattern.converters})
+        urls['posts:search'] += '?q=Пост'
+        urls['core:page_not_found'] = '/nonexist-page/'
+        return urls
+
+    def measure(self, name, url):
+        """Запрос в откатываемой транзакции: подписка и выход не меняют
+        данные для следующих маршрутов."""
+        self.client.force_login(self.reader)
+        cache.clear()
+        with transaction.atomic():
+            _, count = self.assertQueryBudget(
+                name, QUERY_BUDGETS[name], self.client.get, url)
+            transaction.set_rollback(True)
+        return count
+
+    def test_every_view_within_budget(self):
+        """Каждый маршрут укладывается в бюджет, и число запросов
+        не растёт вместе с данными."""
+        counts = {}
+        for size in DATA_SIZES:
+            urls = self.urls(self.grow(size))
+            self.assertEqual(set(urls), set(QUERY_BUDGETS),
+                             'У каждого маршрута должен быть бюджет.')
+            for name, url in urls.items():
+                with self.subTest(route=name, size=size):
+                    counts.setdefault(name, set()).add(
+                        self.measure(name, url))
+        for name, sizes in counts.items():
+            with self.subTest(route=name):
+                self.assertLessEqual(
+                    len(sizes), 1,
+                    f'{name}: число запросов зависит от данных: {sizes}')
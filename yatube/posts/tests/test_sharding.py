@@ -0,0 +1,270 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from http import HTTPStatus
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connections
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .. import sharding
+from ..models import AuthorShard, Comment, Follow, Group, Post
+from ..utils import COUNT_PAGES
+from .test_commands import SMALL_GIF
+
+User = get_user_model()
+
+# default — первый шард, ещё два — отдельные файлы SQLite.
+SHARDS = ['default', 'shard_1', 'shard_2']
+
+
+@override_settings(POST_SHARDS=SHARDS)
+class ShardingTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        for alias in SHARDS[1:]:
+            connections.databases[alias] = {
+                **connections['default'].settings_dict,
+                'NAME': os.path.join(cls.directory, f'{alias}.sqlite3'),
+            }
+            call_command('migrate', database=alias, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in SHARDS[1:]:
+            connections[alias].close()
+            del connections[alias]
+            del connections.databases[alias]
+        shutil.rmtree(cls.directory)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='shard_reader')
+        self.client.force_login(self.reader)
+
+    def tearDown(self):
+        # Файлы шардов не откатываются вместе с транзакцией теста.
+        for alias in SHARDS[1:]:
+            Comment.objects.using(alias).all().delete()
+            Post.objects.using(alias).all().delete()
+
+    def author(self, username, shard):
+        author = User.objects.create_user(username=username)
+        AuthorShard.objects.create(user=author, shard=shard)
+        return author
+
+    def publish(self, author, text):
+        post = Post(author=author, text=text)
+        post.save()
+        return post
+
+    def test_writes_go_to_author_shard(self):
+        """Пост пишется в шард автора, комментарий — в шард поста;
+        страница поста собирает их вместе с автором из default."""
+        author = self.author('shard_author', 'shard_1')
+        self.client.force_login(author)
+        self.client.post(reverse('posts:post_create'), {'text': 'В шарде'})
+        post = Post.objects.using('shard_1').get()
+        self.assertFalse(Post.objects.filter(text='В шарде').exists())
+        self.assertGreater(post.pk, 1 << 40)
+
+        self.client.post(reverse('posts:add_comment', args=[post.pk]),
+                         {'text': 'Отзыв'})
+        self.assertEqual(
+            Comment.objects.using('shard_1').get().post_id, post.pk)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk]))
+        self.assertContains(response, 'В шарде')
+        self.assertContains(response, 'Отзыв')
+        self.assertEqual(response.context['post_number'], 1)
+
+    def test_first_write_pins_author(self):
+        """Автор со старыми постами остаётся в первом шарде, новый
+        закрепляется по остатку от деления id."""
+        veteran = User.objects.create_user(username='shard_veteran')
+        with override_settings(POST_SHARDS=[]):
+            Post.objects.create(author=veteran, text='До шардирования')
+        newcomer = User.objects.create_user(username='shard_newcomer')
+        self.publish(veteran, 'После')
+        self.publish(newcomer, 'Первый')
+        self.assertEqual(sharding.author_shard(veteran.pk), 'default')
+        self.assertEqual(Post.objects.filter(author=veteran).count(), 2)
+        self.assertEqual(sharding.author_shard(newcomer.pk),
+                         SHARDS[newcomer.pk % len(SHARDS)])
+
+    def test_feeds_merge_shards(self):
+        """Главная лента сливает все шарды по дате, курсор ведёт дальше;
+        профиль и лента подписок читают только шарды своих авторов.
+        То же в HTML и в JSON API, вместе со страницей поста."""
+        authors = [self.author(f'shard_author_{index}', shard)
+                   for index, shard in enumerate(SHARDS)]
+        posts = [self.publish(authors[index % len(authors)], f'Пост {index}')
+                 for index in range(COUNT_PAGES + 2)]
+        newest = [post.pk for post in reversed(posts)]
+
+        response = self.client.get(reverse('posts:index'))
+        page = response.context['page_obj']
+        self.assertEqual([post.pk for post in page], newest[:COUNT_PAGES])
+        self.assertEqual(page[0].author, authors[(len(posts) - 1) % 3])
+        response = self.client.get(
+            reverse('posts:index') + f'?cursor={page.next_cursor}')
+        self.assertEqual([post.pk for post in response.context['page_obj']],
+                         newest[COUNT_PAGES:])
+
+        response = self.client.get(
+            reverse('posts:profile', args=[authors[1].username]))
+        self.assertEqual(
+            {post.author for post in response.context['page_obj']},
+            {authors[1]})
+
+        data = self.client.get(reverse('api:index')).json()
+        self.assertEqual([item['id'] for item in data['results']],
+                         newest[:COUNT_PAGES])
+        data = self.client.get(
+            reverse('api:index') + f'?cursor={data["next"]}').json()
+        self.assertEqual([item['id'] for item in data['results']],
+                         newest[COUNT_PAGES:])
+        lines = self.client.get(
+            reverse('api:index') + '?format=ndjson&fields=id'
+        ).getvalue().decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], newest)
+        results = self.client.get(reverse(
+            'api:profile', args=[authors[1].username])).json()['results']
+        self.assertEqual(
+            [item['id'] for item in results],
+            [post.pk for post in reversed(posts)
+             if post.author == authors[1]])
+        self.assertEqual({item['author'] for item in results},
+                         {authors[1].username})
+        in_shard = posts[1]
+        Comment(post=in_shard, author=self.reader,
+                text='Отзыв в шарде').save()
+        data = self.client.get(
+            reverse('api:post_detail', args=[in_shard.pk])).json()
+        self.assertEqual(data['author'], authors[1].username)
+        self.assertEqual(
+            [item['text'] for item in data['comments']['results']],
+            ['Отзыв в шарде'])
+        results = self.client.get(reverse(
+            'api:post_comments', args=[in_shard.pk])).json()['results']
+        self.assertEqual(results[0]['author'], self.reader.username)
+
+        Follow.objects.create(user=self.reader, author=authors[2])
+        followed = [pk for pk in newest if Post.objects.using(
+            'shard_2').filter(pk=pk).exists()]
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            [post.pk for post in response.context['page_obj']], followed)
+        results = self.client.get(
+            reverse('api:follow_index')).json()['results']
+        self.assertEqual([item['id'] for item in results], followed)
+        self.assertEqual({item['author'] for item in results},
+                         {authors[2].username})
+
+    def test_export_and_thumbnails_read_shards(self):
+        """Выгрузка читает посты из шарда автора, а комментарии — из
+        шардов чужих постов; warm_thumbnails обходит все шарды."""
+        author = self.author('shard_exporter', 'shard_1')
+        other = self.author('shard_other', 'shard_2')
+        group = Group.objects.create(
+            title='Группа', slug='shard-group', description='Описание')
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        with override_settings(MEDIA_ROOT=media):
+            post = Post(author=author, text='Пост в шарде', group=group,
+                        image=SimpleUploadedFile(
+                            'shard.gif', SMALL_GIF, 'image/gif'))
+            post.save()
+            Comment(post=self.publish(other, 'Чужой'), author=author,
+                    text='Отзыв').save()
+            self.client.force_login(author)
+            url = reverse('posts:export')
+            rows = [json.loads(line) for line in b''.join(
+                self.client.get(url).streaming_content).splitlines()]
+            self.assertTrue(rows[0].pop('pub_date'))
+            self.assertEqual(rows, [{
+                'id': post.pk, 'author': author.username,
+                'group': group.slug, 'text': 'Пост в шарде',
+                'image': post.image.name,
+            }])
+            rows = [json.loads(line) for line in b''.join(self.client.get(
+                url, {'kind': 'comments'}).streaming_content).splitlines()]
+            self.assertEqual([(row['author'], row['text']) for row in rows],
+                             [(author.username, 'Отзыв')])
+            archive = b''.join(self.client.get(
+                url, {'kind': 'images'}).streaming_content)
+            self.assertIn(post.image.name.encode(), archive)
+
+        # Потоки пула не видят базу теста в транзакции: проверяется,
+        # что команда передаёт генерации пост вместе с его шардом.
+        with mock.patch('posts.management.commands.warm_thumbnails.'
+                        'generate_in_worker', return_value=0) as generate:
+            call_command('warm_thumbnails', workers=1, stdout=StringIO())
+        generate.assert_called_once_with(
+            post.pk, post.image.name, 'shard_1')
+
+    def test_reshard_moves_author_online(self):
+        """Во время переноса запись автора запрещена; после переноса
+        посты и комментарии лежат в новом шарде и видны на страницах."""
+        author = self.author('moving_author', 'shard_1')
+        first = self.publish(author, 'Первый')
+        self.publish(author, 'Второй')
+        Comment(post=first, author=self.reader, text='Отзыв').save()
+
+        AuthorShard.objects.filter(pk=author.pk).update(moving=True)
+        with self.assertRaises(sharding.ShardMoving):
+            self.publish(author, 'Не вовремя')
+        self.client.force_login(author)
+        response = self.client.post(
+            reverse('posts:post_create'), {'text': 'Не вовремя'})
+        self.assertEqual(response.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertTrue(response.has_header('Retry-After'))
+        AuthorShard.objects.filter(pk=author.pk).update(moving=False)
+
+        old = timezone.now() - timedelta(days=30)
+        Post.objects.using('shard_1').filter(pk=first.pk).update(
+            pub_date=old)
+        out = StringIO()
+        call_command('reshard_posts', author.username, to='shard_2',
+                     grace=0, stdout=out)
+        self.assertIn('shard_1 -> shard_2, постов 2, комментариев 1',
+                      out.getvalue())
+        self.assertFalse(Post.objects.using('shard_1').exists())
+        self.assertEqual(Post.objects.using('shard_2').count(), 2)
+        self.assertEqual(Comment.objects.using('shard_2').count(), 1)
+        self.assertEqual(
+            Post.objects.using('shard_2').get(pk=first.pk).pub_date, old)
+        self.assertEqual(sharding.author_shard(author.pk), 'shard_2')
+
+        response = self.client.get(
+            reverse('posts:post_detail', args=[first.pk]))
+        self.assertContains(response, 'Отзыв')
+        self.assertEqual(sharding.shard_for_write(author.pk), 'shard_2')
+
+    def test_rebalance_plan(self):
+        """Переносится самый крупный автор, который сокращает разрыв."""
+        moves = sharding.rebalance_plan({
+            'default': {1: 50, 2: 30, 3: 5},
+            'shard_1': {4: 10},
+            'shard_2': {},
+        })
+        self.assertEqual(moves, [(1, 'default', 'shard_2')])
+
+    def test_ids_unique_and_ordered(self):
+        ids = [sharding.next_id() for _ in range(10000)]
+        self.assertEqual(ids, sorted(set(ids)))
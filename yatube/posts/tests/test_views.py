@@ -1,16 +1,27 @@
+import json
 import shutil
 import tempfile
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock
 
 # from django import forms
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.core.cache import cache
+from django.core.files.base import ContentFile
 # from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase, Client
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 
 
-from posts.models import Post, Group, User
+from core.testing import run_on_commit
+from posts import cache as cache_generations
+from posts.admin import PostAdmin, ScalablePaginator
+from posts.models import Comment, Follow, Post, Group, TimelineEntry, User
+from ..utils import COUNT_COMMENTS
 from ..views import COUNT_POST
 
 User = get_user_model()
@@ -335,14 +346,16 @@ class ViewPagesTests(TestCase):
         self.assertEqual(comment.text, 'Тестовый комментарий')
 
     def test_index_cache_1(self):
-        """Напишите тесты, которые проверяют работу кеша. user."""
+        """Напишите тесты, которые проверяют работу кеша. user.
+        Изменение в обход сигналов не сбрасывает кеш, cache.clear() —
+        сбрасывает."""
         post = Post.objects.create(
             author=self.user,
             text='Новый тестовый пост'
         )
         response = self.authorized_client.get(reverse('posts:index'))
         temp = response.content
-        post.delete()
+        Post.objects.filter(pk=post.pk).update(text='Изменённый пост')
         response = self.authorized_client.get(reverse('posts:index'))
         self.assertEqual(response.content, temp)
         cache.clear()
@@ -350,15 +363,348 @@ class ViewPagesTests(TestCase):
         self.assertNotEqual(response.content, temp)
 
     def test_index_cache_2(self):
-        """Напишите тесты, которые проверяют работу кеша 2. user_second."""
-        post = Post.objects.create(
-            author=self.user_second,
-            text='Тестовый пост',
-        )
+        """Напишите тесты, которые проверяют работу кеша 2. user_second.
+        Удаление поста сразу переводит кеш ленты на новое поколение."""
+        with run_on_commit():
+            post = Post.objects.create(
+                author=self.user_second,
+                text='Тестовый пост',
+            )
         response = self.authorized_client.get(reverse('posts:index'))
-        Post.objects.filter(pk=post.pk).delete()
+        self.assertContains(response, 'Тестовый пост')
+        with run_on_commit():
+            Post.objects.filter(pk=post.pk).delete()
         response_2 = self.authorized_client.get(reverse('posts:index'))
-        self.assertEqual(response.content, response_2.content)
+        self.assertNotEqual(response.content, response_2.content)
+        self.assertNotContains(response_2, 'Тестовый пост')
+
+    def test_group_and_profile_cache_invalidated_on_edit(self):
+        """Правка поста сразу видна на страницах группы и автора."""
+        urls = (
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.user.username]),
+        )
+        for url in urls:
+            self.guest_client.get(url)
+        self.post.text = 'Отредактированный пост'
+        with run_on_commit():
+            self.post.save()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertContains(response, 'Отредактированный пост')
+
+
+class AnonymousPageCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='cache_author')
+        cls.post = Post.objects.create(author=cls.user, text='Исходный текст')
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.url = reverse('posts:post_detail', args=[self.post.pk])
+
+    def test_anonymous_page_served_from_cache(self):
+        """Повторный анонимный запрос не обращается к базе."""
+        self.guest_client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(self.url)
+        self.assertContains(response, 'Исходный текст')
+
+    def test_authenticated_user_bypasses_cache(self):
+        """Авторизованный пользователь всегда получает свежую страницу."""
+        self.guest_client.get(self.url)
+        Post.objects.filter(pk=self.post.pk).update(text='Тихая правка')
+        self.assertContains(self.guest_client.get(self.url), 'Исходный текст')
+        self.assertContains(
+            self.authorized_client.get(self.url), 'Тихая правка')
+
+    def test_conditional_get(self):
+        """Совпавший ETag или Last-Modified даёт 304 без запросов
+        к базе; правка поста меняет валидаторы."""
+        response = self.guest_client.get(self.url)
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(
+                self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.guest_client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Правка'
+        with run_on_commit():
+            post.save()
+        response = self.guest_client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_authenticated_user_gets_no_validators(self):
+        response = self.authorized_client.get(self.url)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_new_comment_invalidates_anonymous_page(self):
+        """Новый комментарий сразу виден анонимному читателю."""
+        self.guest_client.get(self.url)
+        with run_on_commit():
+            self.authorized_client.post(
+                reverse('posts:add_comment', args=[self.post.pk]),
+                data={'text': 'Свежий комментарий'},
+            )
+        self.assertContains(
+            self.guest_client.get(self.url), 'Свежий комментарий')
+
+    def test_author_post_count_refreshed(self):
+        """Новый пост автора меняет счётчик на странице старого поста."""
+        self.guest_client.get(self.url)
+        with run_on_commit():
+            self.authorized_client.post(
+                reverse('posts:post_create'), {'text': 'Ещё пост'})
+        self.assertContains(self.guest_client.get(self.url),
+                            'Всего постов автора: <span >2</span>')
+
+    def test_generation_bumped_after_commit(self):
+        """До коммита страница остаётся в старом поколении: иначе
+        параллельный читатель закешировал бы под новым поколением
+        незакоммиченные данные."""
+        scope = cache_generations.post_scope(self.post.pk)
+        before = cache_generations.generation(scope)
+        with run_on_commit():
+            Post.objects.get(pk=self.post.pk).save()
+            self.assertEqual(cache_generations.generation(scope), before)
+        self.assertNotEqual(cache_generations.generation(scope), before)
+
+
+class CommentsPaginationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='comment_author')
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=cls.user, text=f'Отзыв {index}')
+            for index in range(COUNT_COMMENTS + 5))
+        cls.comments = list(
+            Comment.objects.filter(post=cls.post).order_by('created', 'id'))
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.url = reverse('posts:post_detail', args=[self.post.pk])
+
+    def test_first_page_and_load_more(self):
+        """Пост показывает первую порцию, «Показать ещё» — остальное,
+        каждая порция — один запрос вместе с авторами."""
+        response = self.client.get(self.url)
+        comments = response.context['comments']
+        self.assertEqual(list(comments), self.comments[:COUNT_COMMENTS])
+        self.assertContains(response, 'data-load-more')
+        with self.assertNumQueries(1):
+            fragment = self.client.get(
+                reverse('posts:post_comments', args=[self.post.pk]),
+                {'cursor': comments.next_cursor})
+            self.assertEqual(
+                list(fragment.context['comments']),
+                self.comments[COUNT_COMMENTS:])
+            self.assertNotContains(fragment, 'data-load-more')
+
+    def test_newest_first(self):
+        response = self.client.get(self.url, {'order': 'new'})
+        self.assertEqual(
+            list(response.context['comments']),
+            self.comments[::-1][:COUNT_COMMENTS])
+
+    def test_comment_block_cached_per_cursor(self):
+        """Страница поста с курсором комментариев не отдаёт
+        закешированную первую порцию."""
+        first = self.authorized_client.get(self.url)
+        cursor = first.context['comments'].next_cursor
+        response = self.authorized_client.get(self.url, {'cursor': cursor})
+        self.assertContains(response, self.comments[-1].text)
+        self.assertNotContains(response, self.comments[0].text)
+
+    def test_comment_block_cached_until_new_comment(self):
+        """Блок комментариев берётся из кеша, новый комментарий его
+        сбрасывает."""
+        self.authorized_client.get(self.url, {'order': 'new'})
+        Comment.objects.filter(pk=self.comments[-1].pk).update(
+            text='Тихая правка')
+        response = self.authorized_client.get(self.url, {'order': 'new'})
+        self.assertNotContains(response, 'Тихая правка')
+        with run_on_commit():
+            self.authorized_client.post(
+                reverse('posts:add_comment', args=[self.post.pk]),
+                data={'text': 'Свежий отзыв'})
+        response = self.authorized_client.get(self.url, {'order': 'new'})
+        self.assertContains(response, 'Свежий отзыв')
+        self.assertContains(response, 'Тихая правка')
+
+
+class SearchViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='search_author')
+        cls.strong = Post.objects.create(
+            author=cls.user, text='Котики котики и ещё раз котики')
+        cls.weak = Post.objects.create(
+            author=cls.user,
+            text='Длинный рассказ о собаках, где котики мелькают однажды')
+        Post.objects.create(author=cls.user, text='Про погоду')
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('posts:search')
+
+    def test_results_ranked_by_relevance(self):
+        """Выдача содержит только совпадения, самые релевантные выше."""
+        response = self.client.get(self.url, {'q': 'котики'})
+        self.assertEqual(
+            list(response.context['page_obj']), [self.strong, self.weak])
+
+    def test_prefix_and_operators_in_query(self):
+        """Последнее слово ищется по префиксу, синтаксис FTS5 в запросе
+        пользователя не ломает поиск."""
+        response = self.client.get(self.url, {'q': 'погод'})
+        self.assertEqual(len(response.context['page_obj']), 1)
+        response = self.client.get(self.url, {'q': '"котики" OR -('})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page_obj']), 0)
+
+    def test_index_follows_edit_and_delete(self):
+        """Правка и удаление поста сразу отражаются в поиске."""
+        post = Post.objects.get(pk=self.strong.pk)
+        post.text = 'Теперь про хомяков'
+        post.save()
+        Post.objects.get(pk=self.weak.pk).delete()
+        self.assertEqual(
+            len(self.client.get(
+                self.url, {'q': 'котики'}).context['page_obj']), 0)
+        self.assertEqual(
+            list(self.client.get(
+                self.url, {'q': 'хомяков'}).context['page_obj']),
+            [post])
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке отбирает посты по тому же индексу."""
+        admin = User.objects.create_superuser(
+            'search_admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'котики'})
+        self.assertEqual(
+            set(response.context['cl'].result_list),
+            {self.strong, self.weak})
+
+    def test_cursor_pages_keep_query(self):
+        """Курсор следующей страницы сохраняет запрос и не повторяет
+        посты."""
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'Лисы {index}')
+            for index in range(COUNT_POST + 3))
+        call_command('rebuild_search_index', stdout=StringIO())
+        first = self.client.get(self.url, {'q': 'лисы'})
+        self.assertContains(first, '?q=%D0%BB%D0%B8%D1%81%D1%8B&amp;cursor=')
+        page_obj = first.context['page_obj']
+        second = self.client.get(
+            self.url, {'q': 'лисы', 'cursor': page_obj.next_cursor})
+        seen = list(page_obj) + list(second.context['page_obj'])
+        self.assertEqual(len(seen), COUNT_POST + 3)
+        self.assertEqual(len(set(seen)), COUNT_POST + 3)
+
+
+class ExportViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='export_user')
+        for index in range(3):
+            Post.objects.create(author=cls.user, text=f'Пост {index}')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.url = reverse('posts:export')
+
+    def test_export_streams_ndjson(self):
+        response = self.authorized_client.get(self.url)
+        self.assertTrue(response.streaming)
+        rows = [
+            json.loads(line) for line in
+            b''.join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual([row['text'] for row in rows],
+                         ['Пост 0', 'Пост 1', 'Пост 2'])
+        self.assertEqual({row['author'] for row in rows}, {'export_user'})
+
+    def test_export_images_zip(self):
+        """ZIP картинок собирается потоком и читается обычным zipfile."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(MEDIA_ROOT=directory):
+            post = Post.objects.first()
+            post.image.save('export.gif', ContentFile(b'GIF89a'))
+            response = self.authorized_client.get(
+                self.url, {'kind': 'images'})
+            archive = zipfile.ZipFile(
+                BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), [post.image.name])
+        self.assertEqual(archive.read(post.image.name), b'GIF89a')
+
+    def test_export_requires_login(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+
+class AdminChangelistTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            'changelist_admin', 'admin@example.com', 'password')
+        Post.objects.bulk_create(
+            Post(author=cls.admin, text=f'Пост {index}')
+            for index in range(25))
+        post = Post.objects.first()
+        Comment.objects.create(post=post, author=cls.admin, text='Отзыв')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:posts_post_changelist')
+
+    def test_deep_page_read_by_keyset(self):
+        """Keyset-срез даёт те же строки, что OFFSET."""
+        with mock.patch('posts.admin.KEYSET_FROM', 0), \
+                mock.patch.object(PostAdmin, 'list_per_page', 10):
+            response = self.client.get(self.url, {'p': 1})
+        self.assertEqual(
+            list(response.context['cl'].result_list),
+            list(Post.objects.all()[10:20]))
+
+    def test_large_table_count_is_estimated(self):
+        """Большая таблица считается по статистике ANALYZE."""
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        with mock.patch('posts.admin.EXACT_COUNT_LIMIT', 5):
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['cl'].result_count, 25)
+        self.assertIsInstance(
+            response.context['cl'].paginator, ScalablePaginator)
+
+    def test_comment_search_by_author(self):
+        """Комментарии ищутся по точному имени автора."""
+        response = self.client.get(
+            reverse('admin:posts_comment_changelist'),
+            {'q': 'changelist_admin'})
+        self.assertEqual(response.context['cl'].result_count, 1)
 
 
 class PaginatorViewsTest(TestCase):
@@ -377,20 +723,18 @@ class PaginatorViewsTest(TestCase):
         """Создаем клиента и 14 постов для теста(10+4)."""
         self.client = Client()
         self.count_of_posts_to_create = 14
-        for post in range(self.count_of_posts_to_create):
-            Post.objects.create(
-                author=self.author,
-                text=f'test_text_{post}',
-                group=self.group)
+        with run_on_commit():
+            for post in range(self.count_of_posts_to_create):
+                Post.objects.create(
+                    author=self.author,
+                    text=f'test_text_{post}',
+                    group=self.group)
 
     def test_page_index_paginator(self):
         """Проверяем пагинацию страницы for index."""
         self._check_pagination_correct(
             reverse('posts:index'),
-            COUNT_POST
-        )
-        self._check_pagination_correct(
-            reverse('posts:index') + '?page=2',
+            COUNT_POST,
             self.count_of_posts_to_create % COUNT_POST
         )
 
@@ -398,10 +742,7 @@ class PaginatorViewsTest(TestCase):
         """Проверяем пагинацию страницы for group_list."""
         self._check_pagination_correct(
             reverse('posts:group_list', args=[self.group.slug]),
-            COUNT_POST
-        )
-        self._check_pagination_correct(
-            reverse('posts:group_list', args=[self.group.slug]) + '?page=2',
+            COUNT_POST,
             self.count_of_posts_to_create % COUNT_POST
         )
 
@@ -409,15 +750,117 @@ class PaginatorViewsTest(TestCase):
         """Проверяем пагинацию страницы for profile."""
         self._check_pagination_correct(
             reverse('posts:profile', args=[self.author.username]),
-            COUNT_POST
-        )
-        self._check_pagination_correct(
-            reverse('posts:profile', args=[self.author.username]) + '?page=2',
+            COUNT_POST,
             self.count_of_posts_to_create % COUNT_POST
         )
 
-    def _check_pagination_correct(self, page: str, expected: int):
-        """Сравниваем кол-во постов на странице с ожидаемым результатом."""
+    def test_cursor_previous_and_last_pages(self):
+        """Курсор назад возвращает первую страницу,
+        курсор последней страницы — полная страница самых старых постов."""
+        url = reverse('posts:index')
+        first_page = self.client.get(url).context['page_obj']
+        second_page = self.client.get(
+            url, {'cursor': first_page.next_cursor}).context['page_obj']
+        back_page = self.client.get(
+            url, {'cursor': second_page.previous_cursor}).context['page_obj']
+        self.assertEqual(list(back_page), list(first_page))
+        self.assertFalse(back_page.has_previous())
+        last_page = self.client.get(
+            url, {'cursor': first_page.last_cursor}).context['page_obj']
+        self.assertEqual(len(last_page), COUNT_POST)
+        self.assertEqual(
+            list(last_page)[-len(second_page):], list(second_page))
+        self.assertFalse(last_page.has_next())
+
+    def test_index_cache_is_page_aware(self):
+        """Вторая страница не отдаётся из кеша первой."""
+        url = reverse('posts:index')
+        first = self.client.get(url)
+        second = self.client.get(
+            url, {'cursor': first.context['page_obj'].next_cursor})
+        self.assertNotEqual(first.content, second.content)
+        self.assertContains(second, 'test_text_0')
+
+    def test_invalid_cursor_returns_first_page(self):
+        """Битый курсор не роняет страницу, а отдаёт начало ленты."""
+        response = self.client.get(
+            reverse('posts:index'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(len(response.context['page_obj']), COUNT_POST)
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+    def _check_pagination_correct(self, page: str, expected: int,
+                                  expected_next: int):
+        """Сравниваем кол-во постов на странице и на следующей по
+        курсору с ожидаемым результатом."""
         response = self.client.get(page)
-        count_posts_on_page = len(response.context['page_obj'])
-        self.assertEqual(count_posts_on_page, expected)
+        page_obj = response.context['page_obj']
+        self.assertEqual(len(page_obj), expected)
+        response = self.client.get(page, {'cursor': page_obj.next_cursor})
+        next_page_obj = response.context['page_obj']
+        self.assertEqual(len(next_page_obj), expected_next)
+        self.assertFalse(next_page_obj.has_next())
+        self.assertTrue(set(page_obj).isdisjoint(next_page_obj))
+
+
+class FollowTimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='timeline_author')
+        cls.reader = User.objects.create_user(username='timeline_reader')
+        cls.old_post = Post.objects.create(
+            author=cls.author, text='Пост до подписки')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def _feed(self):
+        response = self.client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_follow_backfills_and_new_posts_fan_out(self):
+        """Подписка добавляет в ленту прошлые посты автора,
+        новый пост автора раскладывается по ленте подписчика."""
+        self.client.get(
+            reverse('posts:profile_follow', args=[self.author.username]))
+        self.assertEqual(self._feed(), [self.old_post])
+        new_post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=new_post).exists())
+        self.assertEqual(self._feed(), [new_post, self.old_post])
+
+    def test_unfollow_trims_timeline(self):
+        """Отписка убирает посты автора из ленты."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.client.get(
+            reverse('posts:profile_unfollow', args=[self.author.username]))
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=self.reader).exists())
+        self.assertEqual(self._feed(), [])
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_celebrity_posts_read_on_fan_out(self):
+        """Посты популярного автора не раскладываются, а читаются
+        при открытии ленты."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self._feed(), [new_post, self.old_post])
+
+    @override_settings(FEED_FANOUT_LIMIT=2)
+    def test_former_celebrity_posts_stay_in_feed(self):
+        """Пост, написанный сверх FEED_FANOUT_LIMIT, остаётся в ленте,
+        когда автор опускается ниже порога чтения."""
+        others = [User.objects.create_user(username=f'timeline_{index}')
+                  for index in range(2)]
+        for user in [self.reader, *others]:
+            Follow.objects.create(user=user, author=self.author)
+        new_post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertFalse(TimelineEntry.objects.filter(
+            post=new_post).exists())
+        for user in others:
+            Follow.objects.filter(user=user, author=self.author).delete()
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=new_post).exists())
+        self.assertEqual(self._feed(), [new_post, self.old_post])
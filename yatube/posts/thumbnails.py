@@ -0,0 +1,245 @@
+"""Предварительная генерация миниатюр sorl-thumbnail.
+
+Шаблоны запрашивают миниатюры известных размеров; если сделать их сразу
+после загрузки картинки, первый показ ленты не декодирует и не
+масштабирует изображение внутри запроса. Для лент дополнительно
+готовятся адаптивные варианты (WebP и JPEG нескольких ширин), их
+манифест хранится в Post.image_variants.
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE, KVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.tasks import task
+
+logger = logging.getLogger(__name__)
+
+# Миниатюра постов в лентах: геометрия и опции {% thumbnail %}.
+FEED_THUMBNAIL = ('960x339', {'crop': 'center', 'upscale': True})
+# Все геометрии, которые используют шаблоны.
+THUMBNAIL_GEOMETRIES = (
+    FEED_THUMBNAIL,
+)
+
+# Ширины адаптивных вариантов; пропорции те же, что у FEED_THUMBNAIL.
+RESPONSIVE_WIDTHS = (320, 640, 960)
+RESPONSIVE_RATIO = 339 / 960
+# Форматы вариантов: WebP и JPEG для браузеров без WebP.
+VARIANT_FORMATS = ('WEBP', 'JPEG')
+VARIANT_QUALITY = 80
+# Атрибут sizes: на узких экранах картинка во всю ширину.
+RESPONSIVE_SIZES = '(max-width: 992px) 100vw, 960px'
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            thread_name_prefix='thumbnails',
+        )
+    return _executor
+
+
+def generate(image_name):
+    """Создаёт все миниатюры картинки. Повторный вызов ничего не
+    пересчитывает: sorl находит готовые миниатюры в kvstore.
+    Возвращает число геометрий, которые не удалось обработать."""
+    failed = 0
+    for geometry, options in THUMBNAIL_GEOMETRIES:
+        try:
+            get_thumbnail(image_name, geometry, **options)
+        except Exception:
+            failed += 1
+            logger.exception('Не удалось создать миниатюру %s %s',
+                             image_name, geometry)
+    return failed
+
+
+def build_variants(image_name):
+    """Создаёт адаптивные варианты картинки и возвращает манифест
+    {формат: [[ширина, высота, имя файла], ...]} по возрастанию ширины.
+    Картинка не растягивается: ширины больше исходной пропускаются."""
+    source = default.kvstore.get_or_set(ImageFile(image_name))
+    widths = [
+        width for width in RESPONSIVE_WIDTHS if width <= source.width
+    ] or RESPONSIVE_WIDTHS[:1]
+    manifest = {}
+    for image_format in VARIANT_FORMATS:
+        variants = {}
+        for width in widths:
+            height = round(width * RESPONSIVE_RATIO)
+            image = get_thumbnail(
+                image_name, f'{width}x{height}', crop='center',
+                format=image_format, quality=VARIANT_QUALITY)
+            variants.setdefault(
+                image.width, [image.width, image.height, image.name])
+        manifest[image_format] = sorted(variants.values())
+    return manifest
+
+
+def generate_post(post_id, image_name, using=None):
+    """Миниатюры и адаптивные варианты картинки поста. Манифест
+    записывается, только если картинка поста не сменилась за время
+    генерации. using — база поста (шард). Возвращает число неудавшихся
+    шагов."""
+    from . import cache, sharding
+    from .models import Post
+
+    failed = generate(image_name)
+    try:
+        manifest = build_variants(image_name)
+    except Exception:
+        logger.exception('Не удалось создать варианты картинки %s',
+                         image_name)
+        return failed + 1
+    posts = Post.objects.using(using).filter(pk=post_id)
+    updated = posts.filter(image=image_name).update(
+        image_variants=json.dumps(manifest))
+    if updated:
+        # update() не отправляет сигналы: ленты перерисуются с srcset.
+        post, = sharding.attach(posts)
+        cache.bump(*cache.post_scopes(
+            post, post.group.slug if post.group else None))
+    return failed
+
+
+def generate_in_worker(post_id, image_name, using=None):
+    try:
+        return generate_post(post_id, image_name, using)
+    finally:
+        # У каждого потока свои соединения с базами (kvstore sorl, шард).
+        connections.close_all()
+
+
+@task(atomic=False)
+def generate_task(post_id, image_name, using=None):
+    """generate_post в очереди core.tasks: неудача — повод повторить."""
+    failed = generate_post(post_id, image_name, using)
+    if failed:
+        raise RuntimeError(
+            f'Миниатюры {image_name}: не удалось шагов — {failed}.')
+
+
+def schedule(post):
+    """Ставит генерацию миниатюр поста в очередь core.tasks, а при
+    TASKS_EAGER — в пул после коммита транзакции. При
+    THUMBNAIL_WORKERS = 0 миниатюры создаются синхронно."""
+    if not post.image:
+        return
+    post_id, image_name, using = post.pk, post.image.name, post._state.db
+    if not settings.TASKS_EAGER:
+        generate_task.delay(post_id, image_name, using)
+        return
+    if not settings.THUMBNAIL_WORKERS:
+        transaction.on_commit(
+            lambda: generate_post(post_id, image_name, using))
+        return
+    transaction.on_commit(lambda: get_executor().submit(
+        generate_in_worker, post_id, image_name, using))
+
+
+def variant_sources(post):
+    """Атрибуты <picture> для поста по манифесту вариантов:
+    srcset для каждого формата, src и размеры самого широкого JPEG.
+    Пустой словарь, если варианты ещё не готовы."""
+    if not post.image or not post.image_variants:
+        return {}
+    try:
+        manifest = json.loads(post.image_variants)
+        fallback = manifest['JPEG'][-1]
+    except (ValueError, KeyError, IndexError):
+        return {}
+    storage = default.storage
+    sources = {
+        image_format.lower(): ', '.join(
+            f'{storage.url(name)} {width}w' for width, _, name in variants)
+        for image_format, variants in manifest.items()
+    }
+    width, height, name = fallback
+    sources.update(src=storage.url(name), width=width, height=height,
+                   sizes=RESPONSIVE_SIZES)
+    return sources
+
+
+def thumbnail_file(image_name, geometry, options):
+    """Файл миниатюры с тем же именем, что вычисляет backend sorl
+    в get_thumbnail, но без обращения к kvstore."""
+    backend = default.backend
+    source = ImageFile(image_name)
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return ImageFile(name, default.storage)
+
+
+def _lookup_many(raw_keys):
+    """Значения kvstore sorl по списку ключей: один get_many в кеш
+    и один запрос в базу за промахами."""
+    kvstore = default.kvstore
+    if not isinstance(kvstore, KVStore):
+        return {key: kvstore._get_raw(key) for key in raw_keys}
+    found = kvstore.cache.get_many(raw_keys)
+    missing = [key for key in raw_keys if key not in found]
+    if missing:
+        stored = dict(KVStoreModel.objects.filter(
+            key__in=missing).values_list('key', 'value'))
+        kvstore.cache.set_many(
+            stored, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        found.update(stored)
+    return {
+        key: value for key, value in found.items()
+        if value and value != EMPTY_VALUE
+    }
+
+
+def prefetch(image_names, geometry, options):
+    """Миниатюры для набора картинок разом: {имя картинки: ImageFile}.
+    Ещё не созданные миниатюры создаются как в {% thumbnail %}."""
+    files = {
+        name: thumbnail_file(name, geometry, options)
+        for name in set(image_names)
+    }
+    raw_keys = {add_prefix(image.key): name for name, image in files.items()}
+    found = _lookup_many(list(raw_keys))
+    result = {}
+    for raw_key, name in raw_keys.items():
+        if raw_key in found:
+            result[name] = deserialize_image_file(found[raw_key])
+            continue
+        try:
+            result[name] = get_thumbnail(name, geometry, **options)
+        except Exception:
+            logger.exception('Не удалось создать миниатюру %s %s',
+                             name, geometry)
+    return result
+
+
+def prefetch_for_posts(posts):
+    """Миниатюры постов страницы, у которых ещё нет адаптивных
+    вариантов."""
+    geometry, options = FEED_THUMBNAIL
+    return prefetch(
+        (post.image.name for post in posts
+         if post.image and not post.image_variants),
+        geometry, options,
+    )
@@ -0,0 +1,223 @@
+"""Ленты подписок: fan-out-on-write с fan-out-on-read для популярных авторов.
+
+Новый пост раскладывается в TimelineEntry каждого подписчика автора.
+У авторов с очень большим числом подписчиков раскладка не делается:
+их посты подмешиваются в ленту при чтении (гибридная схема).
+fan_out, backfill и trim — задачи core.tasks и принимают только id.
+"""
+import heapq
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from core.tasks import task
+
+from .models import AuthorStats, Follow, Post, TimelineEntry
+from .utils import CURSOR_NEXT, CursorPaginator
+
+TIMELINE_BATCH_SIZE = 500
+
+
+def is_celebrity(author_id):
+    """Автор с числом подписчиков больше FEED_FANOUT_LIMIT."""
+    return AuthorStats.objects.filter(
+        pk=author_id,
+        followers_count__gt=settings.FEED_FANOUT_LIMIT,
+    ).exists()
+
+
+def celebrity_ids(user):
+    """Популярные авторы, на которых подписан user.
+    Порог чтения вдвое ниже порога записи: автор, опустившийся чуть ниже
+    FEED_FANOUT_LIMIT, по-прежнему подмешивается при чтении, и его посты,
+    не разложенные по лентам, не пропадают. Дубли снимает слияние.
+    Опустившись до порога чтения, автор раскладывается по лентам
+    заново (drop_follower)."""
+    return list(AuthorStats.objects.filter(
+        user__following__user=user,
+        followers_count__gt=settings.FEED_FANOUT_LIMIT // 2,
+    ).values_list('pk', flat=True))
+
+
+def _bulk_insert(entries):
+    TimelineEntry.objects.bulk_create(
+        entries, batch_size=TIMELINE_BATCH_SIZE, ignore_conflicts=True)
+
+
+@task()
+def fan_out(post_id):
+    """Раскладывает новый пост по лентам подписчиков автора.
+    Пост, удалённый до выполнения задачи, пропускается."""
+    post = Post.objects.filter(pk=post_id).values(
+        'author_id', 'pub_date').first()
+    if post is None or is_celebrity(post['author_id']):
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=post['author_id']).values_list('user_id', flat=True)
+    _bulk_insert(
+        TimelineEntry(user_id=user_id, post_id=post_id, **post)
+        for user_id in follower_ids.iterator()
+    )
+
+
+@task()
+def backfill(user_id, author_id):
+    """После подписки добавляет в ленту последние посты автора."""
+    if is_celebrity(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id').values_list('id', 'pub_date')
+    _bulk_insert(
+        TimelineEntry(user_id=user_id, post_id=post_id,
+                      author_id=author_id, pub_date=pub_date)
+        for post_id, pub_date in posts[:settings.FEED_BACKFILL_SIZE]
+    )
+
+
+BACKFILL_SQL = """
+    INSERT INTO {timeline} (user_id, post_id, author_id, pub_date)
+    SELECT follow.user_id, recent.id, recent.author_id, recent.pub_date
+    FROM {follow} follow CROSS JOIN (
+        SELECT id, author_id, pub_date FROM {post}
+        WHERE author_id = %s
+        ORDER BY pub_date DESC, id DESC
+        LIMIT %s
+    ) recent
+    WHERE follow.author_id = %s
+    ON CONFLICT DO NOTHING
+""".format(
+    timeline=TimelineEntry._meta.db_table,
+    follow=Follow._meta.db_table,
+    post=Post._meta.db_table,
+)
+
+
+def _backfill_author(cursor, author_id):
+    cursor.execute(BACKFILL_SQL, [
+        author_id, settings.FEED_BACKFILL_SIZE, author_id])
+
+
+@task()
+def drop_follower(author_id):
+    """Уменьшает число подписчиков автора после отписки. Автор,
+    опустившийся до порога чтения, больше не подмешивается в ленты
+    при чтении: его последние посты, в том числе написанные сверх
+    FEED_FANOUT_LIMIT, раскладываются по лентам всех подписчиков.
+    Уменьшение и проверка — в одной транзакции, поэтому порог
+    видит ровно одна отписка."""
+    # counters импортирует sharding, а тот — этот модуль.
+    from .counters import drop_author
+
+    drop_author(author_id, followers_count=-1)
+    followers = AuthorStats.objects.filter(pk=author_id).values_list(
+        'followers_count', flat=True).first()
+    if followers == settings.FEED_FANOUT_LIMIT // 2:
+        with connection.cursor() as cursor:
+            _backfill_author(cursor, author_id)
+
+
+def backfill_all():
+    """Заполняет ленты по всем подпискам, например после массовой
+    загрузки в обход сигналов. Повторный вызов ничего не дублирует.
+    Строки собирает сама база: один INSERT ... SELECT на автора,
+    без объектов моделей, всё в одной транзакции."""
+    authors = Follow.objects.exclude(
+        author__stats__followers_count__gt=settings.FEED_FANOUT_LIMIT,
+    ).order_by('author_id').values_list('author_id', flat=True).distinct()
+    with transaction.atomic(), connection.cursor() as cursor:
+        for author_id in authors.iterator():
+            _backfill_author(cursor, author_id)
+
+
+@task()
+def trim(user_id, author_id):
+    """После отписки убирает посты автора из ленты."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, author_id=author_id).delete()
+
+
+class MergedCursorPaginator(CursorPaginator):
+    """k-way слияние нескольких курсорных источников по (pub_date, id).
+    Каждый источник отдаёт не больше limit строк своим индексным срезом,
+    поэтому слияние остаётся O(per_page) независимо от глубины."""
+
+    def __init__(self, sources, per_page, **kwargs):
+        super().__init__(list(sources), per_page, **kwargs)
+
+    def fetch(self, position, direction, limit):
+        chunks = [
+            source.fetch(position, direction, limit)
+            for source in self.object_list
+        ]
+        # При oldest_first источники сами разворачивают направление.
+        newest_first = (direction == CURSOR_NEXT) != self.oldest_first
+        merged = heapq.merge(*chunks, key=self.key, reverse=newest_first)
+        rows, seen = [], set()
+        for row in merged:
+            key = self.key(row)
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append(row)
+            if len(rows) == limit:
+                break
+        return rows
+
+
+class TimelinePaginator(CursorPaginator):
+    """Курсорный срез TimelineEntry, отдающий сами посты."""
+
+    def __init__(self, user, per_page):
+        entries = TimelineEntry.objects.filter(user=user).select_related(
+            'post__author', 'post__group').order_by('-pub_date', '-post_id')
+        super().__init__(entries, per_page, id_field='post_id')
+
+    def key(self, post):
+        return post.pub_date, post.pk
+
+    def fetch(self, position, direction, limit):
+        entries = super().fetch(position, direction, limit)
+        return [entry.post for entry in entries]
+
+
+class TimelineKeyPaginator(CursorPaginator):
+    """Курсорный срез TimelineEntry, отдающий только ключи постов
+    {'pub_date', 'id'} — для выдачи через .values()."""
+
+    def __init__(self, user, per_page):
+        entries = TimelineEntry.objects.filter(user=user).values(
+            'pub_date', 'post_id').order_by('-pub_date', '-post_id')
+        super().__init__(entries, per_page, id_field='post_id')
+
+    def key(self, row):
+        return row['pub_date'], row['id']
+
+    def fetch(self, position, direction, limit):
+        return [
+            {'pub_date': row['pub_date'], 'id': row['post_id']}
+            for row in super().fetch(position, direction, limit)
+        ]
+
+
+def follow_key_paginator(user, per_page):
+    """Как follow_paginator, но без экземпляров моделей: страница
+    состоит из ключей постов."""
+    sources = [TimelineKeyPaginator(user, per_page)]
+    celebrities = celebrity_ids(user)
+    if celebrities:
+        posts = Post.objects.filter(author_id__in=celebrities).values(
+            'pub_date', 'id')
+        sources.append(CursorPaginator(posts, per_page))
+    return MergedCursorPaginator(sources, per_page)
+
+
+def follow_paginator(user, per_page):
+    """Пагинатор ленты подписок: материализованная лента
+    плюс посты популярных авторов, читаемые напрямую."""
+    sources = [TimelinePaginator(user, per_page)]
+    celebrities = celebrity_ids(user)
+    if celebrities:
+        posts = Post.objects.select_related('author', 'group').filter(
+            author_id__in=celebrities)
+        sources.append(CursorPaginator(posts, per_page))
+    return MergedCursorPaginator(sources, per_page)
@@ -1,12 +1,190 @@
-# from django.conf import settings
-from django.core.paginator import Paginator
+import base64
+import binascii
 
-#  Число страниц
+from django.core.paginator import Page, Paginator
+from django.utils.dateparse import parse_datetime
+
+#  Число страниц
 COUNT_PAGES = 10
+# Комментариев на странице поста и в каждой подгрузке.
+COUNT_COMMENTS = 20
+
+# Направление курсора: вперёд (к старым постам) и назад (к новым).
+CURSOR_NEXT = 'n'
+CURSOR_PREV = 'p'
+
+
+def dump_date(value):
+    return value.isoformat()
+
+
+def encode_cursor(direction, position=None, dump=dump_date):
+    """Непрозрачный токен курсора: направление и ключ (дата, id).
+    dump превращает первую часть ключа в строку."""
+    raw = direction
+    if position is not None:
+        date, pk = position
+        raw = f'{direction}|{dump(date)}|{pk}'
+    token = base64.urlsafe_b64encode(raw.encode())
+    return token.decode().rstrip('=')
+
+
+def decode_cursor(token, load=parse_datetime):
+    """Разбор токена курсора. Битый токен означает первую страницу.
+    load — обратная к dump функция; None означает битое значение."""
+    if not token:
+        return CURSOR_NEXT, None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+    except (binascii.Error, ValueError):
+        return CURSOR_NEXT, None
+    direction, *position = raw.split('|')
+    if direction not in (CURSOR_NEXT, CURSOR_PREV):
+        return CURSOR_NEXT, None
+    if not position:
+        return direction, None
+    try:
+        date = load(position[0])
+        pk = int(position[1])
+    except (IndexError, ValueError):
+        return CURSOR_NEXT, None
+    if date is None:
+        return CURSOR_NEXT, None
+    return direction, (date, pk)
+
+
+class CursorPage(Page):
+    """Страница курсорной пагинации.
+    Сохраняет контракт page_obj: итерация, len, has_next/has_previous;
+    вместо номеров страниц отдаёт токены next_cursor/previous_cursor.
+    Строки читаются при первом обращении, поэтому страница, целиком
+    отданная из кеша шаблона, не делает запросов к базе."""
+
+    def __init__(self, paginator, direction, position):
+        self.number = None
+        self.paginator = paginator
+        self.direction = direction
+        self.position = position
+        self._object_list = None
+
+    def __repr__(self):
+        return '<CursorPage of %s items>' % len(self)
+
+    def _load(self):
+        if self._object_list is not None:
+            return
+        per_page = self.paginator.per_page
+        rows = self.paginator.fetch(
+            self.position, self.direction, per_page + 1)
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        if self.direction == CURSOR_PREV:
+            rows.reverse()
+            self._has_next = self.position is not None
+            self._has_previous = has_more
+        else:
+            self._has_next = has_more
+            self._has_previous = self.position is not None
+        self._object_list = rows
+
+    @property
+    def object_list(self):
+        self._load()
+        return self._object_list
+
+    @object_list.setter
+    def object_list(self, value):
+        self._object_list = value
+
+    def has_next(self):
+        self._load()
+        return self._has_next
+
+    def has_previous(self):
+        self._load()
+        return self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        paginator = self.paginator
+        return paginator.encode(CURSOR_NEXT, paginator.key(self[-1]))
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous():
+            return None
+        paginator = self.paginator
+        return paginator.encode(CURSOR_PREV, paginator.key(self[0]))
+
+    @property
+    def last_cursor(self):
+        return self.paginator.encode(CURSOR_PREV)
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинация по (date_field, id_field) от новых к старым,
+    при oldest_first — от старых к новым.
+    Не делает COUNT(*) и OFFSET: каждая страница — один индексный срез.
+    Подклассы с ключом не по дате переопределяют dump_value/load_value."""
+    dump_value = staticmethod(dump_date)
+    load_value = staticmethod(parse_datetime)
+
+    def __init__(self, object_list, per_page,
+                 date_field='pub_date', id_field='id', oldest_first=False):
+        super().__init__(object_list, per_page)
+        self.date_field = date_field
+        self.id_field = id_field
+        self.oldest_first = oldest_first
+
+    def _check_object_list_is_ordered(self):
+        """Порядок задаёт сам пагинатор в order()."""
+
+    def key(self, obj):
+        if isinstance(obj, dict):
+            return obj[self.date_field], obj[self.id_field]
+        return getattr(obj, self.date_field), getattr(obj, self.id_field)
+
+    def seek(self, queryset, position, direction):
+        """Отбор строк строго после (или до) позиции курсора.
+        pub_date <= d AND NOT (pub_date = d AND id >= pk) даёт
+        диапазонный поиск по индексу вместо OR по двум условиям."""
+        date, pk = position
+        date_field, id_field = self.date_field, self.id_field
+        if direction == CURSOR_NEXT:
+            return queryset.filter(**{f'{date_field}__lte': date}).exclude(
+                **{date_field: date, f'{id_field}__gte': pk})
+        return queryset.filter(**{f'{date_field}__gte': date}).exclude(
+            **{date_field: date, f'{id_field}__lte': pk})
+
+    def order(self, queryset, direction):
+        if direction == CURSOR_NEXT:
+            return queryset.order_by(
+                f'-{self.date_field}', f'-{self.id_field}')
+        return queryset.order_by(self.date_field, self.id_field)
+
+    def fetch(self, position, direction, limit):
+        if self.oldest_first:
+            # «Вперёд» по возрастанию — это «назад» по убыванию.
+            direction = (CURSOR_PREV if direction == CURSOR_NEXT
+                         else CURSOR_NEXT)
+        queryset = self.object_list
+        if position is not None:
+            queryset = self.seek(queryset, position, direction)
+        return list(self.order(queryset, direction)[:limit])
+
+    def encode(self, direction, position=None):
+        return encode_cursor(direction, position, self.dump_value)
+
+    def get_page(self, cursor):
+        direction, position = decode_cursor(cursor, self.load_value)
+        return CursorPage(self, direction, position)
 
 
-def paginator_context(request, queryset):
-    paginator = Paginator(queryset, COUNT_PAGES)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+def paginator_context(request, queryset, paginator=CursorPaginator,
+                      **kwargs):
+    paginator = paginator(queryset, COUNT_PAGES, **kwargs)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     return page_obj
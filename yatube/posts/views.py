@@ -1,52 +1,78 @@
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.http import urlencode
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.db import transaction
 from django.urls import reverse
-# from django.views.decorators.cache import cache_page
 
+from . import cache, export, sharding
 from .forms import PostForm, CommentForm
-from .models import Group, Post, User, Follow
+from .models import Comment, Group, Post, User, Follow
 
-from .utils import paginator_context
+from .search import search_paginator
+from .timeline import follow_paginator
+from .utils import COUNT_COMMENTS, COUNT_PAGES, paginator_context
 
 
 COUNT_POST = 10
+# Порядок комментариев: ?order=old (по умолчанию) или ?order=new.
+COMMENTS_NEWEST = 'new'
+COMMENTS_OLDEST = 'old'
 
 
-# @cache_page(20 * 15)
+@cache.anonymous_page(cache.FEED)
 def index(request):
     """Главная страница."""
+    cache_generation = cache.generation(cache.FEED)
     posts = Post.objects.select_related('author', 'group')
-    paginator = Paginator(posts, COUNT_POST)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginator_context(request, posts, sharding.paginator)
     context = {
         'page_obj': page_obj,
+        'cache_generation': cache_generation,
     }
     return render(request, 'posts/index.html', context)
 
 
+@cache.anonymous_page(cache.FEED)
+def search(request):
+    """Поиск по тексту постов, самые релевантные выше."""
+    query = request.GET.get('q', '').strip()
+    paginator = search_paginator(query, COUNT_PAGES)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'paginator_query': urlencode({'q': query}),
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@cache.anonymous_page(cache.group_scope)
 def group_posts(request, slug):
     """Страница списка групп постов."""
+    cache_generation = cache.generation(cache.group_scope(slug))
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, COUNT_POST)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = group.posts.select_related('author', 'group')
+    page_obj = paginator_context(request, post_list, sharding.paginator)
     context = {
         'group': group,
         'page_obj': page_obj,
+        'cache_generation': cache_generation,
     }
     return render(request, 'posts/group_list.html', context)
 
 
+@cache.anonymous_page(cache.author_scope)
 def profile(request, username):
     """Cписок постов пользователя, информация о пользователе.
     Проверка: подписан ли текущий пользователь на автора, страницу
     которого он просматривает; результат проверки переменной following."""
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.select_related('author').all()
-    page_obj = paginator_context(request, posts)
+    cache_generation = cache.generation(cache.author_scope(username))
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username)
+    posts = author.posts.select_related('author', 'group').all()
+    page_obj = paginator_context(request, posts, sharding.paginator,
+                                 shard=sharding.author_shard(author.pk))
     following = True
     if request.user.is_authenticated:
         following = Follow.objects.filter(
@@ -57,33 +83,72 @@ def profile(request, username):
             'author': author,
             'page_obj': page_obj,
             'following': following,
+            'cache_generation': cache_generation,
         }
         return render(request, 'posts/profile.html', context)
     context = {
         'author': author,
         'page_obj': page_obj,
+        'cache_generation': cache_generation,
     }
     return render(request, 'posts/profile.html', context)
 
 
+@cache.anonymous_page(cache.post_scope, cache.post_author_scope)
 def post_detail(request, post_id):
     """Страница поста пользоввателя и общее количество постов."""
-    post = get_object_or_404(Post, id=post_id)
-    post_number = Post.objects.filter(author=post.author).count()
+    comments_generation = cache.generation(cache.post_scope(post_id))
+    post = sharding.get_post_or_404(
+        Post.objects.select_related('author__stats', 'group'), id=post_id)
+    post_number = post.author.stats.posts_count
     post_comment = post.text
     form = CommentForm()
-    comments = post.comments.all()
+    comments, comment_order = comments_page(
+        request, post.pk, post._state.db)
     context = {
         'post': post,
         'post_number': post_number,
         'post_comment': post_comment,
         'form': form,
-        'comments': comments
+        'comments': comments,
+        'comment_order': comment_order,
+        'comments_generation': comments_generation,
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+def comments_page(request, post_id, shard=None):
+    """Страница комментариев поста вместе с авторами одним запросом.
+    shard — шард поста, если посты шардированы. Возвращает страницу
+    и выбранный порядок."""
+    order = request.GET.get('order')
+    if order != COMMENTS_NEWEST:
+        order = COMMENTS_OLDEST
+    paginator = sharding.paginator(
+        Comment.objects.filter(post_id=post_id).select_related('author'),
+        COUNT_COMMENTS,
+        shard=shard,
+        date_field='created',
+        oldest_first=order == COMMENTS_OLDEST,
+    )
+    return paginator.get_page(request.GET.get('cursor')), order
+
+
+@cache.anonymous_page(cache.post_scope)
+def post_comments(request, post_id):
+    """Фрагмент со следующей порцией комментариев для «Показать ещё»."""
+    comments, comment_order = comments_page(
+        request, post_id, sharding.post_shard(post_id))
+    context = {
+        'post_id': post_id,
+        'comments': comments,
+        'comment_order': comment_order,
+    }
+    return render(request, 'includes/comments.html', context)
+
+
 @login_required
+@transaction.atomic
 def post_create(request):
     """Добавление нового поста."""
     form = PostForm(
@@ -105,9 +170,10 @@ def post_create(request):
 
 
 @login_required
+@transaction.atomic
 def post_edit(request, post_id):
     """Cтраница редактирования постов"""
-    post = get_object_or_404(Post, pk=post_id)
+    post = sharding.get_post_or_404(Post.objects, pk=post_id)
     if request.user != post.author:
         return redirect('posts:post_detail', post_id)
     form = PostForm(
@@ -129,8 +195,10 @@ def post_edit(request, post_id):
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = sharding.get_post_or_404(
+        Post.objects.select_related('author', 'group'), pk=post_id)
     # Получите пост и сохраните его в переменную post.
     form = CommentForm(request.POST or None)
     if form.is_valid():
@@ -146,16 +214,20 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    """Информация о текущем пользователе доступна в переменной request.user."""
-    list_posts = Post.objects.select_related('author', 'group').filter(
-        author__following__user=request.user
-    )
-    page_obj = paginator_context(request, list_posts)
+    """Информация о текущем пользователе доступна в переменной request.user.
+    Посты читаются из материализованной ленты TimelineEntry,
+    с шардами — прямо из шардов авторов."""
+    if sharding.enabled():
+        paginator = sharding.follow_paginator(request.user, COUNT_PAGES)
+    else:
+        paginator = follow_paginator(request.user, COUNT_PAGES)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     context = {'page_obj': page_obj}
     return render(request, 'posts/follow.html', context)
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     """Подписаться на автора."""
     author = get_object_or_404(User, username=username)
@@ -167,11 +239,36 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     """Дизлайк, отписка.
     Проверка is_follower существует, то удаляем подписку."""
     author = get_object_or_404(User, username=username)
-    is_follower = Follow.objects.filter(user=request.user, author=author)
-    if is_follower.exists():
-        is_follower.delete()
+    follow = Follow.objects.filter(user=request.user, author=author).first()
+    if follow is not None:
+        # Сигналы удаления читают автора: отдаём уже загруженного.
+        follow.author = author
+        follow.delete()
     return redirect('posts:profile', username=author)
+
+
+@login_required
+def export_data(request):
+    """Потоковая выгрузка своих постов, комментариев и подписок
+    (?kind=posts|comments|follows, ?format=ndjson|csv) или ZIP картинок
+    постов (?kind=images)."""
+    kind = request.GET.get('kind', 'posts')
+    file_format = request.GET.get('format', 'ndjson')
+    if kind == 'images':
+        response = StreamingHttpResponse(
+            export.zip_images(request.user), content_type='application/zip')
+        filename = 'images.zip'
+    elif kind in export.EXPORTS and file_format in export.FORMATS:
+        response = StreamingHttpResponse(
+            export.lines(kind, request.user, file_format),
+            content_type=export.CONTENT_TYPES[file_format])
+        filename = f'{kind}.{export.EXTENSIONS[file_format]}'
+    else:
+        return HttpResponseBadRequest('Неизвестный вид или формат выгрузки.')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
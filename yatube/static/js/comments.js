@@ -0,0 +1,11 @@
+// «Показать ещё» подгружает следующую порцию комментариев на место ссылки.
+document.addEventListener('click', function (event) {
+  const link = event.target.closest('[data-load-more]');
+  if (!link) {
+    return;
+  }
+  event.preventDefault();
+  fetch(link.href)
+    .then(function (response) { return response.text(); })
+    .then(function (html) { link.outerHTML = html; });
+});
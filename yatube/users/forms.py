@@ -1,7 +1,12 @@
-from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.forms import PasswordResetForm, UserCreationForm
 from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
 from django import forms
 
+from core.tasks import task
+
 from .models import Contact
 
 
@@ -18,3 +23,42 @@ class ContactForm(forms.ModelForm):
     class Meta:
         model = Contact
         fields = ('name', 'email', 'subject', 'body')
+
+
+# Ключи контекста письма, по которым можно сбросить пароль: в очередь
+# не попадают, задача строит их заново.
+TOKEN_CONTEXT = ('user', 'uid', 'token')
+
+
+@task(atomic=False)
+def send_password_reset(user_id, subject_template_name,
+                        email_template_name, context, from_email,
+                        html_email_template_name=None):
+    """Письмо сброса пароля со ссылкой, построенной в воркере."""
+    user = User._default_manager.filter(pk=user_id).first()
+    if user is None:
+        return
+    context = {
+        **context,
+        'user': user,
+        'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+        'token': default_token_generator.make_token(user),
+    }
+    PasswordResetForm().send_mail(
+        subject_template_name, email_template_name, context, from_email,
+        getattr(user, User.get_email_field_name()),
+        html_email_template_name)
+
+
+class QueuedPasswordResetForm(PasswordResetForm):
+    """Письмо сброса пароля отправляется задачей send_password_reset.
+    В очередь идут только id пользователя и имена шаблонов: ссылка
+    с токеном не лежит в таблице задач открытым текстом."""
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email,
+                  html_email_template_name=None):
+        send_password_reset.delay(
+            context['user'].pk, subject_template_name, email_template_name,
+            {key: value for key, value in context.items()
+             if key not in TOKEN_CONTEXT},
+            from_email, html_email_template_name)
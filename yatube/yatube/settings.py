@@ -50,13 +50,18 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы в метрики попало время всех остальных слоёв.
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # 503 вместо 500, пока автор переносится между шардами.
+    'posts.middleware.ShardMovingMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -91,11 +96,65 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # SQLite с WAL, кешем страниц и PRAGMA optimize (core/db/sqlite3).
+        'ENGINE': 'core.db.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Соединение живёт между запросами, а не открывается на каждый.
+        'CONN_MAX_AGE': 600,
     }
 }
 
+# Реплики только для чтения (core.db.routers). Локально: YATUBE_REPLICA=1
+# и manage.py replicate_sqlite --interval 1 рядом с runserver.
+DATABASE_REPLICAS = []
+if os.environ.get('YATUBE_REPLICA'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.path.join(BASE_DIR, 'db_replica.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS = ['replica']
+# Шарды постов и комментариев (posts.sharding); пусто — всё в default.
+# Локально: YATUBE_SHARDS=3 — default и db_shard_1, db_shard_2.sqlite3,
+# для каждого нового шарда manage.py migrate --database shard_N.
+POST_SHARDS = []
+if os.environ.get('YATUBE_SHARDS'):
+    POST_SHARDS = ['default'] + [
+        f'shard_{number}'
+        for number in range(1, int(os.environ['YATUBE_SHARDS']))]
+    for alias in POST_SHARDS[1:]:
+        DATABASES[alias] = {
+            **DATABASES['default'],
+            'NAME': os.path.join(BASE_DIR, f'db_{alias}.sqlite3'),
+        }
+# Номер процесса в id постов (0-1023); None — по pid.
+POST_SHARD_WORKER_ID = None
+# ShardRouter решает только за посты и комментарии, остальное — реплики.
+DATABASE_ROUTERS = ['posts.sharding.ShardRouter',
+                    'core.db.routers.ReplicaRouter']
+
+# Фоновые задачи (core.tasks). По умолчанию выполняются сразу в запросе;
+# с YATUBE_TASK_QUEUE=1 — ставятся в очередь для manage.py run_workers.
+TASKS_EAGER = not os.environ.get('YATUBE_TASK_QUEUE')
+# Секунды, на которые воркер захватывает задачу: если он упал, задачу
+# после этого возьмёт другой.
+TASK_LEASE_SECONDS = 300
+# Маршруты, которые читают с реплик.
+REPLICA_READ_VIEWS = (
+    'posts:index',
+    'posts:group_list',
+    'posts:profile',
+    'posts:post_detail',
+    'posts:follow_index',
+)
+# Сколько секунд после записи в модели этих приложений пользователь
+# читает только из default.
+REPLICA_STICKY_APPS = ('posts', 'auth')
+REPLICA_STICKY_SECONDS = 10
+# Наибольшее отставание реплик: пока поколение кеша страницы моложе,
+# она читается из default, чтобы не закешировать старые данные.
+REPLICA_MAX_LAG_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -156,9 +215,16 @@ PASSWORD_RESET_REDIRECT_URL = 'users:password_reset_done'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Поколения кеша страниц сдвигаются в том процессе, где изменились
+# данные, а видеть их должны все воркеры веб-сервера и run_workers:
+# кеш общий, не LocMemCache. Процессный кеш даёт предупреждение
+# core.W001 в manage.py check.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        # По умолчанию 300: страницы вытесняли бы друг друга.
+        'OPTIONS': {'MAX_ENTRIES': 10000},
     }
 }
 
@@ -166,3 +232,19 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 #  Число страниц
 COUNT_PAGES = 10
+
+
+# Лента подписок: посты авторов, у которых подписчиков больше
+# FEED_FANOUT_LIMIT, не раскладываются по лентам, а читаются напрямую.
+FEED_FANOUT_LIMIT = 1000
+# Сколько последних постов автора попадает в ленту при подписке.
+FEED_BACKFILL_SIZE = 1000
+
+# SQL-запросы дольше SLOW_QUERY_MS миллисекунд записываются с планом
+# в журнал медленных запросов (последние SLOW_QUERY_LOG_SIZE записей).
+SLOW_QUERY_MS = 200
+SLOW_QUERY_LOG_SIZE = 100
+
+# Потоки, в которых после загрузки готовятся миниатюры картинок постов;
+# 0 — готовить синхронно после коммита.
+THUMBNAIL_WORKERS = 2
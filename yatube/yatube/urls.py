@@ -3,13 +3,18 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from core.views import prometheus_metrics, slow_query_log
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('posts.urls', namespace="posts")),
+    path('api/v1/', include('posts.api_urls', namespace="api")),
     path('auth/', include('users.urls', namespace="users")),
     path('auth/', include('django.contrib.auth.urls')),
     path('about/', include("about.urls", namespace="about")),
+    path('metrics', prometheus_metrics, name='metrics'),
+    path('slow-queries/', slow_query_log, name='slow_queries'),
 ]
 
 handler404 = 'core.views.page_not_found'